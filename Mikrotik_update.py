@@ -1,7 +1,24 @@
 import paramiko
+import argparse
+import functools
+import hashlib
+import inspect
+import json
 import logging
+import math
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import threading
 import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
 from conf import HOSTS, USER, PASSWD, PORT
+from routeros import PackageUpdate, Resource, Routerboard, RouterOSVersion, parse_version
 
 # Mikrotik commands
 mikrotik = {'version check': 'system package update print',
@@ -9,13 +26,51 @@ mikrotik = {'version check': 'system package update print',
            'firmware upgrade': 'system routerboard upgrade',
            'update check': 'system package update check-for-updates',
            'update download': 'system package update download',
+           'resource': 'system resource print',
            'disable ssh': 'ip service disable ssh',
            'system reboot': 'system reboot'}
 
+# Printed between commands of one batch to split their output
+BATCH_MARKER = '#--mikrotik-update-batch--#'
+
+# Waiting for a router to come back after reboot, seconds. Deadlines are 
+# matched by board model prefix, slow CCRs get more time than small hEX
+REBOOT_DEADLINES = {'CCR': 600,
+                    'CRS': 420,
+                    'RB760iGS': 180,
+                    'default': 300}
+# A router still up this long after reboot is reported as slow to shut down. 
+# From then on its uptime is read every REBOOT_GOING_DOWN seconds, a reboot 
+# too short to fall between two port polls shows up as a reset uptime. 
+# REBOOT_POLL is the pause between polls, not the connect timeout: a short 
+# timeout would take a slow handshake for a router that went down
+REBOOT_GOING_DOWN = 15
+REBOOT_POLL = 0.2
+PROBE_DELAY = 1
+PROBE_MAX_DELAY = 15
+REBOOT_TIMES_FILE = 'logs/reboot_times.json'
+INVENTORY_FILE = 'inventory.db'
+JOURNAL_FILE = 'logs/journal.jsonl'
+TELEMETRY_FILE = 'logs/telemetry.jsonl'
+
+# Allowed host state transitions during a run, every host starts from None
+TRANSITIONS = {None: ('connected', 'failed'),
+               'connected': ('checked', 'failed'),
+               'checked': ('downloaded', 'verified', 'failed'),
+               'downloaded': ('rebooting', 'failed'),
+               'rebooting': ('verified', 'failed'),
+               'verified': (),
+               'failed': ()}
+
+# Local package mirror: latest version per channel and the package files
+MIRROR_DIR = 'packages'
+NEWEST_URL = 'https://upgrade.mikrotik.com/routeros/NEWEST{major}.{channel}'
+PACKAGE_URL = 'https://download.mikrotik.com/routeros/{version}/{name}'
+
 # Logging conf
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s;%(levelname)s;%(message)s",
+    format="%(asctime)s;%(levelname)s;%(threadName)s;%(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
     handlers=[
         logging.FileHandler("logs/info.log", encoding='utf8'),
@@ -24,6 +79,149 @@ logging.basicConfig(
 )
 
 
+class Span():
+    '''
+    One timed phase of one host
+    '''
+    def __init__(self, host, phase):
+        self.host = host
+        self.phase = phase
+        self.outcome = 'ok'
+        self.error = None
+
+    def fail(self, error=None):
+        self.outcome = 'failed'
+        if error is not None:
+            self.error = error if isinstance(error, str) else type(error).__name__
+
+
+class Telemetry():
+    '''
+    Timing spans of every host phase, written as json lines with host, phase, 
+    duration, outcome and error class to TELEMETRY_FILE and summarised at 
+    the end of the run
+    '''
+    def __init__(self, path=TELEMETRY_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.records = []
+
+    @contextmanager
+    def span(self, host, phase):
+        span = Span(host, phase)
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(span)
+        started = time.time()
+        begin = time.perf_counter()
+        try:
+            yield span
+        except Exception as err:
+            span.outcome = 'error'
+            span.error = type(err).__name__
+            raise
+        finally:
+            stack.pop()
+            self.write({'run': journal.run, 'time': round(started, 3), 'host': host, 'phase': phase,
+                        'duration': round(time.perf_counter() - begin, 4), 'outcome': span.outcome,
+                        'error': span.error})
+
+    def fail(self, error=None):
+        '''
+        Mark the innermost open span of this thread as failed
+        '''
+        stack = self.local.__dict__.get('stack')
+        if stack:
+            stack[-1].fail(error)
+
+    def call(self, host, phase, func, *args):
+        with self.span(host, phase) as span:
+            result = func(*args)
+            if not result:
+                span.fail()
+            return result
+
+    def write(self, record):
+        with self.lock:
+            self.records.append(record)
+            with open(self.path, 'a', encoding='utf8') as fh:
+                fh.write(json.dumps(record) + '\n')
+
+    def summary(self, slowest=5):
+        '''
+        Log p50/p95/max and failures per phase and the slowest hosts of the 
+        run, and append the same as a summary record
+        '''
+        with self.lock:
+            records = list(self.records)
+        phases = {}
+        for record in records:
+            phases.setdefault(record['phase'], []).append(record)
+        summary = {'run': journal.run, 'phase': 'summary', 'phases': {}, 'slowest': []}
+        for phase, items in phases.items():
+            durations = sorted(item['duration'] for item in items)
+            errors = {}
+            for item in items:
+                if item['error']:
+                    errors[item['error']] = errors.get(item['error'], 0) + 1
+            stats = {'count': len(items), 'failed': sum(item['outcome'] != 'ok' for item in items),
+                     'p50': percentile(durations, 50), 'p95': percentile(durations, 95),
+                     'max': durations[-1], 'errors': errors}
+            summary['phases'][phase] = stats
+            logging.info(f'telemetry {phase}: {stats["count"]} spans, {stats["failed"]} failed, '
+                         f'p50 {stats["p50"]:.2f}s, p95 {stats["p95"]:.2f}s, max {stats["max"]:.2f}s'
+                         + (f', errors {errors}' if errors else ''))
+        totals = sorted(phases.get('host', []), key=lambda item: item['duration'], reverse=True)[:slowest]
+        for item in totals:
+            summary['slowest'].append({'host': item['host'], 'duration': item['duration']})
+            logging.info(f'telemetry slow host {item["host"]}: {item["duration"]:.1f}s, {item["outcome"]}')
+        self.write(summary)
+        return summary
+
+
+def percentile(values, percent):
+    '''
+    Nearest-rank percentile of sorted values
+    '''
+    if not values:
+        return None
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+telemetry = Telemetry()
+
+
+def timed(phase, falsy_fails=True):
+    '''
+    Run the function in a telemetry span of its `ip` argument. A falsy 
+    result marks the span failed unless falsy_fails is False
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            ip = signature.bind(*args, **kwargs).arguments['ip']
+            with telemetry.span(ip, phase) as span:
+                result = func(*args, **kwargs)
+                if falsy_fails and not result:
+                    span.fail()
+                return result
+        return wrapper
+    return decorator
+
+
+def split_host(host, port=PORT):
+    '''
+    HOSTS entries are an ip or "ip:port" for routers with ssh on another port
+    '''
+    ip, sep, host_port = host.rpartition(':')
+    if sep and host_port.isdigit():
+        return ip, int(host_port)
+    return host, port
+
+
+@timed('connect')
 def create_ssh_connect(ip, port=PORT, user=USER, passwd=PASSWD):
     '''
     Try to establish ssh connection
@@ -31,128 +229,185 @@ def create_ssh_connect(ip, port=PORT, user=USER, passwd=PASSWD):
     try:
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(ip, PORT, USER, SECRET)
+        client.connect(*split_host(ip, port), user, passwd)
         return client
-    except TimeoutError:
+    except TimeoutError as err:
         logging.error(f'{ip} TimeoutError')
+        telemetry.fail(err)
         return False
-    except paramiko.ssh_exception.NoValidConnectionsError:
+    except paramiko.ssh_exception.NoValidConnectionsError as err:
         logging.error(f'{ip} SSH not enable')
+        telemetry.fail(err)
         return False
     except Exception as err:
         logging.error(f'{ip} create_ssh_connect() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
+class RouterSession():
+    '''
+    One ssh connection to a router that is kept open for every command 
+    of a pass. Behaves like paramiko.SSHClient for exec_command(), so the 
+    check functions below accept either
+    '''
+    def __init__(self, ip, port=PORT, user=USER, passwd=PASSWD):
+        self.ip = ip
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.client = None
+
+    def __enter__(self):
+        if not self.client:
+            self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __bool__(self):
+        return bool(self.client)
+
+    def open(self):
+        self.client = create_ssh_connect(self.ip, self.port, self.user, self.passwd)
+        return self
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    def exec_command(self, command):
+        return self.client.exec_command(command)
+
+    def open_sftp(self):
+        return self.client.open_sftp()
+
+    def run(self, command):
+        stdin, stdout, stderr = self.client.exec_command(command)
+        return stdout.read().decode('utf8')
+
+    def run_batch(self, *names):
+        '''
+        Run several mikrotik commands in one exec_command round trip. RouterOS 
+        accepts ';' separated commands, a :put marker between them lets us 
+        split the output back. Return {name: output}
+        '''
+        separator = f'; :put "{BATCH_MARKER}"; '
+        script = separator.join('/' + mikrotik[name] for name in names)
+        parts = self.run(script).split(BATCH_MARKER)
+        if len(parts) != len(names):
+            raise ValueError(f'batch output has {len(parts)} parts for {len(names)} commands')
+        return {name: part.strip('\r\n') for name, part in zip(names, parts)}
+
+
+@timed('version check')
 def version_check(ssh, ip):
     '''
     Check version before update
     '''
     try:
         stdin, stdout, stderr = ssh.exec_command(mikrotik['version check'])
-        version = stdout.read().decode().split()[3]
+        version = PackageUpdate.from_output(stdout.read().decode()).installed_version
         return version
     except Exception as err:
         logging.error(f'{ip} version_check() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
-def version_check_after_update(ip, oldversion):
+def version_check_after_update(ip, oldversion, model=None):
     '''
-    After the update, try to establish ssh connection 
-    and compare versions within three attempts
+    After the update, wait for the router to come back 
+    and compare versions
     '''
-    for attempt in range(3):
-        ssh = create_ssh_connect(ip)
-        
-        if ssh:
-            stdin, stdout, stderr = ssh.exec_command(mikrotik['version check'])
-            data = stdout.read()
-            newversion = data.decode("utf8").split()[3]
-            
-            if oldversion:
-                if newversion > oldversion:
-                    logging.info(f'{ip} newversion: {newversion}')
-                elif oldversion == newversion:
-                    logging.info(f'{ip} the latest update is installed: {oldversion} == {newversion}')
-                else:
-                    logging.error(f'{ip} error check after update [oldversion={oldversion} | newversion={newversion}]')
-                ssh.close()
-                return True
-            else:
-                logging.error(f'{ip} not old version')
-            
-            ssh.close()
-            return
+    ssh = reconnect_after_reboot(ip, model)
+    if not ssh:
+        logging.error(f'{ip} can\'t connect after update')
+        return False
+
+    with ssh, telemetry.span(ip, 'verify'):
+        update = PackageUpdate.from_output(ssh.run(mikrotik['version check']))
+    inventory.remember(ip, update)
+    newversion = update.installed_version
+    if oldversion and newversion:
+        if newversion > oldversion:
+            logging.info(f'{ip} newversion: {newversion}')
+        elif oldversion == newversion:
+            logging.info(f'{ip} the latest update is installed: {oldversion} == {newversion}')
         else:
-            time.sleep(20)
-    
-    logging.error(f'{ip} can\'t connect after update')
+            logging.error(f'{ip} error check after update [oldversion={oldversion} | newversion={newversion}]')
+            return False
+        return True
+    logging.error(f'{ip} not old version')
     return False
 
 
+@timed('firmware check')
 def firmware_check(ssh, ip):
     '''
-    Check firmware before update
+    Check firmware before update, return Routerboard record
     '''
     try:
         stdin, stdout, stderr = ssh.exec_command(mikrotik['firmware check'])
-        data = stdout.read().decode('utf8').split()
+        data = Routerboard.from_output(stdout.read().decode('utf8'))
         return data
     except Exception as err:
         logging.error(f'{ip} firmware_check() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
-def firmware_upgrade(ssh, ip):
+@timed('firmware upgrade')
+def firmware_upgrade(ssh, ip, reboot=True):
     try:
         stdin, stdout, stderr = ssh.exec_command(mikrotik['firmware upgrade'])
         data = stdout.read()
         if data == b'':
-            logging.info(f'{ip} Upgrade success, send to reboot')
-            ssh.exec_command(mikrotik['system reboot'])
+            if reboot:
+                logging.info(f'{ip} Upgrade success, send to reboot')
+                ssh.exec_command(mikrotik['system reboot'])
+            else:
+                logging.info(f'{ip} Upgrade success, waiting for reboot')
             return True
         else:
             logging.error(f'{ip} firmware_upgrade() unknown error [{data.decode("utf8")}]')
             return False
     except Exception as err:
         logging.error(f'{ip} firmware_upgrade() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
-def firmware_check_after_upgrade(ip, oldversion):
+def firmware_check_after_upgrade(ip, oldversion, model=None):
     '''
-    After the upgrade, try to establish ssh connection 
-    and compare firmware within three attempts
+    After the upgrade, wait for the router to come back 
+    and compare firmware
     '''
-    for attempt in range(3):
-        ssh = create_ssh_connect(ip)
-        
-        if ssh:
-            stdin, stdout, stderr = ssh.exec_command(mikrotik['firmware check'])
-            data = stdout.read()
-            newversion = data.decode("utf8").split()[15]
+    ssh = reconnect_after_reboot(ip, model)
+    if not ssh:
+        logging.error(f'{ip} can\'t connect after upgrade')
+        return False
 
-            if oldversion:
-                if newversion > oldversion:
-                    logging.info(f'{ip} newversion: {newversion}')
-                elif oldversion == newversion:
-                    logging.info(f'{ip} the latest update is installed: {oldversion} == {newversion}')
-                else:
-                    logging.error(f'{ip} error check after upgrade firmware [oldversion={oldversion} | newversion={newversion}]')
-                ssh.close()
-                return
-            else:
-                logging.error(f'{ip} not old firmware')
-            
-            ssh.close()
-            return
+    with ssh, telemetry.span(ip, 'verify'):
+        routerboard = Routerboard.from_output(ssh.run(mikrotik['firmware check']))
+    inventory.remember(ip, routerboard=routerboard)
+    newversion = routerboard.current_firmware
+    if oldversion and newversion:
+        if newversion > oldversion:
+            logging.info(f'{ip} newversion: {newversion}')
+        elif oldversion == newversion:
+            logging.info(f'{ip} the latest update is installed: {oldversion} == {newversion}')
         else:
-            time.sleep(20)
-    logging.error(f'{ip} can\'t connect after upgrade')
+            logging.error(f'{ip} error check after upgrade firmware [oldversion={oldversion} | newversion={newversion}]')
+            return False
+        return True
+    logging.error(f'{ip} not old firmware')
     return False
 
 
+@timed('update check', falsy_fails=False)
 def update_check(ssh, ip):
     '''
     Check the update, if the response contains 'New version is available' then 
@@ -161,8 +416,8 @@ def update_check(ssh, ip):
     '''
     try:
         stdin, stdout, stderr = ssh.exec_command(mikrotik['update check'])
-        data = stdout.read()
-        if b'status: New version is available' in data:
+        data = PackageUpdate.from_output(stdout.read().decode('utf8'))
+        if data.update_available:
             logging.info(f'{ip} New version is available')
             return True
         else:
@@ -170,70 +425,848 @@ def update_check(ssh, ip):
             return False
     except Exception as err:
         logging.error(f'{ip} update_check() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
-def update_download(ssh, ip):
+@timed('download')
+def update_download(ssh, ip, reboot=True):
     '''
     Download the update, if it succeeds, then we reboot the router to install. 
     Otherwise, check the error lack of download space or something else. 
-    Return True or False. 
+    Return True or False. With reboot=False the caller sends the reboot 
+    itself, e.g. after also scheduling a firmware upgrade
     '''
     try:
         stdin, stdout, stderr = ssh.exec_command(mikrotik['update download'])
         data = stdout.read()
         if b'status: Downloaded, please reboot router to upgrade it' in data:
             logging.info(f'{ip} update downloaded, reboot router for upgrade')
-            ssh.exec_command(mikrotik['system reboot'])
-            logging.info(f'{ip} send reboot')
+            if reboot:
+                ssh.exec_command(mikrotik['system reboot'])
+                logging.info(f'{ip} send reboot')
             return True
         elif b'ERROR: not enough disk space' in data:
             logging.error(f'{ip} not enough disk space')
+            telemetry.fail('NotEnoughDiskSpace')
             return False
         else:
             logging.error(f'{ip} not download upgrade')
             return False
     except Exception as err:
         logging.error(f'{ip} update_download() unknown error [{str(err)}]')
+        telemetry.fail(err)
         return False
 
 
-def version_update_all_mikrotik(hosts=HOSTS):
-    for ip in hosts:
-        ssh = create_ssh_connect(ip)
-        if ssh:
-            logging.info(f'{ip} Connect success')
-            version = version_check(ssh, ip)
-            logging.info(f'{ip} version = {version}')
-            if update_check(ssh, ip):
-                if update_download(ssh, ip):
-                    time.sleep(20)
-                    version_check_after_update(ip, version)
+class RebootTimes():
+    '''
+    Reboot durations per host, kept in REBOOT_TIMES_FILE between runs, used 
+    to predict how long the next reboot of a host or model will take
+    '''
+    def __init__(self, path=REBOOT_TIMES_FILE, keep=10):
+        self.path = Path(path)
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.hosts = {}
+        if self.path.is_file():
+            with open(self.path, encoding='utf8') as fh:
+                self.hosts = json.load(fh)
+
+    def add(self, ip, model, duration):
+        with self.lock:
+            host = self.hosts.setdefault(ip, {'model': model, 'durations': []})
+            host['model'] = model or host['model']
+            host['durations'] = (host['durations'] + [round(duration, 1)])[-self.keep:]
+            with open(self.path, 'w', encoding='utf8') as fh:
+                json.dump(self.hosts, fh, indent=4)
+
+    def predict(self, ip, model=None):
+        '''
+        Median reboot time of the host, or of hosts of the same model, 
+        or None if there is no history yet
+        '''
+        with self.lock:
+            durations = self.hosts.get(ip, {}).get('durations')
+            if not durations and model:
+                durations = [duration for host in self.hosts.values() if host['model'] == model
+                             for duration in host['durations']]
+        return statistics.median(durations) if durations else None
+
+
+reboot_times = RebootTimes()
+
+
+class Inventory():
+    '''
+    Last known state of every host: model, version, firmware, when it was 
+    last seen and how its last run ended. Kept in INVENTORY_FILE, shared 
+    by the worker threads. The file is opened on first use, not on import
+    '''
+    columns = ('ip', 'model', 'version', 'latest_version', 'firmware',
+               'upgrade_firmware', 'last_seen', 'last_result')
+
+    def __init__(self, path=INVENTORY_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def open(self):
+        '''
+        The connection, opened on the first call. Call with the lock held
+        '''
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('''create table if not exists hosts (
+                ip text primary key,
+                model text,
+                version text,
+                latest_version text,
+                firmware text,
+                upgrade_firmware text,
+                last_seen real,
+                last_result text)''')
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def update(self, ip, **values):
+        values = {key: value if isinstance(value, (int, float)) else str(value)
+                  for key, value in values.items() if value is not None}
+        names = ', '.join(['ip', *values])
+        marks = ', '.join('?' * (len(values) + 1))
+        updates = ', '.join(f'{name} = excluded.{name}' for name in values) or 'ip = ip'
+        query = f'insert into hosts ({names}) values ({marks}) on conflict(ip) do update set {updates}'
+        with self.lock:
+            conn = self.open()
+            conn.execute(query, (ip, *values.values()))
+            conn.commit()
+
+    def remember(self, ip, update=None, routerboard=None):
+        '''
+        Store what a check has just seen on the host
+        '''
+        values = {'last_seen': time.time()}
+        if update:
+            values.update(version=update.installed_version, latest_version=update.latest_version)
+        if routerboard:
+            values.update(model=routerboard.model, firmware=routerboard.current_firmware,
+                          upgrade_firmware=routerboard.upgrade_firmware)
+        self.update(ip, **values)
+
+    def hosts(self):
+        with self.lock:
+            return [dict(row) for row in self.open().execute('select * from hosts order by ip')]
+
+    def get(self, ip):
+        with self.lock:
+            row = self.open().execute('select * from hosts where ip = ?', (ip,)).fetchone()
+        return dict(row) if row else None
+
+    def is_current(self, ip, ttl):
+        '''
+        True if the host was seen less than ttl seconds ago, its last run 
+        succeeded and it had the latest version and firmware
+        '''
+        host = self.get(ip)
+        if not host or not host['last_seen'] or host['last_result'] != 'ok':
+            return False
+        if time.time() - host['last_seen'] > ttl:
+            return False
+        version, latest = parse_version(host['version']), parse_version(host['latest_version'])
+        if not version or (latest and latest > version):
+            return False
+        return host['firmware'] == host['upgrade_firmware']
 
 
-def firmware_upgrade_all_mikrotik(hosts=HOSTS):
+inventory = Inventory()
+
+
+class Journal():
+    '''
+    Append-only record of host state transitions, one json line per 
+    transition in JOURNAL_FILE, synced to disk before the next step starts. 
+    An interrupted run can be resumed from the last state of each host
+    '''
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.run = time.strftime('%Y%m%d-%H%M%S')
+        self.states = {}
+
+    def state(self, ip):
+        with self.lock:
+            return self.states.get(ip, {}).get('state')
+
+    def transition(self, ip, state, **details):
+        with self.lock:
+            current = self.states.get(ip, {}).get('state')
+            if state not in TRANSITIONS[current]:
+                raise ValueError(f'{ip} invalid state transition {current} -> {state}')
+            entry = {'run': self.run, 'time': time.time(), 'host': ip, 'state': state}
+            entry.update({key: str(value) for key, value in details.items() if value is not None})
+            with open(self.path, 'a', encoding='utf8') as fh:
+                fh.write(json.dumps(entry) + '\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+            self.states[ip] = entry
+
+    def finish(self, ip, ok):
+        self.transition(ip, 'verified' if ok else 'failed')
+
+    def restart(self, ip):
+        '''
+        Forget the state of a host that starts over in this run
+        '''
+        with self.lock:
+            self.states.pop(ip, None)
+
+    def resume(self):
+        '''
+        Continue the last run of the journal: load the last state of each 
+        host and append to the same run. Return {ip: last entry}
+        '''
+        entries = []
+        if self.path.is_file():
+            with open(self.path, encoding='utf8') as fh:
+                for line in fh:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # a line cut short by the interruption
+                        continue
+        with self.lock:
+            if entries:
+                self.run = entries[-1]['run']
+            self.states = {entry['host']: entry for entry in entries if entry['run'] == self.run}
+            return dict(self.states)
+
+
+journal = Journal()
+
+
+def reboot_deadline(model):
+    for prefix, deadline in REBOOT_DEADLINES.items():
+        if model and model.startswith(prefix):
+            return deadline
+    return REBOOT_DEADLINES['default']
+
+
+def port_is_open(ip, port=PORT, timeout=1):
+    '''
+    Cheap reachability probe: a TCP handshake to the ssh port, no login
+    '''
+    try:
+        with socket.create_connection(split_host(ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+@timed('reboot wait')
+def reconnect_after_reboot(ip, model=None, port=PORT, resumed=False):
+    '''
+    Call right after sending reboot. Wait until the ssh port goes down, sleep 
+    part of the predicted reboot time, then probe the port with jittered 
+    exponential backoff until the model deadline. A full login is tried only 
+    once the port answers. While the port stays up the router is asked for 
+    its uptime now and then: a reboot too short to see the port go down 
+    shows up as an uptime below the time since the call. Return an open 
+    RouterSession or None, also when the router never rebooted: logging in 
+    then would only reach it before its reboot. A resumed run does not know 
+    when the reboot was sent, so it starts probing at once
+    '''
+    started = time.monotonic()
+    deadline = started + reboot_deadline(model)
+    confirm_at = started + REBOOT_GOING_DOWN
+    while not resumed and port_is_open(ip, port):
+        now = time.monotonic()
+        if now >= confirm_at or now >= deadline:
+            if confirm_at == started + REBOOT_GOING_DOWN:
+                logging.warning(f'{ip} still up {REBOOT_GOING_DOWN}s after reboot, checking its uptime')
+            ssh = rebooted_since(ip, port, now - started)
+            if ssh:
+                logging.info(f'{ip} back after reboot, uptime reset before the ssh port was seen down')
+                return ssh
+            if time.monotonic() >= deadline:
+                logging.error(f'{ip} did not reboot, ssh port still up and uptime not reset')
+                return None
+            confirm_at += REBOOT_GOING_DOWN
+        time.sleep(REBOOT_POLL)
+
+    predicted = reboot_times.predict(ip, model)
+    if predicted and not resumed:
+        time.sleep(max(0, min(predicted * 0.8 - (time.monotonic() - started), deadline - time.monotonic())))
+
+    delay = PROBE_DELAY
+    while time.monotonic() < deadline:
+        if port_is_open(ip, port):
+            ssh = RouterSession(ip, port).open()
+            if ssh:
+                duration = time.monotonic() - started
+                logging.info(f'{ip} back after reboot in {duration:.1f}s')
+                if not resumed:
+                    reboot_times.add(ip, model, duration)
+                return ssh
+        time.sleep(min(delay * random.uniform(0.5, 1), max(0, deadline - time.monotonic())))
+        delay = min(delay * 2, PROBE_MAX_DELAY)
+    return None
+
+
+def rebooted_since(ip, port, seconds):
+    '''
+    Log in and read the uptime. Return the open RouterSession if the router 
+    booted less than `seconds` ago, otherwise close it and return None
+    '''
+    ssh = RouterSession(ip, port).open()
+    if not ssh:
+        return None
+    try:
+        uptime = Resource.from_output(ssh.run(mikrotik['resource'])).uptime_seconds
+    except Exception as err:
+        logging.warning(f'{ip} can\'t read uptime [{str(err)}]')
+        uptime = None
+    if uptime is not None and uptime < seconds:
+        return ssh
+    ssh.close()
+    return None
+
+
+def package_name(version, arch):
+    '''
+    File name of the main RouterOS package on download.mikrotik.com
+    '''
+    if version.major < 7:
+        return f'routeros-{arch}-{version}.npk'
+    if arch == 'x86_64':
+        return f'routeros-{version}.npk'
+    return f'routeros-{version}-{arch}.npk'
+
+
+class PackageMirror():
+    '''
+    Local content-addressed cache of RouterOS packages. Each (version, arch) 
+    package is fetched from MikroTik once, stored as sha256/<digest> and 
+    pushed to the routers from here, so the uplink carries it once per run 
+    instead of once per router
+    '''
+    def __init__(self, path=MIRROR_DIR):
+        self.path = Path(path)
+        (self.path / 'sha256').mkdir(parents=True, exist_ok=True)
+        self.index_file = self.path / 'index.json'
+        self.index = {}
+        if self.index_file.is_file():
+            with open(self.index_file, encoding='utf8') as fh:
+                self.index = json.load(fh)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.newest = {}
+        self.verified = set()
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def target_version(self, channel, installed):
+        '''
+        Newest version of the channel for the installed major version, 
+        asked from MikroTik once per run
+        '''
+        major = '6' if installed.major < 7 else 'a7'
+        url = NEWEST_URL.format(major=major, channel=channel)
+        with self.key_lock(url):
+            if url not in self.newest:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    self.newest[url] = RouterOSVersion.parse(response.read().decode().split()[0])
+                logging.info(f'mirror newest {channel} version is {self.newest[url]}')
+        return self.newest[url]
+
+    def package(self, version, arch):
+        '''
+        Return (path, name, sha256) of the package, fetching it on first use. 
+        A cached file is re-hashed once per run before it is handed out
+        '''
+        name = package_name(version, arch)
+        with self.key_lock(name):
+            entry = self.index.get(name)
+            if entry:
+                path = self.path / 'sha256' / entry['sha256']
+                if name not in self.verified and (not path.is_file() or file_sha256(path) != entry['sha256']):
+                    logging.error(f'mirror {name} is missing or corrupted, fetching again')
+                    entry = None
+            if not entry:
+                entry = self.fetch(version, name)
+            self.verified.add(name)
+        return self.path / 'sha256' / entry['sha256'], name, entry['sha256']
+
+    def fetch(self, version, name):
+        url = PACKAGE_URL.format(version=version, name=name)
+        logging.info(f'mirror fetching {url}')
+        digest = hashlib.sha256()
+        temp = self.path / f'{name}.part'
+        with urllib.request.urlopen(url, timeout=60) as response, open(temp, 'wb') as fh:
+            for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                digest.update(chunk)
+                fh.write(chunk)
+        entry = {'sha256': digest.hexdigest(), 'size': temp.stat().st_size, 'url': url}
+        temp.replace(self.path / 'sha256' / entry['sha256'])
+        with self.lock:
+            self.index[name] = entry
+            with open(self.index_file, 'w', encoding='utf8') as fh:
+                json.dump(self.index, fh, indent=4)
+        logging.info(f'mirror stored {name} sha256={entry["sha256"]} size={entry["size"]}')
+        return entry
+
+
+def file_sha256(path, sftp=None):
+    digest = hashlib.sha256()
+    fh = sftp.open(path, 'rb') if sftp else open(path, 'rb')
+    with fh:
+        if sftp:
+            fh.prefetch()
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@timed('upload')
+def package_upload(ssh, ip, mirror, version, resource):
+    '''
+    Push the package for the router architecture from the mirror over sftp 
+    on the open session and verify it by reading back its sha256. RouterOS 
+    installs it on the next reboot. Return True or False
+    '''
+    try:
+        path, name, sha256 = mirror.package(version, resource.architecture_name)
+        size = path.stat().st_size
+        if resource.free_space is not None and resource.free_space < size:
+            logging.error(f'{ip} not enough disk space for {name} [{resource.free_hdd_space} free]')
+            telemetry.fail('NotEnoughDiskSpace')
+            return False
+        with ssh.open_sftp() as sftp:
+            sftp.put(str(path), name)
+            if sftp.stat(name).st_size != size or file_sha256(name, sftp) != sha256:
+                logging.error(f'{ip} {name} checksum mismatch after upload')
+                telemetry.fail('ChecksumMismatch')
+                sftp.remove(name)
+                return False
+        logging.info(f'{ip} {name} uploaded, reboot router for upgrade')
+        return True
+    except Exception as err:
+        logging.error(f'{ip} package_upload() unknown error [{str(err)}]')
+        telemetry.fail(err)
+        return False
+
+
+def version_update_mikrotik(ip):
+    '''
+    Update RouterOS on one host. Return True if the host is up to date 
+    afterwards, False if any step failed
+    '''
+    with RouterSession(ip) as ssh:
+        if not ssh:
+            return False
+        logging.info(f'{ip} Connect success')
+        journal.transition(ip, 'connected')
+        version = version_check(ssh, ip)
+        logging.info(f'{ip} version = {version}')
+        inventory.remember(ip, PackageUpdate(installed_version=version or None))
+        need_update = update_check(ssh, ip)
+        journal.transition(ip, 'checked', version=version)
+        if not need_update:
+            return True
+        if not update_download(ssh, ip, reboot=False):
+            return False
+        journal.transition(ip, 'downloaded')
+        journal.transition(ip, 'rebooting', version=version)
+        ssh.exec_command(mikrotik['system reboot'])
+        logging.info(f'{ip} send reboot')
+    return version_check_after_update(ip, version)
+
+
+def firmware_upgrade_mikrotik(ip):
     '''
     Let's check the difference between the Routerboard firmware version, 
     if the upgrade and reboot are different. After rebooting, check the version.
     '''
-    for ip in hosts:
-        try:
-            ssh = create_ssh_connect(ip)
-            if ssh:
-                data = firmware_check(ssh, ip)
-                if data:
-                    if data[15] != data[17]:
-                        oldversion = data[15]
-                        logging.info(f'{ip} firmware need upgrade')
-                        if firmware_upgrade(ssh, ip):
-                            time.sleep(20)
-                            firmware_check_after_upgrade(ip, oldversion)
-                    elif data[15] == data[17]:
-                        logging.info(f'{ip} firmware is already up to date')
-        except Exception as err:
-            logging.error(f'{ip} firmware_upgrade_all_mikrotik() unknown error [{str(err)}]')
+    try:
+        with RouterSession(ip) as ssh:
+            if not ssh:
+                return False
+            journal.transition(ip, 'connected')
+            data = firmware_check(ssh, ip)
+            if not data:
+                return False
+            inventory.remember(ip, routerboard=data)
+            journal.transition(ip, 'checked', firmware=data.current_firmware, model=data.model)
+            if not data.upgrade_needed:
+                logging.info(f'{ip} firmware is already up to date')
+                return True
+            logging.info(f'{ip} firmware need upgrade')
+            if not firmware_upgrade(ssh, ip, reboot=False):
+                return False
+            journal.transition(ip, 'downloaded')
+            journal.transition(ip, 'rebooting', firmware=data.current_firmware, model=data.model)
+            ssh.exec_command(mikrotik['system reboot'])
+            logging.info(f'{ip} send reboot')
+        return firmware_check_after_upgrade(ip, data.current_firmware, data.model)
+    except Exception as err:
+        logging.error(f'{ip} firmware_upgrade_mikrotik() unknown error [{str(err)}]')
+        return False
+
+
+def update_mikrotik(ip, mirror=None):
+    '''
+    Update RouterOS and routerboard firmware in one pass: one ssh session for 
+    all checks, one batched round trip for them, and a single reboot that 
+    installs the downloaded package and applies the pending firmware. 
+    Firmware bundled with the new package is picked up on the next run. 
+    With a PackageMirror the router does not download anything itself, 
+    the package is uploaded from the mirror
+    '''
+    try:
+        with RouterSession(ip) as ssh:
+            if not ssh:
+                return False
+            logging.info(f'{ip} Connect success')
+            journal.transition(ip, 'connected')
+            with telemetry.span(ip, 'check'):
+                if mirror:
+                    data = ssh.run_batch('version check', 'firmware check', 'resource')
+                    update = PackageUpdate.from_output(data['version check'])
+                    update.latest_version = mirror.target_version(update.channel, update.installed_version)
+                else:
+                    data = ssh.run_batch('update check', 'version check', 'firmware check')
+                    update = PackageUpdate.from_output(data['update check'])
+            routerboard = Routerboard.from_output(data['firmware check'])
+            version = PackageUpdate.from_output(data['version check']).installed_version
+            firmware = routerboard.current_firmware
+            model = routerboard.model
+            logging.info(f'{ip} version = {version}, firmware = {firmware}')
+            inventory.remember(ip, update, routerboard)
+            journal.transition(ip, 'checked', version=version, firmware=firmware, model=model)
+
+            need_update = update.update_available
+            need_firmware = routerboard.upgrade_needed
+            logging.info(f'{ip} New version is {"" if need_update else "not "}available')
+            if need_firmware:
+                logging.info(f'{ip} firmware need upgrade')
+            if not need_update and not need_firmware:
+                return True
+
+            if need_firmware and not firmware_upgrade(ssh, ip, reboot=False):
+                return False
+            if mirror:
+                resource = Resource.from_output(data['resource'])
+                downloaded = need_update and package_upload(ssh, ip, mirror, update.latest_version, resource)
+            else:
+                downloaded = need_update and update_download(ssh, ip, reboot=False)
+            if need_update and not downloaded and not need_firmware:
+                return False
+            journal.transition(ip, 'downloaded')
+            journal.transition(ip, 'rebooting', version=version if downloaded else None,
+                               firmware=firmware if need_firmware else None, model=model,
+                               updated=bool(downloaded) or None)
+            ssh.exec_command(mikrotik['system reboot'])
+            logging.info(f'{ip} send reboot')
+        result = check_after_reboot(ip, version if downloaded else None,
+                                    firmware if need_firmware else None, model, updated=bool(downloaded))
+        return result and (downloaded or not need_update)
+    except Exception as err:
+        logging.error(f'{ip} update_mikrotik() unknown error [{str(err)}]')
+        return False
+
+
+def check_after_reboot(ip, oldversion=None, oldfirmware=None, model=None, resumed=False, updated=None):
+    '''
+    After the reboot, wait for the router to come back and compare version 
+    and firmware in one batched round trip. Only the parts that were 
+    updated (old value is not None) are checked. An update of a package 
+    whose old version could not be read (`updated` without `oldversion`) 
+    can't be verified and fails
+    '''
+    if updated is None:
+        updated = oldversion is not None
+    ssh = reconnect_after_reboot(ip, model, resumed=resumed)
+    if not ssh:
+        logging.error(f'{ip} can\'t connect after reboot')
+        return False
+
+    with ssh, telemetry.span(ip, 'verify'):
+        data = ssh.run_batch('version check', 'firmware check')
+    inventory.remember(ip, PackageUpdate.from_output(data['version check']),
+                       Routerboard.from_output(data['firmware check']))
+    result = True
+    if updated and oldversion is None:
+        logging.error(f'{ip} old version unknown, can\'t verify the update')
+        result = False
+    elif oldversion is not None:
+        newversion = PackageUpdate.from_output(data['version check']).installed_version
+        if newversion and newversion > oldversion:
+            logging.info(f'{ip} newversion: {newversion}')
+        else:
+            logging.error(f'{ip} error check after update [oldversion={oldversion} | newversion={newversion}]')
+            result = False
+    if oldfirmware is not None:
+        newfirmware = Routerboard.from_output(data['firmware check']).current_firmware
+        if newfirmware and newfirmware > oldfirmware:
+            logging.info(f'{ip} newfirmware: {newfirmware}')
+        else:
+            logging.error(f'{ip} error check after upgrade firmware [oldversion={oldfirmware} | newversion={newfirmware}]')
+            result = False
+    return result
+
+
+def make_waves(hosts, canary=0, waves=None):
+    '''
+    Split hosts into rollout waves. The first `canary` hosts go alone, 
+    the rest are cut at cumulative percentages, e.g. waves=[10, 50, 100] 
+    gives 10%, then up to 50%, then everything that is left
+    '''
+    hosts = list(hosts)
+    result = []
+    if canary:
+        result.append(hosts[:canary])
+        hosts = hosts[canary:]
+    waves = list(waves or [100])
+    if waves[-1] < 100:
+        waves.append(100)
+    start = 0
+    for percent in waves:
+        end = min(len(hosts), math.ceil(len(hosts) * percent / 100))
+        if end > start:
+            result.append(hosts[start:end])
+            start = end
+    return result
+
+
+def rollout(job, hosts=HOSTS, concurrency=1, canary=0, waves=None, max_failure_rate=None):
+    '''
+    Run job(ip) over hosts wave by wave, at most `concurrency` hosts at a time. 
+    A wave takes as long as its slowest host. If the share of failed hosts 
+    exceeds max_failure_rate, queued hosts are cancelled and later waves 
+    are not started. A host listed twice is run once. Return {ip: True/False} 
+    for the hosts that were run
+    '''
+    unique = list(dict.fromkeys(hosts))
+    if len(unique) < len(hosts):
+        logging.warning(f'{len(hosts) - len(unique)} duplicate hosts skipped')
+    hosts = unique
+    results = {}
+    for number, wave in enumerate(make_waves(hosts, canary, waves), 1):
+        logging.info(f'{job.__name__} wave {number}: {len(wave)} hosts, concurrency {concurrency}')
+        stopped = False
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='host')
+        futures = {pool.submit(telemetry.call, ip, 'host', job, ip): ip for ip in wave}
+        for future in as_completed(futures):
+            ip = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                results[ip] = bool(future.result())
+            except Exception as err:
+                logging.error(f'{ip} {job.__name__}() unknown error [{str(err)}]')
+                results[ip] = False
+            try:
+                journal.finish(ip, results[ip])
+            except ValueError as err:
+                # The host failed even if its job did not, counted below
+                logging.error(f'{ip} journal error [{str(err)}]')
+                results[ip] = False
+            try:
+                inventory.update(ip, last_result='ok' if results[ip] else 'failed')
+            except sqlite3.Error as err:
+                # The inventory is only a cache, the rollout goes on
+                logging.error(f'{ip} inventory error [{str(err)}]')
+            if failure_rate_exceeded(results, max_failure_rate, concurrency) and not stopped:
+                stopped = True
+                # cancel() marks the queued futures done, so as_completed()
+                # yields them, shutdown(cancel_futures=True) would leave it
+                # waiting for them forever
+                for queued in futures:
+                    queued.cancel()
+        pool.shutdown(wait=True)
+
+        failed = [ip for ip, ok in results.items() if not ok]
+        logging.info(f'{job.__name__} wave {number} done: {len(results)} hosts processed, {len(failed)} failed')
+        if stopped or failure_rate_exceeded(results, max_failure_rate):
+            logging.error(f'{job.__name__} failure rate {len(failed)}/{len(results)} exceeds '
+                          f'{max_failure_rate:.0%}, rollout stopped after wave {number}')
+            break
+    return results
+
+
+def failure_rate_exceeded(results, max_failure_rate, min_hosts=1):
+    if max_failure_rate is None or len(results) < min_hosts:
+        return False
+    failed = sum(not ok for ok in results.values())
+    return failed / len(results) > max_failure_rate
+
+
+def version_update_all_mikrotik(hosts=HOSTS, **rollout_options):
+    return rollout(version_update_mikrotik, hosts, **rollout_options)
+
+
+def firmware_upgrade_all_mikrotik(hosts=HOSTS, **rollout_options):
+    return rollout(firmware_upgrade_mikrotik, hosts, **rollout_options)
+
+
+def update_all_mikrotik(hosts=HOSTS, mirror=None, **rollout_options):
+    if not mirror:
+        return rollout(update_mikrotik, hosts, **rollout_options)
+
+    def update_mikrotik_from_mirror(ip):
+        return update_mikrotik(ip, mirror)
+    return rollout(update_mikrotik_from_mirror, hosts, **rollout_options)
+
+
+def resumable(job, entries):
+    '''
+    Wrap job for a resumed run: hosts that were rebooting when the run was 
+    interrupted only get the post-reboot check, the others start over
+    '''
+    def resumed(ip):
+        entry = entries.get(ip)
+        if entry and entry['state'] == 'rebooting':
+            logging.info(f'{ip} resuming after reboot')
+            return check_after_reboot(ip, parse_version(entry.get('version')), parse_version(entry.get('firmware')),
+                                      entry.get('model'), resumed=True,
+                                      updated=bool(entry.get('updated') or entry.get('version')))
+        journal.restart(ip)
+        return job(ip)
+    resumed.__name__ = job.__name__
+    return resumed
+
+
+def changed_hosts(hosts, ttl):
+    '''
+    Drop the hosts that the inventory says are current and fresh
+    '''
+    changed = [ip for ip in hosts if not inventory.is_current(ip, ttl)]
+    logging.info(f'{len(hosts) - len(changed)} hosts are current in the inventory, {len(changed)} to check')
+    return changed
+
+
+def print_inventory(ttl):
+    '''
+    Report fleet state from the inventory, without connecting to any host
+    '''
+    hosts = {host['ip']: host for host in inventory.hosts()}
+    row = '{:<16} {:<18} {:<10} {:<10} {:<10} {:<10} {:<19} {:<7}'
+    print(row.format('ip', 'model', 'version', 'latest', 'firmware', 'upgrade', 'last seen', 'result'))
+    counts = {'current': 0, 'outdated': 0, 'failed': 0, 'unknown': 0}
+    for ip in HOSTS:
+        host = hosts.get(ip)
+        if not host:
+            counts['unknown'] += 1
+            print(row.format(ip, *['-'] * 7))
+            continue
+        if host['last_result'] == 'failed':
+            counts['failed'] += 1
+        elif inventory.is_current(ip, ttl):
+            counts['current'] += 1
+        else:
+            counts['outdated'] += 1
+        last_seen = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(host['last_seen'])) if host['last_seen'] else '-'
+        print(row.format(ip, *[host[column] or '-' for column in Inventory.columns[1:6]],
+                         last_seen, host['last_result'] or '-'))
+    print(', '.join(f'{count} {state}' for state, count in counts.items()) + f' of {len(HOSTS)} hosts')
+
+
+def percent_list(value):
+    return [float(percent) for percent in value.split(',')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Update RouterOS and routerboard firmware on Mikrotik hosts')
+    parser.add_argument(
+        'action',
+        nargs='?',
+        choices=('all', 'version', 'firmware', 'inventory'),
+        default='all',
+        help='what to update, "all" does version and firmware with one reboot, '
+             '"inventory" only reports the cached fleet state [default: all]'
+    )
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        type=int,
+        default=1,
+        help='how many hosts are updated at the same time [default: 1]'
+    )
+    parser.add_argument(
+        '--canary',
+        type=int,
+        default=0,
+        help='number of hosts updated alone in the first wave [default: 0]'
+    )
+    parser.add_argument(
+        '--waves',
+        type=percent_list,
+        help='cumulative percentages of hosts per wave, e.g. 10,50,100'
+    )
+    parser.add_argument(
+        '--mirror',
+        nargs='?',
+        const=MIRROR_DIR,
+        help='fetch packages once into this local cache and upload them to '
+             'the routers instead of letting each router download, "all" action only [default: packages]'
+    )
+    parser.add_argument(
+        '--changed-only',
+        action='store_true',
+        default=False,
+        help='skip hosts the inventory has seen current within --ttl'
+    )
+    parser.add_argument(
+        '--ttl',
+        type=int,
+        default=3600,
+        help='how long a cached host state stays fresh, seconds [default: 3600]'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help='continue the last interrupted run, only hosts that are not verified yet'
+    )
+    parser.add_argument(
+        '--max-failure-rate',
+        type=float,
+        help='stop the rollout when this share of hosts failed, e.g. 0.2'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.action == 'inventory':
+        print_inventory(args.ttl)
+        return
+
+    hosts = changed_hosts(HOSTS, args.ttl) if args.changed_only else HOSTS
+    if args.action == 'all' and args.mirror:
+        mirror = PackageMirror(args.mirror)
+
+        def job(ip):
+            return update_mikrotik(ip, mirror)
+        job.__name__ = update_mikrotik.__name__
+    else:
+        job = {'all': update_mikrotik,
+               'version': version_update_mikrotik,
+               'firmware': firmware_upgrade_mikrotik}[args.action]
+
+    if args.resume:
+        entries = journal.resume()
+        hosts = [ip for ip in hosts if entries.get(ip, {}).get('state') != 'verified']
+        logging.info(f'resuming run {journal.run}: {len(hosts)} hosts are not verified yet')
+        job = resumable(job, entries)
+
+    rollout(job, hosts, concurrency=args.concurrency, canary=args.canary,
+            waves=args.waves, max_failure_rate=args.max_failure_rate)
+    telemetry.summary()
 
 
 if __name__ == '__main__':
-    version_update_all_mikrotik()
-    firmware_upgrade_all_mikrotik()
\ No newline at end of file
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import difflib
+import random
+import time
+import fastdiff
+
+'''
+Benchmark of the diff engines of diff_cli on synthetic inputs: a file of
+`lines` lines (CSV or log like rows, with a share of repeated lines) and
+a copy with `edits` random insertions, deletions and changes. Reports the
+time of difflib and of fastdiff for the unified and context formats and
+for --all, and compares the outputs. With many repeated lines the two
+engines may align changes differently, fastdiff's diff is then the
+shorter one since Myers finds a minimal edit script.
+'''
+
+
+def synthetic_lines(count, repeated=0.05, seed=1):
+    rng = random.Random(seed)
+    common = [f'{value}\n' for value in ('', '}', 'end', '-' * 40)]
+    lines = []
+    for index in range(count):
+        if rng.random() < repeated:
+            lines.append(rng.choice(common))
+        else:
+            lines.append(f'{index},{rng.randint(0, 10 ** 9)},host{rng.randint(0, 999)},{rng.random():.6f}\n')
+    return lines
+
+
+def edited(lines, edits, seed=2):
+    rng = random.Random(seed)
+    lines = list(lines)
+    for index in range(edits):
+        position = rng.randrange(len(lines))
+        choice = rng.random()
+        if choice < 0.3:
+            del lines[position]
+        elif choice < 0.6:
+            lines.insert(position, f'inserted {index}\n')
+        else:
+            lines[position] = f'changed {index}\n'
+    return lines
+
+
+def timed(function, *args, **options):
+    started = time.perf_counter()
+    result = ''.join(function(*args, **options))
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of difflib and fastdiff')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='lines in the old file [default: 200000]')
+    parser.add_argument('-e', '--edits', type=int, default=200, help='number of edits [default: 200]')
+    parser.add_argument('--repeated', type=float, default=0.05,
+                        help='share of repeated lines like blank lines and braces [default: 0.05]')
+    parser.add_argument('--skip-difflib', action='store_true', default=False,
+                        help='time only fastdiff, for inputs difflib takes minutes on')
+    args = parser.parse_args()
+
+    old = synthetic_lines(args.lines, args.repeated)
+    new = edited(old, args.edits)
+    print(f'{len(old)} -> {len(new)} lines, {args.edits} edits')
+    engines = (('unified_diff', fastdiff.unified_diff, difflib.unified_diff),
+               ('context_diff', fastdiff.context_diff, difflib.context_diff),
+               ('all', fastdiff.compare, difflib.Differ().compare))
+    for name, fast_diff, slow_diff in engines:
+        names = () if name == 'all' else ('old', 'new')
+        fast, fast_time = timed(fast_diff, old, new, *names)
+        print(f'{name:>12}: fastdiff {fast_time:8.3f}s, {fast.count(chr(10))} output lines')
+        if args.skip_difflib:
+            continue
+        slow, slow_time = timed(slow_diff, old, new, *names)
+        if name == 'all':
+            # Differ adds "?" guide lines fastdiff leaves out
+            slow = ''.join(line for line in slow.splitlines(keepends=True) if not line.startswith('? '))
+        same = 'same output' if slow == fast else f'different alignment, {slow.count(chr(10))} output lines'
+        print(f'{name:>12}: difflib  {slow_time:8.3f}s, {slow_time / fast_time:.1f}x slower, {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from routeros import PackageUpdate, Resource, Routerboard
+
+'''
+Benchmarks for the Mikrotik updater. `parse` replays the captured RouterOS
+outputs from fixtures/routeros through the typed parsers and reports how
+many outputs per second are turned into records. `rollout` updates a fleet
+of fake routers (mikrotik_fake.py) on localhost and reports per-phase
+latency histograms, taken from the rollout journal, and the total time.
+A --downtime shorter than the updater's port polls (REBOOT_POLL, 0.2 s)
+can go unseen. Such reboots are confirmed from the reset uptime after
+REBOOT_GOING_DOWN, so "reboot and verify" then measures that 15 s wait.
+`stop` runs a rollout where every host fails and checks that the failure
+rate stops it and rollout() returns. With --journal-error the jobs succeed
+but leave their host in a state the journal cannot finish.
+'''
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'routeros'
+
+# Record type for each fixture by file name prefix
+RECORDS = {'update': PackageUpdate,
+           'routerboard': Routerboard,
+           'resource': Resource}
+
+
+def load_fixtures(path=FIXTURES):
+    fixtures = []
+    for fixture in sorted(Path(path).glob('*.txt')):
+        record = RECORDS.get(fixture.name.split('_')[0])
+        if record:
+            fixtures.append((record, fixture.read_bytes().decode('utf8')))
+    return fixtures
+
+
+def bench_parse(count):
+    fixtures = load_fixtures()
+    started = time.perf_counter()
+    for index in range(count):
+        record, text = fixtures[index % len(fixtures)]
+        record.from_output(text)
+    elapsed = time.perf_counter() - started
+    print(f'parsed {count} outputs from {len(fixtures)} fixtures in {elapsed:.3f}s '
+          f'({count / elapsed:.0f} outputs/s)')
+
+
+def histogram(name, values, buckets=(0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300)):
+    if not values:
+        print(f'{name}: no samples')
+        return
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    print(f'{name}: n={len(values)} p50={statistics.median(values):.3f}s p95={p95:.3f}s max={values[-1]:.3f}s')
+    lower = 0
+    for upper in buckets + (float('inf'),):
+        count = sum(lower <= value < upper for value in values)
+        if count:
+            print(f'  {lower:>7g} - {upper:<7g} {count:>6} {"#" * max(1, 50 * count // len(values))}')
+        lower = upper
+
+
+def phases(entries, started):
+    '''
+    Per-phase durations of every host from its journal transitions
+    '''
+    result = {'connect': [], 'check': [], 'download': [], 'reboot and verify': [], 'host total': []}
+    hosts = {}
+    for entry in entries:
+        hosts.setdefault(entry['host'], {})[entry['state']] = entry['time']
+    for host, times in hosts.items():
+        end = times.get('verified') or times.get('failed')
+        spans = (('connect', started.get(host), times.get('connected')),
+                 ('check', times.get('connected'), times.get('checked')),
+                 ('download', times.get('checked'), times.get('downloaded')),
+                 ('reboot and verify', times.get('rebooting'), end),
+                 ('host total', started.get(host), end))
+        for name, begin, finish in spans:
+            if begin and finish:
+                result[name].append(finish - begin)
+    return result
+
+
+def load_updater(workdir, hosts):
+    '''
+    Import Mikrotik_update with a conf.py for `hosts`, working in `workdir`
+    '''
+    (workdir / 'logs').mkdir()
+    (workdir / 'conf.py').write_text(f"HOSTS = {hosts!r}\nUSER = 'admin'\nPASSWD = ''\nPORT = 22\n")
+    os.chdir(workdir)
+    sys.path.insert(0, str(workdir))
+    mikrotik_update = importlib.import_module('Mikrotik_update')
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    return mikrotik_update
+
+
+def bench_stop(count, concurrency, max_failure_rate, journal_error=False, timeout=60):
+    workdir = Path(tempfile.mkdtemp(prefix='bench_mikrotik_'))
+    hosts = [f'10.0.{index // 256}.{index % 256}' for index in range(count)]
+    mikrotik_update = load_updater(workdir, hosts)
+
+    def failing(ip):
+        time.sleep(0.05)
+        if journal_error:
+            # connected -> verified is not a valid transition
+            mikrotik_update.journal.transition(ip, 'connected')
+            return True
+        return False
+
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(
+        mikrotik_update.rollout(failing, hosts, concurrency=concurrency, max_failure_rate=max_failure_rate)),
+        daemon=True)
+    began = time.perf_counter()
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        print(f'rollout did not return within {timeout}s')
+        sys.exit(1)
+    print(f'rollout of {count} failing hosts at concurrency {concurrency} stopped after {len(results)} hosts '
+          f'in {time.perf_counter() - began:.2f}s')
+    if len(results) >= count:
+        print('the failure rate did not stop the rollout')
+        sys.exit(1)
+
+
+def bench_rollout(count, concurrency, port, latency, downtime, download_time, disk_full):
+    from mikrotik_fake import FakeFleet
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_mikrotik_'))
+    with FakeFleet(count, port, disk_full=disk_full, latency=latency, downtime=downtime,
+                   download_time=download_time, seed=1) as fleet:
+        mikrotik_update = load_updater(workdir, fleet.hosts)
+
+        started = {}
+
+        def update_mikrotik(ip):
+            started[ip] = time.time()
+            return mikrotik_update.update_mikrotik(ip)
+
+        began = time.perf_counter()
+        results = mikrotik_update.rollout(update_mikrotik, fleet.hosts, concurrency=concurrency)
+        elapsed = time.perf_counter() - began
+
+    with open(workdir / 'logs' / 'journal.jsonl', encoding='utf8') as fh:
+        entries = [json.loads(line) for line in fh]
+    for name, values in phases(entries, started).items():
+        histogram(name, values)
+    failed = sum(not ok for ok in results.values())
+    print(f'fleet of {count} hosts, concurrency {concurrency}: {elapsed:.1f}s total, {failed} failed '
+          f'(work dir {workdir})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for Mikrotik_update')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+    parse = subparsers.add_parser('parse', help='parse captured RouterOS outputs')
+    parse.add_argument('-n', '--count', type=int, default=100000,
+                       help='number of outputs to parse [default: 100000]')
+    rollout = subparsers.add_parser('rollout', help='update a fleet of fake routers on localhost')
+    rollout.add_argument('-n', '--count', type=int, default=50, help='number of fake routers [default: 50]')
+    rollout.add_argument('-c', '--concurrency', type=int, default=10, help='rollout concurrency [default: 10]')
+    rollout.add_argument('-p', '--port', type=int, default=20000, help='port of the first router [default: 20000]')
+    rollout.add_argument('--latency', type=float, default=0.05,
+                         help='delay of every connect and command, seconds [default: 0.05]')
+    rollout.add_argument('--downtime', type=float, default=3, help='reboot downtime, seconds [default: 3]')
+    rollout.add_argument('--download-time', type=float, default=0.5,
+                         help='package download time, seconds [default: 0.5]')
+    rollout.add_argument('--disk-full', type=float, default=0.05,
+                         help='share of routers without space for the update [default: 0.05]')
+    stop = subparsers.add_parser('stop', help='check that a failing rollout stops and returns')
+    stop.add_argument('-n', '--count', type=int, default=20, help='number of hosts, all failing [default: 20]')
+    stop.add_argument('-c', '--concurrency', type=int, default=2, help='rollout concurrency [default: 2]')
+    stop.add_argument('--max-failure-rate', type=float, default=0.1,
+                      help='failure rate that stops the rollout [default: 0.1]')
+    stop.add_argument('--journal-error', action='store_true',
+                      help='jobs succeed, the journal fails to finish the host')
+    args = parser.parse_args()
+    if args.bench == 'parse':
+        bench_parse(args.count)
+    elif args.bench == 'rollout':
+        bench_rollout(args.count, args.concurrency, args.port, args.latency, args.downtime,
+                      args.download_time, args.disk_full)
+    elif args.bench == 'stop':
+        bench_stop(args.count, args.concurrency, args.max_failure_rate, args.journal_error)
+
+
+if __name__ == '__main__':
+    main()
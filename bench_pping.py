@@ -0,0 +1,151 @@
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import pping
+from pping_stats import ProbeStats, format_event
+from pping import OK, TIMEOUT, Probe
+
+'''
+Benchmarks for pping. `log` writes the same synthetic capture as text
+lines and as a binary log and reports the size of each file and how long
+it takes to load it back for plotting. `plot` loads a week long capture
+and reduces it to the chart points with each downsampler. `stats` feeds
+a capture with a known outage through the online statistics. `writer`
+logs many targets at once line by line and through the LogWriter thread.
+'''
+
+
+def synthetic_probes(count, period=1.0, loss=0.01, seed=1):
+    '''
+    `count` probes `period` seconds apart with a noisy latency around 20ms
+    '''
+    rng = random.Random(seed)
+    start = time.time() - count * period
+    for seq in range(count):
+        if rng.random() < loss:
+            yield Probe(start + seq * period, seq, None, TIMEOUT)
+        else:
+            yield Probe(start + seq * period, seq, int(rng.gauss(20000, 3000)) % 200000, OK)
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_log(count, workdir):
+    text = workdir / '10.0.0.1 text.txt'
+    binary = workdir / '10.0.0.1 binary.ppl'
+
+    def write_text():
+        with open(text, 'w', encoding='utf8') as fh:
+            for probe in synthetic_probes(count):
+                fh.write(pping.format_probe(probe, '10.0.0.1') + '\n')
+
+    def write_binary():
+        with pping.BinaryLog(binary, '10.0.0.1') as log:
+            for probe in synthetic_probes(count):
+                log.write(probe)
+
+    for name, path, write in (('text', text, write_text), ('binary', binary, write_binary)):
+        _, write_time = timed(write)
+        records, load_time = timed(pping.load_log, path)
+        size = path.stat().st_size
+        print(f'{name:>6}: {size / 1024 ** 2:8.2f} MiB ({size / count:5.1f} B/probe), '
+              f'write {write_time:6.3f}s, load {load_time:6.3f}s, {len(records)} probes')
+
+
+def bench_plot(count, points, workdir):
+    binary = workdir / '10.0.0.1 week.ppl'
+    with pping.BinaryLog(binary, '10.0.0.1') as log:
+        for probe in synthetic_probes(count, loss=0.001):
+            log.write(probe)
+    records, load_time = timed(pping.load_log, binary)
+    for method in pping.DOWNSAMPLERS:
+        (time_date, time_ms, drop_date, maximum), elapsed = timed(pping.plot_series, records, points, method)
+        print(f'{method:>6}: {len(records)} probes -> {len(time_date)} points and {len(drop_date)} drops '
+              f'in {elapsed:.3f}s (load {load_time:.3f}s), max {np.nanmax(time_ms):.1f}ms')
+
+
+def bench_stats(count, outage):
+    probes = list(synthetic_probes(count, loss=0.001))
+    start = count // 2
+    for seq in range(start, min(count, start + outage)):
+        probes[seq] = Probe(probes[seq].timestamp, seq, None, TIMEOUT)
+    stats = ProbeStats('10.0.0.1')
+    started = time.perf_counter()
+    events = [event for probe in probes for event in stats.add(probe)]
+    elapsed = time.perf_counter() - started
+    for event in events + [stats.summary()]:
+        if event['event'] not in ('stats', 'loss burst'):
+            print(format_event(event))
+    print(f'{count} probes in {elapsed:.3f}s ({count / elapsed:.0f} probes/s, '
+          f'{elapsed / count * 1e6:.2f}us per probe)')
+
+
+def bench_writer(targets, count, workdir):
+    hosts = [f'10.0.{index // 256}.{index % 256}' for index in range(targets)]
+    probes = list(synthetic_probes(count))
+
+    def per_probe():
+        files = {host: open(workdir / f'{host} lines.txt', 'w', encoding='utf8') for host in hosts}
+        for probe in probes:
+            for host in hosts:
+                files[host].write(pping.format_probe(probe, host) + '\n')
+                files[host].flush()
+        for fh in files.values():
+            fh.close()
+
+    def writer(format):
+        writer = pping.LogWriter({host: workdir / f'{host} writer.{format}' for host in hosts}, format)
+        for probe in probes:
+            for host in hosts:
+                writer.write(host, probe)
+        writer.close()
+        return writer
+
+    total = targets * count
+    _, elapsed = timed(per_probe)
+    print(f'  line per probe: {total} probes in {elapsed:.3f}s ({total / elapsed:.0f} probes/s), {total} writes')
+    for format in ('text', 'binary'):
+        result, elapsed = timed(writer, format)
+        print(f'{format:>6} writer: {total} probes in {elapsed:.3f}s ({total / elapsed:.0f} probes/s), '
+              f'{result.writes} writes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for pping')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+    log = subparsers.add_parser('log', help='size and load time of text and binary logs')
+    log.add_argument('-n', '--count', type=int, default=86400,
+                     help='number of probes, a day at 1/s by default [default: 86400]')
+    plot = subparsers.add_parser('plot', help='downsampling of a long capture for the chart')
+    plot.add_argument('-n', '--count', type=int, default=7 * 86400,
+                      help='number of probes, a week at 1/s by default [default: 604800]')
+    plot.add_argument('--points', type=int, default=pping.PLOT_POINTS,
+                      help=f'chart points [default: {pping.PLOT_POINTS}]')
+    stats = subparsers.add_parser('stats', help='online statistics of a two day capture with an outage')
+    stats.add_argument('-n', '--count', type=int, default=2 * 86400,
+                       help='number of probes, two days at 1/s by default [default: 172800]')
+    stats.add_argument('--outage', type=int, default=30, help='outage length, probes [default: 30]')
+    writer = subparsers.add_parser('writer', help='logging many targets per probe and through the writer')
+    writer.add_argument('-t', '--targets', type=int, default=200, help='number of targets [default: 200]')
+    writer.add_argument('-n', '--count', type=int, default=1000, help='probes per target [default: 1000]')
+    args = parser.parse_args()
+    workdir = Path(tempfile.mkdtemp(prefix='bench_pping_'))
+    if args.bench == 'log':
+        bench_log(args.count, workdir)
+    elif args.bench == 'plot':
+        bench_plot(args.count, args.points, workdir)
+    elif args.bench == 'stats':
+        bench_stats(args.count, args.outage)
+    elif args.bench == 'writer':
+        bench_writer(args.targets, args.count, workdir)
+
+
+if __name__ == '__main__':
+    main()
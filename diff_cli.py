@@ -1,9 +1,104 @@
 import argparse
 import difflib
+import hashlib
+import html
+import itertools
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+import diffstore
+import fastdiff
+
+# Bytes read at a time when hashing
+HASH_CHUNK = 1024 * 1024
+
+# Rough memory the fast engine needs per line of a window (offset and hash
+# of the line, Myers vectors) and the smallest window --max-memory allows
+WINDOW_LINE_BYTES = 100
+MIN_WINDOW = 1000
+
+# Rows of the HTML diff rendered at a time as the page is scrolled, and
+# the longest pair of lines highlighted character by character
+HTML_CHUNK = 500
+INTRALINE_MAX = 400
+
+HTML_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>TITLE</title>
+<style>
+body {font-family: sans-serif; margin: 8px}
+table {border-collapse: collapse; table-layout: fixed; width: 100%; font: 13px monospace}
+td {padding: 0 4px; white-space: pre-wrap; word-break: break-all; vertical-align: top}
+td.n {width: 5em; text-align: right; color: #888; user-select: none}
+tr.f td {background: #eee; font: bold 14px sans-serif; padding: 6px 4px; border-top: 1px solid #ccc}
+tr.s td {background: #f4f8ff; color: #668; text-align: center}
+tr.s.x {cursor: pointer}
+tr.h {display: none}
+tr.d td.o, tr.r td.o {background: #ffdede}
+tr.i td.w, tr.r td.w {background: #deffde}
+tr.r td.o span {background: #f9a8a8}
+tr.r td.w span {background: #a8eca8}
+#status {position: fixed; right: 8px; bottom: 8px; background: #fff; font-size: 12px}
+</style>
+</head><body>
+<table><colgroup><col style="width: 5em"><col><col style="width: 5em"><col></colgroup>
+<tbody id="rows"></tbody></table>
+<div id="more"></div>
+<div id="status"><span id="count"></span> <button id="all">render all</button></div>
+<script>
+let chunks, next = 0, group = 0;
+const expanded = new Set();
+const body = document.getElementById('rows'), more = document.getElementById('more');
+const row = (kind, a, ah, b, bh, extra) =>
+  `<tr class="${kind}${extra}"><td class="n">${a || ''}</td><td class="o">${ah}</td>` +
+  `<td class="n">${b || ''}</td><td class="w">${bh}</td></tr>`;
+function render() {
+  const rows = JSON.parse(chunks[next].textContent);
+  chunks[next++].remove();
+  let html = '';
+  for (const [kind, a, ah, b, bh] of rows) {
+    if (kind === 'f') {
+      html += `<tr class="f"><td colspan="4">${ah}</td></tr>`;
+    } else if (kind === 's') {
+      group++;
+      html += `<tr class="s" data-group="${group}"><td colspan="4">\u22ef ${a} unchanged lines</td></tr>`;
+    } else if (kind === 'h') {
+      html += row(expanded.has(group) ? 'e' : 'h', a, ah, b, bh, ` g${group}`);
+    } else {
+      html += row(kind, a, ah, b, bh, '');
+    }
+  }
+  body.insertAdjacentHTML('beforeend', html);
+  body.querySelectorAll('tr.s:not(.x)').forEach(tr => {
+    if (tr.nextElementSibling && tr.nextElementSibling.classList.contains('g' + tr.dataset.group)) {
+      tr.classList.add('x');
+    }
+  });
+  document.getElementById('count').textContent = next < chunks.length ?
+    `${next * CHUNK} of about ${chunks.length * CHUNK} rows` : '';
+  if (next >= chunks.length) document.getElementById('all').remove();
+}
+function fill() {
+  while (next < chunks.length && more.getBoundingClientRect().top < 2 * innerHeight) render();
+}
+body.onclick = event => {
+  const tr = event.target.closest('tr.s.x');
+  if (!tr) return;
+  expanded.add(+tr.dataset.group);
+  body.querySelectorAll('.g' + tr.dataset.group).forEach(r => r.className = 'e');
+  tr.remove();
+};
+document.addEventListener('DOMContentLoaded', () => {
+  chunks = Array.from(document.querySelectorAll('script.rows'));
+  document.getElementById('all').onclick = () => { while (next < chunks.length) render(); };
+  if (!chunks.length) return document.getElementById('all').remove();
+  new IntersectionObserver(fill, {rootMargin: '100% 0px'}).observe(more);
+  fill();
+});
+</script>
+""".replace('CHUNK', str(HTML_CHUNK))
 
 
 def file_mtime(path):
@@ -11,26 +106,296 @@ def file_mtime(path):
     time = time.strftime("%d.%m.%Y %H:%M:%S")
     return time
 
-def make_html(diff):
-    # COLORS
-    green = "#deffde"
-    red = "#ffdede"
+def file_hash(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as fh:
+        while chunk := fh.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.digest()
+
+def read_lines(path):
+    with open(path, errors='replace') as fh:
+        return fh.readlines()
+
+def make_diff(old_text, new_text, old_name, new_name, old_date, new_date, mode='unified', n=3, engine='difflib'):
+    if engine == 'fast':
+        if mode == 'context':
+            return fastdiff.context_diff(old_text, new_text, old_name, new_name, old_date, new_date, n=n)
+        if mode == 'all':
+            return fastdiff.compare(old_text, new_text)
+        return fastdiff.unified_diff(old_text, new_text, old_name, new_name, old_date, new_date, n=n)
+    if mode == 'context':
+        return difflib.context_diff(old_text, new_text, old_name, new_name, old_date, new_date, n=n)
+    if mode == 'all':
+        return difflib.Differ().compare(old_text, new_text)
+    return difflib.unified_diff(old_text, new_text, old_name, new_name, old_date, new_date, n=n)
+
+def memory_window(max_memory):
+    # Lines of each file the fast engine indexes at a time to stay within
+    # max_memory MiB, None for whole files
+    if not max_memory:
+        return None
+    return max(MIN_WINDOW, int(max_memory * 1024 * 1024 / WINDOW_LINE_BYTES / 2))
+
+def diff_files(old_path, new_path, old_name, new_name, old_date, new_date, mode='unified', n=3, engine='difflib',
+               max_memory=None):
+    # The fast engine maps the files and keeps only line offsets and hashes
+    # in memory, difflib needs the lines of both files. A missing path is
+    # an empty file
+    if engine == 'fast' or max_memory:
+        return fastdiff.diff_files(old_path, new_path, old_name, new_name, old_date, new_date, mode, n,
+                                   memory_window(max_memory))
+    old_text = read_lines(old_path) if old_path else []
+    new_text = read_lines(new_path) if new_path else []
+    return make_diff(old_text, new_text, old_name, new_name, old_date, new_date, mode, n, engine)
+
+def intraline(old, new):
+    # Escaped old and new line with the changed characters in <span>s.
+    # Long lines only get their common prefix and suffix, lines with
+    # little in common are left unmarked
+    old, new = old.rstrip('\r\n'), new.rstrip('\r\n')
+    if len(old) + len(new) <= INTRALINE_MAX:
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        if matcher.ratio() < 0.5:
+            return html.escape(old), html.escape(new)
+        opcodes = matcher.get_opcodes()
+    else:
+        prefix = len(os.path.commonprefix([old, new]))
+        suffix = len(os.path.commonprefix([old[prefix:][::-1], new[prefix:][::-1]]))
+        opcodes = [('equal', 0, prefix, 0, prefix),
+                   ('replace', prefix, len(old) - suffix, prefix, len(new) - suffix),
+                   ('equal', len(old) - suffix, len(old), len(new) - suffix, len(new))]
+
+    def marked(text, start, stop):
+        pieces = []
+        for opcode in opcodes:
+            piece = html.escape(text[opcode[start]:opcode[stop]])
+            if piece:
+                pieces.append(piece if opcode[0] == 'equal' else f'<span>{piece}</span>')
+        return ''.join(pieces)
+
+    return marked(old, 1, 2), marked(new, 3, 4)
+
+def change_rows(i1, old_lines, j1, new_lines):
+    # Old and new lines of a change side by side, pairs get intraline marks
+    for index in range(max(len(old_lines), len(new_lines))):
+        if index < len(old_lines) and index < len(new_lines):
+            old_html, new_html = intraline(old_lines[index], new_lines[index])
+            yield ['r', i1 + index + 1, old_html, j1 + index + 1, new_html]
+        elif index < len(old_lines):
+            yield ['d', i1 + index + 1, html.escape(old_lines[index].rstrip('\r\n')), 0, '']
+        else:
+            yield ['i', 0, '', j1 + index + 1, html.escape(new_lines[index].rstrip('\r\n'))]
+
+def html_rows(opcodes, old, new, n=3, show_all=False):
+    # Rows of a side by side diff: [kind, old line number, old html, new
+    # line number, new html], kinds are e(qual), r(eplace), d(elete),
+    # i(nsert), s(kip) with the number of unchanged lines left out in
+    # place of the old line number, and h(idden) for the unchanged lines
+    # show_all keeps behind a skip row
+    if show_all:
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != 'equal':
+                yield from change_rows(i1, old.lines(i1, i2), j1, new.lines(j1, j2))
+                continue
+            collapse = i2 - i1 > 2 * n
+            for index, line in enumerate(old.lines(i1, i2)):
+                if collapse and index == n:
+                    yield ['s', i2 - i1 - 2 * n, '', 0, '']
+                kind = 'h' if collapse and n <= index < i2 - i1 - n else 'e'
+                text = html.escape(line.rstrip('\r\n'))
+                yield [kind, i1 + index + 1, text, j1 + index + 1, text]
+        return
+
+    end = [0]
+
+    def tracked():
+        for opcode in opcodes:
+            end[0] = opcode[2]
+            yield opcode
+
+    shown = 0
+    for group in fastdiff.stream_groups(fastdiff.stream_spans(old, new, tracked(), n), n):
+        if group[0][1] > shown:
+            yield ['s', group[0][1] - shown, '', 0, '']
+        for tag, i1, i2, j1, j2, old_lines, new_lines in group:
+            if tag != 'equal':
+                yield from change_rows(i1, old_lines, j1, new_lines)
+                continue
+            for index, line in enumerate(old_lines):
+                text = html.escape(line.rstrip('\r\n'))
+                yield ['e', i1 + index + 1, text, j1 + index + 1, text]
+        shown = group[-1][2]
+    if shown and end[0] > shown:
+        yield ['s', end[0] - shown, '', 0, '']
+
+def side_by_side(old_path, new_path, n=3, engine='difflib', max_memory=None, show_all=False):
+    # html_rows() of two files, a missing path is an empty file
+    if engine == 'fast' or max_memory:
+        with fastdiff.MappedLines(old_path) as old, fastdiff.MappedLines(new_path) as new:
+            yield from html_rows(fastdiff.stream_opcodes(old, new, memory_window(max_memory)), old, new, n, show_all)
+        return
+    old = fastdiff.ListLines(read_lines(old_path) if old_path else [])
+    new = fastdiff.ListLines(read_lines(new_path) if new_path else [])
+    yield from html_rows(difflib.SequenceMatcher(None, old, new).get_opcodes(), old, new, n, show_all)
+
+def header_row(text):
+    # A file name row above the rows of one file
+    return ['f', 0, html.escape(text), 0, '']
+
+def make_html(rows, title=''):
+    # Yields the page as the rows are produced. The rows are stored in
+    # chunks of HTML_CHUNK as JSON, the page renders a chunk when the end
+    # of the table scrolls into view, so a huge diff opens at once
+    yield HTML_PAGE.replace('TITLE', html.escape(title))
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == HTML_CHUNK:
+            yield html_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield html_chunk(chunk)
+    yield '</body></html>\n'
+
+def html_chunk(rows):
+    data = json.dumps(rows, separators=(',', ':')).replace('</', '<\\/')
+    return f'<script type="application/json" class="rows">{data}</script>\n'
+
+def tree_files(root):
+    # relative path -> size of every regular file under root
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path):
+                files[os.path.relpath(path, root)] = os.path.getsize(path)
+    return files
+
+def diff_pair(job):
+    # Runs in a worker process: compare one pair of files, a missing side
+    # (None) is an added or removed file, files of different size are not
+    # hashed. Returns (relative path, status, diff text), or the html_rows()
+    # of the pair for an HTML diff
+    relpath, old_path, new_path, same_size, mode, n, engine, report, max_memory, html_diff = job
+    if old_path and new_path:
+        if same_size and file_hash(old_path) == file_hash(new_path):
+            return relpath, 'same', ''
+        status = 'differ'
+    else:
+        status = 'added' if new_path else 'removed'
+    if report:
+        return relpath, status, ''
+    if html_diff:
+        rows = list(side_by_side(old_path, new_path, n, engine, max_memory, mode == 'all'))
+        if not any(row[0] in 'rdi' for row in rows):
+            return relpath, 'same', []
+        return relpath, status, [header_row(f'{old_path or "/dev/null"} \u2192 {new_path or "/dev/null"}')] + rows
+    epoch = datetime.fromtimestamp(0, timezone.utc).strftime("%d.%m.%Y %H:%M:%S")
+    diff = diff_files(old_path, new_path, old_path or '/dev/null', new_path or '/dev/null',
+                      file_mtime(old_path) if old_path else epoch,
+                      file_mtime(new_path) if new_path else epoch, mode, n, engine, max_memory)
+    text = diff_text(diff, old_path or '/dev/null', new_path or '/dev/null')
+    return relpath, status if text else 'same', text
+
+def diff_text(diff, old_name, new_name):
+    # One file's part of a tree diff, '' without differences
+    diff = ''.join(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n' for line in diff)
+    return f'diff {old_name} {new_name}\n' + diff if diff else ''
+
+def diff_trees(old_dir, new_dir, mode='unified', n=3, engine='difflib', report=False, jobs=None, max_memory=None,
+               html_diff=False):
+    # Pair the files of two trees by relative path and diff them in a
+    # process pool, yields the results in path order
+    old_files = tree_files(old_dir)
+    new_files = tree_files(new_dir)
+    pairs = []
+    for relpath in sorted(old_files.keys() | new_files.keys()):
+        old_path = os.path.join(old_dir, relpath) if relpath in old_files else None
+        new_path = os.path.join(new_dir, relpath) if relpath in new_files else None
+        same_size = old_files.get(relpath) == new_files.get(relpath)
+        pairs.append((relpath, old_path, new_path, same_size, mode, n, engine, report, max_memory, html_diff))
+    if not pairs:
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(pairs) // ((jobs or os.cpu_count() or 1) * 8))
+        yield from executor.map(diff_pair, pairs, chunksize=chunksize)
+
+def snapshot_results(args, mode, store, old_date, root, files):
+    # diff_pair() results of a new snapshot: changed files are diffed
+    # against the stored index of their old version
+    epoch = datetime.fromtimestamp(0, timezone.utc).strftime("%d.%m.%Y %H:%M:%S")
+    window = memory_window(args.max_memory)
+    for relpath, status, old_digest, new_digest in store.update(args.snapshot, root, files):
+        if status == 'same' or args.report:
+            yield relpath, status, [] if args.make_html else ''
+            continue
+        old_name = f'{args.snapshot}@{old_date}/{relpath}' if old_digest else '/dev/null'
+        new_name = files[relpath] if new_digest else '/dev/null'
+        with store.lines(old_digest) as old, store.lines(new_digest) as new:
+            if args.make_html:
+                rows = list(html_rows(fastdiff.stream_opcodes(old, new, window), old, new, args.lines, mode == 'all'))
+                yield relpath, status, [header_row(f'{old_name} \u2192 {new_name}')] + rows
+                continue
+            diff = fastdiff.diff_lines(old, new, old_name, new_name, old_date if old_digest else epoch,
+                                       file_mtime(new_name) if new_digest else epoch, mode, args.lines, window)
+            yield relpath, status, diff_text(diff, old_name, new_name)
 
-    # HTML
-    html_head = """<table style="font-size: 18px; border: 1px solid black;">"""
-    html_end = """\n</table>"""
-    html_table_row = []
+def main_snapshot(args, mode):
+    # Compare a file or tree with the last snapshot of the same name and
+    # store it as the new one
+    store = diffstore.SnapshotStore(args.store)
+    root = args.old_file
+    if os.path.isdir(root):
+        files = {relpath: os.path.join(root, relpath) for relpath in tree_files(root)}
+    else:
+        files = {os.path.basename(root): root}
+    previous = store.last(args.snapshot)
+    if previous is None:
+        for _ in store.update(args.snapshot, root, files):
+            pass
+        print(f'{len(files)} files stored in the first snapshot {args.snapshot}', file=sys.stderr)
+        return 0
+    old_date = datetime.fromtimestamp(previous['time'], timezone.utc).strftime("%d.%m.%Y %H:%M:%S")
+    results = snapshot_results(args, mode, store, old_date, root, files)
+    return show_results(args, results, f'{args.snapshot}@{old_date}', root)
+
+def main_trees(args, mode):
+    results = diff_trees(args.old_file, args.new_file, mode, args.lines, args.engine, args.report, args.jobs,
+                         args.max_memory, bool(args.make_html))
+    return show_results(args, results, args.old_file, args.new_file)
+
+def show_results(args, results, old_root, new_root):
+    # Writes the diff_pair() results of a tree, returns the exit status
+    counts = dict.fromkeys(('same', 'differ', 'added', 'removed'), 0)
 
-    for line in list(diff):
-        if line.startswith(" "):
-            html_table_row.append(f'<tr><td><pre>{line}</pre></td><tr>')
-        elif line.startswith("-"):
-            html_table_row.append(f'<tr><td bgcolor="{red}"><pre>{line}</pre></td><tr>')
-        elif line.startswith("+"):
-            html_table_row.append(f'<tr><td bgcolor="{green}"><pre>{line}</pre></td><tr>')
+    def diff():
+        # Diff lines, or HTML rows with -m
+        for relpath, status, text in results:
+            counts[status] += 1
+            if args.report:
+                if status == 'differ':
+                    message = f'Files {os.path.join(old_root, relpath)} and {os.path.join(new_root, relpath)} differ\n'
+                elif status == 'added':
+                    message = f'Only in {new_root}: {relpath}\n'
+                elif status == 'removed':
+                    message = f'Only in {old_root}: {relpath}\n'
+                else:
+                    continue
+                yield header_row(message.rstrip('\n')) if args.make_html else message
+            elif args.make_html:
+                yield from text
+            elif text:
+                yield from text.splitlines(keepends=True)
 
-    html = html_head + '\n'.join(html_table_row) + html_end
-    return html
+    if args.make_html:
+        with open(args.make_html, 'w', encoding='utf8') as fh:
+            fh.writelines(make_html(diff(), f'{old_root} \u2192 {new_root}'))
+    else:
+        sys.stdout.writelines(diff())
+    print(f"{sum(counts.values())} files: {counts['same']} identical, {counts['differ']} changed, "
+          f"{counts['added']} added, {counts['removed']} removed", file=sys.stderr)
+    return 1 if counts['differ'] or counts['added'] or counts['removed'] else 0
 
 def main():
     parser = argparse.ArgumentParser()
@@ -38,46 +403,61 @@ def main():
                         help='Produce a context format diff')
     parser.add_argument('-u', '--unified', action='store_true', default=False,
                         help='Produce a unified format diff (default)')
-    parser.add_argument('-m', '--make-html', help='Produce HTML side by side diff '
-                        '(can use -c and -l in conjunction)')
+    parser.add_argument('-m', '--make-html', help='Produce HTML side by side diff, unchanged lines '
+                        'past the context are collapsed (can use -a and -l in conjunction)')
     parser.add_argument('-a', '--all', action='store_true', default=False,
                         help='Produce all lines in diff')
     parser.add_argument('-l', '--lines', type=int, default=3,
                         help='Set number of context lines (default 3)')
-    parser.add_argument('old_file')
-    parser.add_argument('new_file')
+    parser.add_argument('-e', '--engine', choices=('difflib', 'fast'), default='difflib',
+                        help='Diff engine, fast is a Myers diff for large files, with -a it '
+                             'leaves out the "?" hint lines (default difflib)')
+    parser.add_argument('-q', '--report', action='store_true', default=False,
+                        help='With directories, only report which files differ')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='With directories, number of worker processes (default: number of cores)')
+    parser.add_argument('--max-memory', type=float, default=None, metavar='MiB',
+                        help='Diff with the fast engine a window of lines at a time so the index of both '
+                             'files stays within about MiB, a change larger than the window may be shown '
+                             'as a longer replace (default: index whole files)')
+    parser.add_argument('-s', '--snapshot', metavar='NAME',
+                        help='Compare old_file (a file or directory) with the last snapshot NAME in the store '
+                             'and store it as the new snapshot NAME, unchanged files are not read')
+    parser.add_argument('--store', default=os.path.join(os.path.expanduser('~'), '.cache', 'diff_cli'),
+                        help='Snapshot store directory (default ~/.cache/diff_cli)')
+    parser.add_argument('old_file', help='Old file, or directory to compare with new_file directory')
+    parser.add_argument('new_file', nargs='?')
     args = parser.parse_args()
 
+    mode = 'context' if args.context else 'all' if args.all else 'unified'
+    if args.snapshot:
+        if args.new_file:
+            parser.error('--snapshot compares a single file or directory')
+        return main_snapshot(args, mode)
+    if not args.new_file:
+        parser.error('the following arguments are required: new_file')
+    if os.path.isdir(args.old_file) and os.path.isdir(args.new_file):
+        return main_trees(args, mode)
+
     old_file = Path(args.old_file)
     new_file = Path(args.new_file)
-    
+
     context_lines_count = args.lines
 
     old_file_date = file_mtime(old_file)
     new_file_date = file_mtime(new_file)
-    
-    with open(old_file) as ff:
-        old_file_text = ff.readlines()
-    with open(new_file) as tf:
-        new_file_text = tf.readlines()
-
-    if args.context:
-        diff = difflib.context_diff(old_file_text, new_file_text, old_file.name, new_file.name, old_file_date, new_file_date, n=context_lines_count)
-    elif args.all:
-        diff = difflib.Differ.compare(old_file_text, new_file_text)
-    else:
-        diff = difflib.unified_diff(old_file_text, new_file_text, old_file.name, new_file.name, old_file_date, new_file_date, n=context_lines_count)
 
     if args.make_html:
-        # default style
-        # diff = difflib.HtmlDiff().make_file(old_file_text,new_file_text,old_file.name,new_file.name,context=options.c,numlines=context_lines_count)
-        diff = make_html(diff)
+        rows = side_by_side(old_file, new_file, context_lines_count, args.engine, args.max_memory, args.all)
+        header = header_row(f'{old_file.name} {old_file_date} \u2192 {new_file.name} {new_file_date}')
         with open(args.make_html, 'w', encoding='utf8') as fh:
-            fh.write(diff)
+            fh.writelines(make_html(itertools.chain([header], rows), f'{old_file.name} \u2192 {new_file.name}'))
         return
-    
+
+    diff = diff_files(old_file, new_file, old_file.name, new_file.name, old_file_date, new_file_date,
+                      mode, context_lines_count, args.engine, args.max_memory)
     sys.stdout.writelines(diff)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import time
+from array import array
+from pathlib import Path
+import fastdiff
+
+'''
+Content-addressed store of file versions for diff_cli snapshots. A file
+is stored once under the blake2b hash of its content, next to an index of
+its lines: the end offset and a hash of every line. A snapshot records the
+hash, size and mtime of every file of a tree. The next snapshot of the
+tree only reads files whose size or mtime changed, and diffs a changed
+file against the stored index of its old version, so the old side is
+neither read nor hashed again, only the lines a diff prints are read.
+
+store/
+    objects/ab/ab12...       file content
+    objects/ab/ab12....idx   (end offset, line hash) int64 pairs
+    snapshots/NAME/20240101-020000.json
+'''
+
+# Bytes read at a time when hashing and copying
+COPY_CHUNK = 1024 * 1024
+
+# Lines indexed at a time when a file is stored
+INDEX_BATCH = 65536
+
+INDEX_SUFFIX = '.idx'
+
+
+def line_hash(line):
+    '''
+    Hash of the bytes of a line that stays the same across runs, unlike
+    hash() which is salted per process
+    '''
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little', signed=True)
+
+
+class IndexedLines(fastdiff.MappedLines):
+    '''
+    Lines of a stored file, fill() reads line offsets and hashes from the
+    stored index instead of scanning the text
+    '''
+    def __init__(self, path, index_path):
+        super().__init__(path, key=line_hash)
+        self.index = open(index_path, 'rb')
+        self.index_size = os.fstat(self.index.fileno()).st_size
+
+    def close(self):
+        super().close()
+        self.index.close()
+
+    def fill(self, count):
+        remaining = (self.index_size - self.index.tell()) // 16
+        wanted = min(remaining, count - len(self.hashes))
+        if wanted > 0:
+            records = array('q')
+            records.frombytes(self.index.read(wanted * 16))
+            self.offsets.extend(records[0::2])
+            self.hashes.extend(records[1::2])
+        return self.index.tell() >= self.index_size
+
+
+def write_index(path, index_path):
+    with fastdiff.MappedLines(path, key=line_hash) as lines, open(index_path, 'wb') as fh:
+        while True:
+            done = lines.fill(INDEX_BATCH)
+            records = array('q', bytes(16 * len(lines.hashes)))
+            records[0::2] = lines.offsets[1:]
+            records[1::2] = lines.hashes
+            records.tofile(fh)
+            lines.drop(len(lines.hashes))
+            if done:
+                return
+
+
+def content_hash(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as fh:
+        while chunk := fh.read(COPY_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class SnapshotStore():
+    '''
+    Objects and snapshots under `root`. A snapshot is a dict with the
+    time it was taken, the tree it is of, and for every file relative
+    path -> [content hash, size, mtime in ns]
+    '''
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def object_path(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def add(self, path):
+        '''
+        Store a file and its line index unless its content is stored
+        already, returns the content hash. The hash is taken while
+        copying, so it is the hash of what was stored even if the file
+        changes meanwhile
+        '''
+        objects = self.root / 'objects'
+        objects.mkdir(parents=True, exist_ok=True)
+        temporary = objects / f'.{os.getpid()}.tmp'
+        digest = hashlib.blake2b()
+        with open(path, 'rb') as source, open(temporary, 'wb') as target:
+            while chunk := source.read(COPY_CHUNK):
+                digest.update(chunk)
+                target.write(chunk)
+        digest = digest.hexdigest()
+        stored = self.object_path(digest)
+        if stored.exists():
+            temporary.unlink()
+            return digest
+        stored.parent.mkdir(exist_ok=True)
+        # The index goes in first, an object that exists always has one
+        write_index(temporary, temporary.with_suffix(INDEX_SUFFIX))
+        os.replace(temporary.with_suffix(INDEX_SUFFIX), stored.with_name(stored.name + INDEX_SUFFIX))
+        os.replace(temporary, stored)
+        return digest
+
+    def lines(self, digest):
+        '''
+        IndexedLines of a stored file, None is an empty file
+        '''
+        if digest is None:
+            return fastdiff.MappedLines(None)
+        stored = self.object_path(digest)
+        return IndexedLines(stored, stored.with_name(stored.name + INDEX_SUFFIX))
+
+    def last(self, name):
+        '''
+        The latest snapshot called `name`, None before the first one
+        '''
+        snapshots = sorted((self.root / 'snapshots' / name).glob('*.json'))
+        if not snapshots:
+            return None
+        with open(snapshots[-1], encoding='utf8') as fh:
+            return json.load(fh)
+
+    def save(self, name, snapshot):
+        directory = self.root / 'snapshots' / name
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / time.strftime('%Y%m%d-%H%M%S.json', time.localtime(snapshot['time']))
+        with open(path.with_suffix('.tmp'), 'w', encoding='utf8') as fh:
+            json.dump(snapshot, fh)
+        os.replace(path.with_suffix('.tmp'), path)
+
+    def update(self, name, root, files):
+        '''
+        Take a new snapshot `name` of the `files` (relative path -> path)
+        of the tree `root`. Yields (relative path, status, old hash, new
+        hash) for every file with status same, differ, added or removed,
+        and saves the snapshot when done. A file whose size and mtime are
+        those of the last snapshot is taken as unchanged without reading
+        it, one that was touched is hashed and only stored if its content
+        is new
+        '''
+        previous = self.last(name) or {'files': {}}
+        old_files = previous['files']
+        snapshot = {'time': time.time(), 'root': str(root), 'files': {}}
+        for relpath in sorted(old_files.keys() | files.keys()):
+            old = old_files.get(relpath)
+            if relpath not in files:
+                yield relpath, 'removed', old[0], None
+                continue
+            size, mtime = file_stat(files[relpath])
+            if old and old[1:] == [size, mtime]:
+                snapshot['files'][relpath] = old
+                yield relpath, 'same', old[0], old[0]
+                continue
+            if old and content_hash(files[relpath]) == old[0]:
+                snapshot['files'][relpath] = [old[0], size, mtime]
+                yield relpath, 'same', old[0], old[0]
+                continue
+            digest = self.add(files[relpath])
+            snapshot['files'][relpath] = [digest, size, mtime]
+            if old is None:
+                yield relpath, 'added', None, digest
+            else:
+                yield relpath, 'same' if digest == old[0] else 'differ', old[0], digest
+        self.save(name, snapshot)
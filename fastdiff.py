@@ -0,0 +1,533 @@
+import difflib
+import mmap
+import os
+import sys
+from array import array
+
+'''
+Line diff engine for large inputs. Lines are interned to integers, common
+prefix and suffix are trimmed, and the rest is compared with Myers'
+O(ND) algorithm in its linear space (middle snake) form, so the cost
+grows with the size of the change instead of the size of the files.
+
+LineMatcher is a difflib.SequenceMatcher whose matching blocks come from
+Myers, so get_opcodes() and get_grouped_opcodes() work as usual, and
+unified_diff() / context_diff() produce the same format as difflib.
+
+diff_files() diffs two files through mmap with only an index of line
+offsets and hashes in memory, optionally a window of lines at a time so
+memory stays bounded however large the files are.
+'''
+
+
+def intern_lines(a, b):
+    '''
+    The lines of `a` and `b` as integers, equal lines get the same number
+    '''
+    numbers = {}
+    a = [numbers.setdefault(line, len(numbers)) for line in a]
+    b = [numbers.setdefault(line, len(numbers)) for line in b]
+    return a, b
+
+
+def common_run(a, i, b, j, limit):
+    '''
+    Length of the common run of a[i:] and b[j:], at most `limit`. Slices 
+    of growing size are compared, so long equal runs are checked at C speed
+    '''
+    length = 0
+    size = 1
+    while length < limit:
+        step = min(size, limit - length)
+        if a[i + length:i + length + step] == b[j + length:j + length + step]:
+            length += step
+            size *= 2
+        elif step == 1:
+            break
+        else:
+            size = step // 2
+    return length
+
+
+def common_run_back(a, i, b, j, limit):
+    '''
+    Length of the common run of a[:i] and b[:j] counted from the end
+    '''
+    length = 0
+    size = 1
+    while length < limit:
+        step = min(size, limit - length)
+        if a[i - length - step:i - length] == b[j - length - step:j - length]:
+            length += step
+            size *= 2
+        elif step == 1:
+            break
+        else:
+            size = step // 2
+    return length
+
+
+def middle_snake(a, alo, ahi, b, blo, bhi):
+    '''
+    The middle snake of the shortest edit script of a[alo:ahi] and
+    b[blo:bhi]: (x, y, u, v) relative to alo/blo, a[x:u] equals b[y:v]
+    '''
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    limit = (n + m + 1) // 2
+    offset = limit + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            if x < n and y < m and a[alo + x] == b[blo + y]:
+                run = common_run(a, alo + x, b, blo + y, min(n - x, m - y))
+                x += run
+                y += run
+            forward[offset + k] = x
+            c = delta - k
+            if odd and -(d - 1) <= c <= d - 1 and x + backward[offset + c] >= n:
+                return x0, y0, x, y
+        for c in range(-d, d + 1, 2):
+            # the same walk from the ends of both sequences backwards
+            if c == -d or (c != d and backward[offset + c - 1] < backward[offset + c + 1]):
+                x = backward[offset + c + 1]
+            else:
+                x = backward[offset + c - 1] + 1
+            y = x - c
+            x0, y0 = x, y
+            if x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                run = common_run_back(a, ahi - x, b, bhi - y, min(n - x, m - y))
+                x += run
+                y += run
+            backward[offset + c] = x
+            k = delta - c
+            if not odd and -d <= k <= d and x + forward[offset + k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    raise AssertionError('no middle snake')
+
+
+def matching_blocks(a, b):
+    '''
+    Matching blocks of two integer sequences in SequenceMatcher form: sorted
+    (i, j, size) triples, adjacent blocks merged, ending with (len(a), len(b), 0)
+    '''
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        prefix = common_run(a, alo, b, blo, min(ahi - alo, bhi - blo))
+        if prefix:
+            blocks.append((alo, blo, prefix))
+            alo += prefix
+            blo += prefix
+        suffix = common_run_back(a, ahi, b, bhi, min(ahi - alo, bhi - blo))
+        if suffix:
+            ahi -= suffix
+            bhi -= suffix
+            blocks.append((ahi, bhi, suffix))
+        if alo == ahi or blo == bhi:
+            continue
+        x, y, u, v = middle_snake(a, alo, ahi, b, blo, bhi)
+        if u > x:
+            blocks.append((alo + x, blo + y, u - x))
+        stack.append((alo, alo + x, blo, blo + y))
+        stack.append((alo + u, ahi, blo + v, bhi))
+    blocks.sort()
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    merged.append((len(a), len(b), 0))
+    return merged
+
+
+class LineMatcher(difflib.SequenceMatcher):
+    '''
+    SequenceMatcher for lists of lines with Myers matching blocks. It does
+    not build difflib's b2j index, ratio() and find_longest_match() are
+    not supported
+    '''
+    def __init__(self, a=(), b=()):
+        super().__init__(None, a, b, autojunk=False)
+
+    def set_seq2(self, b):
+        if b is self.b:
+            return
+        self.b = b
+        self.matching_blocks = self.opcodes = None
+        self.fullbcount = None
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is None:
+            self.matching_blocks = [difflib.Match(*block) for block in matching_blocks(*intern_lines(self.a, self.b))]
+        return self.matching_blocks
+
+
+def unified_diff(a, b, fromfile='', tofile='', fromfiledate='', tofiledate='', n=3, lineterm='\n'):
+    '''
+    difflib.unified_diff() over LineMatcher
+    '''
+    started = False
+    for group in LineMatcher(a, b).get_grouped_opcodes(n):
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '--- {}{}{}'.format(fromfile, fromdate, lineterm)
+            yield '+++ {}{}{}'.format(tofile, todate, lineterm)
+        first, last = group[0], group[-1]
+        file1_range = difflib._format_range_unified(first[1], last[2])
+        file2_range = difflib._format_range_unified(first[3], last[4])
+        yield '@@ -{} +{} @@{}'.format(file1_range, file2_range, lineterm)
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in {'replace', 'delete'}:
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in {'replace', 'insert'}:
+                for line in b[j1:j2]:
+                    yield '+' + line
+
+
+def context_diff(a, b, fromfile='', tofile='', fromfiledate='', tofiledate='', n=3, lineterm='\n'):
+    '''
+    difflib.context_diff() over LineMatcher
+    '''
+    prefix = dict(insert='+ ', delete='- ', replace='! ', equal='  ')
+    started = False
+    for group in LineMatcher(a, b).get_grouped_opcodes(n):
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '*** {}{}{}'.format(fromfile, fromdate, lineterm)
+            yield '--- {}{}{}'.format(tofile, todate, lineterm)
+        first, last = group[0], group[-1]
+        yield '***************' + lineterm
+        file1_range = difflib._format_range_context(first[1], last[2])
+        yield '*** {} ****{}'.format(file1_range, lineterm)
+        if any(tag in {'replace', 'delete'} for tag, _, _, _, _ in group):
+            for tag, i1, i2, _, _ in group:
+                if tag != 'insert':
+                    for line in a[i1:i2]:
+                        yield prefix[tag] + line
+        file2_range = difflib._format_range_context(first[3], last[4])
+        yield '--- {} ----{}'.format(file2_range, lineterm)
+        if any(tag in {'replace', 'insert'} for tag, _, _, _, _ in group):
+            for tag, _, _, j1, j2 in group:
+                if tag != 'delete':
+                    for line in b[j1:j2]:
+                        yield prefix[tag] + line
+
+
+def compare(a, b):
+    '''
+    Every line with a two character prefix like difflib.Differ.compare(),
+    without Differ's intraline "?" guide lines
+    '''
+    for tag, i1, i2, j1, j2 in LineMatcher(a, b).get_opcodes():
+        if tag == 'equal':
+            for line in a[i1:i2]:
+                yield '  ' + line
+            continue
+        if tag in {'replace', 'delete'}:
+            for line in a[i1:i2]:
+                yield '- ' + line
+        if tag in {'replace', 'insert'}:
+            for line in b[j1:j2]:
+                yield '+ ' + line
+
+
+class MappedLines():
+    '''
+    Lines of a file read through mmap. The file is indexed a window at a
+    time: fill() scans lines up to the window size into an offset array
+    and an array of line hashes, drop() forgets lines the diff is done
+    with. Line text is decoded from the map only when it is printed.
+    Line ends are compared and printed as plain newlines, like text mode
+    reads them. `key` hashes the bytes of a line
+    '''
+    def __init__(self, path, encoding='utf-8', key=hash):
+        self.encoding = encoding
+        self.key = key
+        self.fh = open(path, 'rb') if path else None
+        self.size = os.fstat(self.fh.fileno()).st_size if path else 0
+        self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.base = 0
+        self.released = 0
+        self.offsets = array('q', [0])
+        self.hashes = array('q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        if self.fh:
+            self.fh.close()
+
+    def fill(self, count):
+        '''
+        Index lines until the window holds `count` of them, True at the end
+        of the file
+        '''
+        data, find, size, key = self.map, self.map.find, self.size, self.key
+        offsets, hashes = self.offsets, self.hashes
+        position = offsets[-1]
+        while len(hashes) < count and position < size:
+            end = find(b'\n', position)
+            end = size if end < 0 else end + 1
+            line = data[position:end]
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+            hashes.append(key(line))
+            offsets.append(end)
+            position = end
+        return position >= size
+
+    def drop(self, count):
+        del self.hashes[:count]
+        del self.offsets[:count]
+        self.base += count
+        # Let the kernel drop the pages of lines the diff is done with, so
+        # they don't add up in the resident size of a long diff
+        done = self.offsets[0] // mmap.PAGESIZE * mmap.PAGESIZE
+        if self.size and done > self.released and hasattr(mmap, 'MADV_DONTNEED'):
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, done - self.released)
+            self.released = done
+
+    def lines(self, start, stop):
+        '''
+        Text of lines start..stop, numbered from the start of the file
+        '''
+        offsets = self.offsets
+        result = []
+        for index in range(start - self.base, stop - self.base):
+            line = self.map[offsets[index]:offsets[index + 1]].decode(self.encoding, 'replace')
+            result.append(line[:-2] + '\n' if line.endswith('\r\n') else line)
+        return result
+
+
+class ListLines(list):
+    '''
+    Lines already in memory with the lines() of MappedLines
+    '''
+    def lines(self, start, stop):
+        return self[start:stop]
+
+
+def stream_opcodes(old, new, window=None):
+    '''
+    Opcodes of two MappedLines, compared `window` lines of each at a time
+    (the whole files without a window). A window is diffed up to the end
+    of its last matching block and the next one starts there, so a change
+    larger than the window may come out as a longer replace than needed.
+    The lines of an opcode can be read until the next one is requested
+    '''
+    window = window or sys.maxsize
+    while True:
+        old_end = old.fill(window)
+        new_end = new.fill(window)
+        blocks = matching_blocks(old.hashes, new.hashes)[:-1]
+        if (old_end and new_end) or not blocks:
+            stop_a, stop_b = len(old.hashes), len(new.hashes)
+        else:
+            stop_a, stop_b = blocks[-1][0] + blocks[-1][2], blocks[-1][1] + blocks[-1][2]
+        i = j = 0
+        for ai, bj, size in blocks + [(stop_a, stop_b, 0)]:
+            if i < ai or j < bj:
+                tag = 'replace' if i < ai and j < bj else 'delete' if i < ai else 'insert'
+                yield tag, old.base + i, old.base + ai, new.base + j, new.base + bj
+            if size:
+                yield 'equal', old.base + ai, old.base + ai + size, new.base + bj, new.base + bj + size
+            i, j = ai + size, bj + size
+        old.drop(stop_a)
+        new.drop(stop_b)
+        if old_end and new_end and not old.hashes and not new.hashes:
+            return
+
+
+class Span():
+    '''
+    A run of opcodes of one kind with the text a diff may print: every
+    line of a change, the first 2n and the last n lines of an equal run
+    '''
+    def __init__(self, tag, i1, j1, n):
+        self.tag = tag
+        self.i1 = self.i2 = i1
+        self.j1 = self.j2 = j1
+        self.n = n
+        self.a_lines = []
+        self.b_lines = []
+        self.tail = []
+
+    def add(self, tag, i1, i2, j1, j2, old, new):
+        if self.tag == 'equal':
+            head = min(2 * self.n - len(self.a_lines), i2 - i1)
+            self.a_lines += old.lines(i1, i1 + head)
+            self.tail = (self.tail + old.lines(max(i1, i2 - self.n), i2))[-self.n:] if self.n else []
+        else:
+            self.a_lines += old.lines(i1, i2)
+            self.b_lines += new.lines(j1, j2)
+            self.tag = 'replace' if self.a_lines and self.b_lines else 'delete' if self.a_lines else 'insert'
+        self.i2, self.j2 = i2, j2
+
+    def text(self, start, stop):
+        '''
+        Lines start..stop of an equal run, they must be within the kept
+        head or tail
+        '''
+        if stop - self.i1 <= len(self.a_lines):
+            return self.a_lines[start - self.i1:stop - self.i1]
+        tail_start = self.i2 - len(self.tail)
+        assert start >= tail_start, 'line of an equal run that was not kept'
+        return self.tail[start - tail_start:stop - tail_start]
+
+    def piece(self, i1, i2, j1, j2):
+        if self.tag == 'equal':
+            lines = self.text(i1, i2)
+            return self.tag, i1, i2, j1, j2, lines, lines
+        return self.tag, i1, i2, j1, j2, self.a_lines, self.b_lines
+
+
+def stream_spans(old, new, opcodes, n):
+    span = None
+    for tag, i1, i2, j1, j2 in opcodes:
+        kind = 'equal' if tag == 'equal' else 'change'
+        if span and (span.tag == 'equal') != (kind == 'equal'):
+            yield span
+            span = None
+        if span is None:
+            span = Span(tag, i1, j1, n)
+        span.add(tag, i1, i2, j1, j2, old, new)
+    if span:
+        yield span
+
+
+def stream_groups(spans, n):
+    '''
+    SequenceMatcher.get_grouped_opcodes() over a stream of Spans, the
+    opcodes carry the lines to print
+    '''
+    group = []
+    first = True
+    for span in spans:
+        if span.tag != 'equal':
+            group.append(span.piece(span.i1, span.i2, span.j1, span.j2))
+            first = False
+            continue
+        i1, i2, j1, j2 = span.i1, span.i2, span.j1, span.j2
+        if first:
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+            first = False
+        if i2 - i1 > 2 * n:
+            group.append(span.piece(i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append(span.piece(i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        tag, i1, i2, j1, j2, lines, _ = group[-1]
+        if tag == 'equal':
+            group[-1] = (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n), lines[:n], lines[:n])
+        yield group
+
+
+def format_unified(groups, fromfile, tofile, fromfiledate, tofiledate, lineterm='\n'):
+    started = False
+    for group in groups:
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '--- {}{}{}'.format(fromfile, fromdate, lineterm)
+            yield '+++ {}{}{}'.format(tofile, todate, lineterm)
+        first, last = group[0], group[-1]
+        file1_range = difflib._format_range_unified(first[1], last[2])
+        file2_range = difflib._format_range_unified(first[3], last[4])
+        yield '@@ -{} +{} @@{}'.format(file1_range, file2_range, lineterm)
+        for tag, i1, i2, j1, j2, a_lines, b_lines in group:
+            if tag == 'equal':
+                for line in a_lines:
+                    yield ' ' + line
+                continue
+            for line in a_lines:
+                yield '-' + line
+            for line in b_lines:
+                yield '+' + line
+
+
+def format_context(groups, fromfile, tofile, fromfiledate, tofiledate, lineterm='\n'):
+    prefix = dict(insert='+ ', delete='- ', replace='! ', equal='  ')
+    started = False
+    for group in groups:
+        if not started:
+            started = True
+            fromdate = '\t{}'.format(fromfiledate) if fromfiledate else ''
+            todate = '\t{}'.format(tofiledate) if tofiledate else ''
+            yield '*** {}{}{}'.format(fromfile, fromdate, lineterm)
+            yield '--- {}{}{}'.format(tofile, todate, lineterm)
+        first, last = group[0], group[-1]
+        yield '***************' + lineterm
+        file1_range = difflib._format_range_context(first[1], last[2])
+        yield '*** {} ****{}'.format(file1_range, lineterm)
+        if any(tag in {'replace', 'delete'} for tag, *_ in group):
+            for tag, i1, i2, j1, j2, a_lines, b_lines in group:
+                if tag != 'insert':
+                    for line in a_lines:
+                        yield prefix[tag] + line
+        file2_range = difflib._format_range_context(first[3], last[4])
+        yield '--- {} ----{}'.format(file2_range, lineterm)
+        if any(tag in {'replace', 'insert'} for tag, *_ in group):
+            for tag, i1, i2, j1, j2, a_lines, b_lines in group:
+                if tag != 'delete':
+                    for line in b_lines:
+                        yield prefix[tag] + line
+
+
+def diff_files(old_path, new_path, fromfile='', tofile='', fromfiledate='', tofiledate='', mode='unified', n=3,
+               window=None):
+    '''
+    Diff two files without reading them into memory, `window` lines of
+    each are indexed at a time. A missing path (None) is an empty file
+    '''
+    with MappedLines(old_path) as old, MappedLines(new_path) as new:
+        yield from diff_lines(old, new, fromfile, tofile, fromfiledate, tofiledate, mode, n, window)
+
+
+def diff_lines(old, new, fromfile='', tofile='', fromfiledate='', tofiledate='', mode='unified', n=3, window=None):
+    '''
+    diff_files() of two open MappedLines
+    '''
+    opcodes = stream_opcodes(old, new, window)
+    if mode == 'all':
+        for tag, i1, i2, j1, j2 in opcodes:
+            prefix = '  ' if tag == 'equal' else '- '
+            for line in old.lines(i1, i2):
+                yield prefix + line
+            if tag in {'replace', 'insert'}:
+                for line in new.lines(j1, j2):
+                    yield '+ ' + line
+        return
+    groups = stream_groups(stream_spans(old, new, opcodes, n), n)
+    if mode == 'context':
+        yield from format_context(groups, fromfile, tofile, fromfiledate, tofiledate)
+    else:
+        yield from format_unified(groups, fromfile, tofile, fromfiledate, tofiledate)
@@ -0,0 +1,315 @@
+import argparse
+import logging
+import random
+import socket
+import threading
+import time
+import paramiko
+
+'''
+Local stand-in for a fleet of RouterOS routers, built on paramiko's server
+interface. Every virtual device listens on its own port of 127.0.0.1 and
+answers the commands Mikrotik_update sends with RouterOS formatted output.
+Devices can be slow (latency per command), run out of disk space on
+download and go away for `downtime` seconds on reboot, after which the
+downloaded package and the pending firmware are installed.
+
+    python mikrotik_fake.py -n 200 --port 20000 --downtime 10
+
+prints the HOSTS list to put into conf.py and serves until Ctrl-C.
+'''
+
+# Package size checked against free-hdd-space on download, bytes
+PACKAGE_SIZE = 12 * 1024 ** 2
+
+# Binding the port again after a reboot: attempts and pause between them
+BIND_ATTEMPTS = 20
+BIND_RETRY = 0.1
+
+# RouterOS prints details right aligned on the colon
+DETAIL_WIDTH = 18
+
+
+def detail(**values):
+    lines = [f'{key.replace("_", "-"):>{DETAIL_WIDTH}}: {value}' for key, value in values.items()]
+    return '\r\n'.join(lines) + '\r\n\r\n'
+
+
+def size(value):
+    return f'{value / 1024 ** 2:.1f}MiB'
+
+
+def uptime(seconds):
+    text = ''
+    seconds = int(seconds)
+    for unit, length in (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60)):
+        count, seconds = divmod(seconds, length)
+        if count:
+            text += f'{count}{unit}'
+    return f'{text}{seconds}s'
+
+
+class Device():
+    '''
+    One virtual router: its software state and the listening socket
+    '''
+    def __init__(self, port, host_key, version='7.9.2', latest='7.10.1', firmware=None,
+                 model='RB760iGS', arch='mmips', free_space=PACKAGE_SIZE * 2,
+                 latency=0, downtime=5, download_time=0, internet=True):
+        self.port = port
+        self.host_key = host_key
+        self.version = version
+        self.latest = latest
+        self.firmware = firmware or version
+        self.upgrade_firmware = version
+        self.model = model
+        self.arch = arch
+        self.free_space = free_space
+        self.latency = latency
+        self.downtime = downtime
+        self.download_time = download_time
+        self.internet = internet
+        self.checked = False
+        self.downloaded = False
+        self.firmware_pending = False
+        # up for days, like a router in production
+        self.booted = time.monotonic() - random.uniform(1, 30) * 86400
+        self.lock = threading.Lock()
+        self.listener = None
+        self.transports = []
+
+    @property
+    def host(self):
+        return f'127.0.0.1:{self.port}'
+
+    def start(self):
+        '''
+        Listen on the port, raises OSError if it stays taken
+        '''
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        for attempt in range(BIND_ATTEMPTS):
+            try:
+                listener.bind(('127.0.0.1', self.port))
+                break
+            except OSError:
+                if attempt == BIND_ATTEMPTS - 1:
+                    listener.close()
+                    raise
+                time.sleep(BIND_RETRY)
+        listener.listen(16)
+        self.listener = listener
+        threading.Thread(target=self.accept, args=(listener,), daemon=True).start()
+
+    def stop(self):
+        if self.listener:
+            # close() alone leaves the port bound while accept() blocks on it
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.listener.close()
+            self.listener = None
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+
+    def accept(self, listener):
+        while True:
+            try:
+                client, address = listener.accept()
+            except OSError:
+                return
+            time.sleep(self.latency)
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            self.transports.append(transport)
+            try:
+                transport.start_server(server=DeviceServer(self))
+            except (paramiko.SSHException, EOFError, OSError):
+                transport.close()
+
+    def reboot(self):
+        '''
+        Go down for `downtime` seconds, install what is pending, come back
+        '''
+        time.sleep(0.1)
+        self.stop()
+        time.sleep(self.downtime * random.uniform(0.8, 1.2))
+        with self.lock:
+            if self.firmware_pending:
+                self.firmware = self.upgrade_firmware
+                self.firmware_pending = False
+            if self.downloaded:
+                self.version = self.latest
+                self.upgrade_firmware = self.latest
+                self.downloaded = False
+            self.checked = False
+            self.booted = time.monotonic()
+        try:
+            self.start()
+        except OSError as err:
+            logging.error(f'{self.host} can\'t listen after reboot [{err}]')
+
+    def execute(self, channel, script):
+        '''
+        Run a ';' separated command line and send back the output
+        '''
+        time.sleep(self.latency)
+        output = []
+        for command in script.split(';'):
+            command = command.strip().lstrip('/')
+            if command.startswith(':put '):
+                output.append(command[5:].strip('"') + '\r\n')
+            elif command:
+                if command == 'system package update download':
+                    time.sleep(self.download_time)
+                output.append(self.command(command))
+        if 'system reboot' in script:
+            threading.Thread(target=self.reboot, daemon=True).start()
+        try:
+            channel.sendall(''.join(output).encode('utf8'))
+            channel.send_exit_status(0)
+            # EOF, not close(): this runs while paramiko has yet to answer the 
+            # exec request, a close arriving first fails it on the client
+            channel.shutdown_write()
+        except (OSError, EOFError):
+            # the client does not wait for the output of a reboot
+            pass
+
+    def command(self, command):
+        with self.lock:
+            if command == 'system package update print':
+                return self.update_print()
+            if command == 'system package update check-for-updates':
+                if not self.internet:
+                    return detail(channel='stable', installed_version=self.version,
+                                  status='ERROR: could not resolve dns name')
+                self.checked = True
+                return self.update_print()
+            if command == 'system package update download':
+                return self.download()
+            if command == 'system routerboard print':
+                return detail(routerboard='yes', board_name=self.model, model=self.model, revision='r2',
+                              serial_number=f'FAKE{self.port}', firmware_type=self.arch,
+                              factory_firmware='6.45.9', current_firmware=self.firmware,
+                              upgrade_firmware=self.upgrade_firmware)
+            if command == 'system routerboard upgrade':
+                self.firmware_pending = True
+                return ''
+            if command == 'system resource print':
+                return detail(version=f'{self.version} (stable)', free_hdd_space=size(self.free_space),
+                              total_hdd_space=size(PACKAGE_SIZE * 4), architecture_name=self.arch,
+                              board_name=self.model, platform='MikroTik',
+                              uptime=uptime(time.monotonic() - self.booted))
+            if command == 'system reboot':
+                return ''
+        return 'bad command name\r\n'
+
+    def update_print(self):
+        if not self.checked:
+            return detail(channel='stable', installed_version=self.version)
+        if self.latest != self.version:
+            status = 'New version is available'
+        else:
+            status = 'System is already up to date'
+        return detail(channel='stable', installed_version=self.version,
+                      latest_version=self.latest, status=status)
+
+    def download(self):
+        if not self.checked or self.latest == self.version:
+            return detail(channel='stable', installed_version=self.version, status='System is already up to date')
+        if self.free_space < PACKAGE_SIZE:
+            return detail(channel='stable', installed_version=self.version, latest_version=self.latest,
+                          status='ERROR: not enough disk space')
+        self.downloaded = True
+        return detail(channel='stable', installed_version=self.version, latest_version=self.latest,
+                      status='Downloaded, please reboot router to upgrade it')
+
+
+class DeviceServer(paramiko.ServerInterface):
+    '''
+    Accepts any password and runs exec requests on the device
+    '''
+    def __init__(self, device):
+        self.device = device
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.device.execute, args=(channel, command.decode('utf8')), daemon=True).start()
+        return True
+
+
+class FakeFleet():
+    '''
+    `count` devices on consecutive ports. `outdated` and `disk_full` are the
+    shares of devices that have an update available and that have no room
+    for it, `latency` is added to every connect and command
+    '''
+    def __init__(self, count, port=20000, outdated=1.0, disk_full=0.0, latency=0,
+                 downtime=5, download_time=0, seed=None):
+        rng = random.Random(seed)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.devices = []
+        for index in range(count):
+            version = '7.9.2' if rng.random() < outdated else '7.10.1'
+            free_space = PACKAGE_SIZE // 2 if rng.random() < disk_full else PACKAGE_SIZE * 2
+            model, arch = rng.choice((('RB760iGS', 'mmips'), ('CCR1036-8G-2S+', 'tile'), ('RB4011iGS+', 'arm')))
+            self.devices.append(Device(port + index, self.host_key, version=version, model=model, arch=arch,
+                                       free_space=free_space, latency=latency, downtime=downtime,
+                                       download_time=download_time))
+
+    @property
+    def hosts(self):
+        return [device.host for device in self.devices]
+
+    def __enter__(self):
+        for device in self.devices:
+            device.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        for device in self.devices:
+            device.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake RouterOS ssh fleet for testing Mikrotik_update')
+    parser.add_argument('-n', '--count', type=int, default=10, help='number of devices [default: 10]')
+    parser.add_argument('-p', '--port', type=int, default=20000, help='port of the first device [default: 20000]')
+    parser.add_argument('--outdated', type=float, default=1.0,
+                        help='share of devices with an update available [default: 1.0]')
+    parser.add_argument('--disk-full', type=float, default=0.0,
+                        help='share of devices without space for the update [default: 0]')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of every connect and command, seconds [default: 0]')
+    parser.add_argument('--downtime', type=float, default=5, help='reboot downtime, seconds [default: 5]')
+    parser.add_argument('--download-time', type=float, default=0,
+                        help='time a package download takes, seconds [default: 0]')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # readiness probes open and drop tcp connections without an ssh banner
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    with FakeFleet(args.count, args.port, args.outdated, args.disk_full, args.latency,
+                   args.downtime, args.download_time) as fleet:
+        print(f'HOSTS = {fleet.hosts!r}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,99 @@
 import platform
 import subprocess
 import argparse
+import asyncio
+import random
+import select
+import socket
+import struct
 import time
 import sys
+import os
 import re
+import glob
+import gzip
+import json
+import shutil
+import threading
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from string import Template
+from urllib.parse import parse_qs, urlparse
+import numpy as np
 import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+from pping_stats import OUTAGE_AFTER, ProbeStats, format_event
 
-# The program uses built-in ping tools
+# The program pings from the process itself (ICMP socket, or TCP connect 
+# where ICMP is not allowed), on Windows it runs the built-in ping tool 
+# unless --engine native is given
 # Displays time-stamped responses
+# Probes are logged to a compact binary file (.ppl) by a writer thread that 
+# batches, fsyncs and rotates the files, old text logs can be converted 
+# with --convert and are still plotted as they are
+# With --live the capture can be watched in the browser while it runs
+# Outages, loss bursts and rolling latency stats go to <log>.events.jsonl,
+# --stats prints them for an existing log
 # When finished, it will display the chart in the browser
 
+# Probe status
+OK = 0
+TIMEOUT = 1
+UNREACHABLE = 2
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Native probe types, in the order 'auto' tries them
+PROBE_MODES = ('dgram', 'raw', 'tcp')
+
+# Binary log: a header (magic, format version, record size, start time, 
+# host, probe type) followed by fixed-width little-endian records, so a 
+# whole capture maps straight into a NumPy array. Lost probes have rtt 
+# LOST_RTT. Version 1 headers have no probe type
+LOG_MAGIC = b'PPNG'
+LOG_VERSION = 2
+LOG_HEADER = struct.Struct('<4sHHd64s8s')
+LOG_HEADERS = {1: struct.Struct('<4sHHd64s'), 2: LOG_HEADER}
+LOG_RECORD = struct.Struct('<qIIB3x')
+LOG_DTYPE = np.dtype({'names': ['timestamp', 'seq', 'rtt', 'status'],
+                      'formats': ['<i8', '<u4', '<u4', 'u1'],
+                      'offsets': [0, 8, 12, 16],
+                      'itemsize': LOG_RECORD.size})
+LOG_BLOCK = 256
+LOG_FLUSH_INTERVAL = 1.0
+
+# Log writer: buffered bytes per target that trigger a write, probes taken 
+# queued that wake the writer before the flush interval, seconds between 
+# fsyncs. Text lines are counted as LOG_TEXT_LINE bytes until formatted
+LOG_FLUSH_BYTES = 64 * 1024
+LOG_WRITE_BATCH = 4096
+LOG_TEXT_LINE = 64
+LOG_FSYNC_INTERVAL = 10.0
+LOST_RTT = 0xffffffff
+
+# Bytes of text log lines parsed at a time, and the number of points the 
+# chart is reduced to however long the capture is
+LOAD_CHUNK = 4 * 1024 ** 2
+PLOT_POINTS = 5000
+
+# Live view: records sent at most per poll, records shown when a browser 
+# joins a running capture, points kept on the chart, probes the rolling 
+# loss is computed over, poll period of the page in ms
+LIVE_BATCH = 10000
+LIVE_BACKLOG = 3600
+LIVE_POINTS = 3600
+LIVE_WINDOW = 60
+LIVE_POLL = 1000
+LIVE_PORT = 8050
+DOWNSAMPLERS = ('minmax', 'lttb')
+
+# One probe: wall-clock time it was sent, sequence number, round trip 
+# time in microseconds (None if lost) and status
+Probe = namedtuple('Probe', 'timestamp seq rtt status')
+
 
 def ping(host_or_ip, packets=1, timeout=1000):
     if platform.system() == 'Windows':
@@ -38,31 +122,966 @@ def ping(host_or_ip, packets=1, timeout=1000):
         # result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         # return result.returncode == 0
 
-def plot(fh, period=None):
-    with open(fh, 'r', encoding='utf8') as result:
-        pattern_online = re.compile(r'^(.+?) Ответ.*время.(\d*)мс')
-        pattern_offline = re.compile(r'^(.+?) Превышен')
-        time_date = []
-        time_ms = []
-        time_pass = []
-        for index, line in enumerate(result):
-            if period and index % period != 0:
+def checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def open_probe_socket(mode='auto'):
+    '''
+    Return (socket, mode) for the first probe type that is allowed here, 
+    tcp probes need no shared socket. Falling back to tcp in auto mode is 
+    reported, a TCP handshake is not an ICMP round trip
+    '''
+    for candidate in (PROBE_MODES if mode == 'auto' else (mode,)):
+        try:
+            if candidate == 'dgram':
+                return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), candidate
+            if candidate == 'raw':
+                return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), candidate
+            if mode == 'auto':
+                print('Warning: ICMP sockets are not available here, falling back to TCP connect probes, '
+                      'they time a TCP handshake instead of an ICMP echo', file=sys.stderr)
+            return None, candidate
+        except OSError:
+            # PermissionError without privileges, EPROTONOSUPPORT or EINVAL 
+            # where the socket type does not exist
+            if mode != 'auto':
+                raise
+
+
+def echo_request(ident, seq, size=56):
+    # payload starts with the send time, the rest is padding
+    payload = struct.pack('!Q', time.perf_counter_ns()).ljust(max(8, size), b'\0')
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum(header + payload), ident, seq) + payload
+
+
+def echo_reply(data, mode):
+    '''
+    Return (ident, seq) of an echo reply, None for anything else
+    '''
+    if mode == 'raw':
+        # raw sockets get the IP header too
+        data = data[(data[0] & 0x0f) * 4:]
+    if len(data) < 8:
+        return None
+    kind, code, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+    if kind != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+class Pinger():
+    '''
+    Sends one probe at a time from this process, so probes can go out at 
+    sub-second intervals and the round trip is measured with a monotonic 
+    nanosecond clock instead of parsed from ping output.
+
+    mode 'dgram' is unprivileged ICMP (Linux, allowed by 
+    net.ipv4.ping_group_range), 'raw' is a raw ICMP socket (root or 
+    administrator), 'tcp' measures a TCP handshake to `port`, a refused 
+    connection counts as a reply. 'auto' takes the first one that works
+    '''
+    def __init__(self, host, timeout=1.0, mode='auto', port=80, size=56):
+        self.host = host
+        self.address = socket.gethostbyname(host)
+        self.timeout = timeout
+        self.port = port
+        self.payload = size
+        self.ident = os.getpid() & 0xffff
+        self.seq = 0
+        self.sent = 0
+        self.received = 0
+        self.sock, self.mode = open_probe_socket(mode)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    @property
+    def loss(self):
+        return 1 - self.received / self.sent if self.sent else 0.0
+
+    def probe(self):
+        '''
+        Send one probe and wait for its reply, return Probe
+        '''
+        self.seq = (self.seq + 1) & 0xffff
+        self.sent += 1
+        timestamp = time.time()
+        if self.mode == 'tcp':
+            rtt, status = self.probe_tcp()
+        else:
+            rtt, status = self.probe_icmp(self.seq)
+        if status == OK:
+            self.received += 1
+        return Probe(timestamp, self.seq, rtt, status)
+
+    def probe_icmp(self, seq):
+        started = time.perf_counter_ns()
+        deadline = started + int(self.timeout * 1e9)
+        try:
+            self.sock.sendto(echo_request(self.ident, seq, self.payload), (self.address, 0))
+        except OSError:
+            return None, UNREACHABLE
+        while True:
+            left = (deadline - time.perf_counter_ns()) / 1e9
+            if left <= 0 or not select.select([self.sock], [], [], left)[0]:
+                return None, TIMEOUT
+            data, address = self.sock.recvfrom(2048)
+            received = time.perf_counter_ns()
+            reply = echo_reply(data, self.mode)
+            if address[0] != self.address or not reply:
                 continue
-            data = re.search(pattern_online, line)
-            if data:
-                x = int(data.group(2))
-                time_date.append(data.group(1))
-                time_ms.append(x)
-                time_pass.append('')
+            # the kernel replaces the identifier of dgram sockets
+            if reply[1] == seq and (self.mode == 'dgram' or reply[0] == self.ident):
+                return (received - started) // 1000, OK
+
+    def probe_tcp(self):
+        started = time.perf_counter_ns()
+        try:
+            with socket.create_connection((self.address, self.port), timeout=self.timeout):
+                pass
+        except ConnectionRefusedError:
+            pass
+        except socket.timeout:
+            return None, TIMEOUT
+        except OSError:
+            return None, UNREACHABLE
+        return (time.perf_counter_ns() - started) // 1000, OK
+
+
+def format_probe(probe, address, second=None):
+    '''
+    Log line of a native probe, read back by plot(). `second` is the 
+    formatted local time of the probe's whole second if already known
+    '''
+    if second is None:
+        second = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(probe.timestamp))
+    timestamp = f'{second}.{int(probe.timestamp * 1000) % 1000:03d}'
+    if probe.status == OK:
+        return f'{timestamp} Reply from {address}: seq={probe.seq} time={probe.rtt / 1000:.3f}ms'
+    if probe.status == TIMEOUT:
+        return f'{timestamp} Request timed out: seq={probe.seq}'
+    return f'{timestamp} Destination unreachable: seq={probe.seq}'
+
+
+def format_probes(probes, address, seconds=None):
+    '''
+    Log lines of many probes, or of ready text lines, as one string. The 
+    local time of a second is formatted once and kept in `seconds`, a dict 
+    that can be shared between calls
+    '''
+    seconds = {} if seconds is None else seconds
+    lines = []
+    for probe in probes:
+        if isinstance(probe, str):
+            lines.append(probe)
+            continue
+        current = int(probe.timestamp)
+        second = seconds.get(current)
+        if second is None:
+            second = seconds[current] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(current))
+        lines.append(format_probe(probe, address, second))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class BinaryLog():
+    '''
+    Append-only binary capture. Records are packed into a block buffer and 
+    written LOG_BLOCK at a time, or at least every `flush_interval` seconds 
+    so a live view can follow the file, flush() writes a partial block. 
+    `probe` is the probe type recorded in the header, '' if unknown
+    '''
+    def __init__(self, path, host, start=None, flush_interval=LOG_FLUSH_INTERVAL, probe=''):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.flushed = time.monotonic()
+        self.fh = open(self.path, 'ab')
+        if self.fh.tell() == 0:
+            self.fh.write(self.header(host, start or time.time(), probe))
+            self.fh.flush()
+        self.block = bytearray(LOG_RECORD.size * LOG_BLOCK)
+        self.count = 0
+
+    @staticmethod
+    def header(host, start, probe=''):
+        '''
+        Header of a new log, also used by the LogWriter segments
+        '''
+        return LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, LOG_RECORD.size, start,
+                               host.encode('utf8')[:64], probe.encode('ascii')[:8])
+
+    @staticmethod
+    def record(probe):
+        '''
+        Packed record of a Probe
+        '''
+        rtt = LOST_RTT if probe.rtt is None else min(probe.rtt, LOST_RTT - 1)
+        return LOG_RECORD.pack(int(probe.timestamp * 1e6), probe.seq, rtt, probe.status)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, probe):
+        offset = self.count * LOG_RECORD.size
+        self.block[offset:offset + LOG_RECORD.size] = self.record(probe)
+        self.count += 1
+        if self.count == LOG_BLOCK or time.monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def write_records(self, records):
+        '''
+        Append a structured array of LOG_DTYPE as it is
+        '''
+        self.flush()
+        self.fh.write(np.ascontiguousarray(records, dtype=LOG_DTYPE).tobytes())
+
+    def flush(self):
+        self.fh.write(memoryview(self.block)[:self.count * LOG_RECORD.size])
+        self.fh.flush()
+        self.count = 0
+        self.flushed = time.monotonic()
+
+    def close(self):
+        if not self.fh.closed:
+            self.flush()
+            self.fh.close()
+
+
+def open_log(path, mode='rb', **options):
+    '''
+    Open a log file, gzipped segments (.gz) transparently
+    '''
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode, **options)
+    return open(path, mode, **options)
+
+
+def log_segments(path):
+    '''
+    Files of a capture split by rotation, in order, from the path of any 
+    of them. The first segment has the name of the capture, the next ones 
+    .001, .002... before the suffix, closed segments may be gzipped
+    '''
+    path = Path(path)
+    name = path.name[:-3] if path.name.endswith('.gz') else path.name
+    stem, suffix = os.path.splitext(name)
+    if re.search(r'\.\d{3}$', stem):
+        stem = stem[:-4]
+        name = stem + suffix
+    first = [candidate for candidate in (path.parent / name, path.parent / (name + '.gz')) if candidate.exists()]
+    pattern = os.path.join(glob.escape(str(path.parent)), glob.escape(stem) + '.[0-9][0-9][0-9]' + suffix)
+    rest = [Path(segment) for segment in glob.glob(pattern) + glob.glob(pattern + '.gz')]
+    return first[:1] + sorted(rest, key=lambda segment: segment.name.removesuffix('.gz'))
+
+
+def read_log_header(path):
+    '''
+    Header of a binary log as a dict, with its `size` in bytes, None for 
+    a text log
+    '''
+    with open_log(path, 'rb') as fh:
+        data = fh.read(LOG_HEADER.size)
+    if len(data) < 8 or data[:4] != LOG_MAGIC:
+        return None
+    version = struct.unpack_from('<H', data, 4)[0]
+    header = LOG_HEADERS.get(version)
+    if header is None or len(data) < header.size:
+        raise ValueError(f'{path}: unsupported log format version {version}')
+    magic, version, record_size, start, host, *probe = header.unpack_from(data)
+    if record_size != LOG_RECORD.size:
+        raise ValueError(f'{path}: unsupported log format version {version}')
+    return {'version': version, 'size': header.size, 'start': start, 'host': host.rstrip(b'\0').decode('utf8'),
+            'probe': probe[0].rstrip(b'\0').decode('ascii') if probe else ''}
+
+
+def read_log_host(path):
+    '''
+    Host of a capture, from the header or from the log file name
+    '''
+    header = read_log_header(path)
+    return header['host'] if header else Path(path).name.split()[0]
+
+
+def read_binary_log(path):
+    '''
+    Map a binary log into a structured array without parsing, a record cut 
+    short by a crash is ignored. A gzipped segment is read into memory
+    '''
+    offset = read_log_header(path)['size']
+    if str(path).endswith('.gz'):
+        with gzip.open(path, 'rb') as fh:
+            data = fh.read()[offset:]
+        return np.frombuffer(data, dtype=LOG_DTYPE, count=len(data) // LOG_RECORD.size)
+    size = os.path.getsize(path) - offset
+    count = max(0, size) // LOG_RECORD.size
+    if not count:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.memmap(path, dtype=LOG_DTYPE, mode='r', offset=offset, shape=(count,))
+
+
+# One text log line of ping.exe (Russian) or of the native engine, lines 
+# that are neither a reply nor a loss do not match
+text_record = re.compile(
+    r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) '
+    r'(?:Ответ[^\n]*?время.(\d*)мс|Reply from [^\n]*?(?:seq=(\d+) )?time=([\d.]+)ms'
+    r'|(Превышен|Request timed out)|(?:Ответ от [^:\n]*: )?(Заданный узел недоступен|Destination unreachable))'
+    r'(?:[^\n]*?seq=(\d+))?', re.M)
+
+
+# Time zones change their offset from UTC on a quarter hour, so the offset 
+# is looked up once per run of timestamps in the same quarter, microseconds
+OFFSET_STEP = 15 * 60 * 1000000
+
+
+def utc_offsets(timestamps, local=False):
+    '''
+    Local time offset from UTC of each epoch microsecond timestamp, 
+    microseconds. With `local` the timestamps are local wall times, as the 
+    text logs write them, and the repeated hour of a change back to 
+    standard time is read as its first pass
+    '''
+    def offset(step):
+        if local:
+            moment = (datetime(1970, 1, 1) + timedelta(microseconds=step * OFFSET_STEP)).astimezone()
+        else:
+            moment = datetime.fromtimestamp(step * OFFSET_STEP / 1e6).astimezone()
+        return int(moment.utcoffset().total_seconds() * 1e6)
+
+    steps = timestamps // OFFSET_STEP
+    if not len(steps):
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(steps)) + 1))
+    offsets = np.array([offset(int(steps[start])) for start in starts], dtype=np.int64)
+    return np.repeat(offsets, np.diff(np.append(starts, len(steps))))
+
+
+def parse_text_chunk(text, first_seq=0):
+    '''
+    Records of a block of text log lines. The regex runs over the whole 
+    block at once and the columns are converted as arrays. ping.exe lines 
+    have no sequence number, they are numbered from `first_seq`
+    '''
+    matches = text_record.findall(text)
+    if not matches:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    columns = np.array(matches, dtype=str)
+    records = np.zeros(len(columns), dtype=LOG_DTYPE)
+    local = columns[:, 0].astype('datetime64[us]').astype('int64')
+    records['timestamp'] = local - utc_offsets(local, local=True)
+    ms = np.char.add(columns[:, 1], columns[:, 3])
+    ok = ms != ''
+    records['rtt'] = LOST_RTT
+    records['rtt'][ok] = np.round(ms[ok].astype(float) * 1000)
+    records['status'] = np.where(ok, OK, np.where(columns[:, 5] != '', UNREACHABLE, TIMEOUT))
+    seq = np.char.add(columns[:, 2], columns[:, 6])
+    numbered = seq != ''
+    records['seq'] = np.arange(first_seq, first_seq + len(columns))
+    records['seq'][numbered] = seq[numbered].astype(np.int64)
+    return records
+
+
+def iter_text_log(path, chunk=LOAD_CHUNK):
+    '''
+    Records of a text log, about `chunk` bytes of lines at a time
+    '''
+    first_seq = 1
+    with open_log(path, 'rt', encoding='utf8') as fh:
+        while True:
+            lines = fh.readlines(chunk)
+            if not lines:
+                return
+            records = parse_text_chunk(''.join(lines), first_seq)
+            first_seq += len(records)
+            yield records
+
+
+def convert_text_log(path, target=None):
+    '''
+    Convert a text log to the binary format, return the new path
+    '''
+    path = Path(path)
+    target = Path(target) if target else path.with_suffix('.ppl')
+    host = path.name.split()[0]
+    target.unlink(missing_ok=True)
+    with BinaryLog(target, host) as log:
+        for records in iter_text_log(path):
+            log.write_records(records)
+    return target
+
+
+def load_segment(path):
+    if read_log_header(path):
+        return read_binary_log(path)
+    chunks = list(iter_text_log(path))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=LOG_DTYPE)
+
+
+def load_log(path):
+    '''
+    Structured array of a capture in either format, with all its rotated 
+    segments. A single binary log is mapped without copying, a text log 
+    is parsed in chunks
+    '''
+    segments = [load_segment(segment) for segment in log_segments(path) or [path]]
+    return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+
+def minmax_indices(values, points):
+    '''
+    Indices of the minimum and the maximum of `points` / 2 equal buckets, 
+    every spike stays in the picture
+    '''
+    count = len(values)
+    if count <= points:
+        return np.arange(count)
+    buckets = max(1, points // 2)
+    size = -(-count // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:count] = values
+    padded = padded.reshape(buckets, size)
+    rows = np.flatnonzero(~np.isnan(padded).all(axis=1))
+    offsets = rows * size
+    index = np.concatenate((offsets + np.nanargmin(padded[rows], axis=1),
+                            offsets + np.nanargmax(padded[rows], axis=1)))
+    return np.unique(index)
+
+
+def lttb_indices(x, y, points):
+    '''
+    Largest-Triangle-Three-Buckets: from each bucket keep the point that 
+    spans the largest triangle with the point kept before it and the 
+    average of the next bucket, which keeps the shape with fewer points
+    '''
+    count = len(x)
+    if count <= points or points < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, count - 1, points - 1).astype(int)
+    index = np.zeros(points, dtype=np.int64)
+    index[-1] = count - 1
+    kept = 0
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        after = slice(stop, edges[bucket + 2] if bucket + 2 < len(edges) else count)
+        next_x, next_y = x[after].mean(), y[after].mean()
+        area = np.abs((x[kept] - next_x) * (y[start:stop] - y[kept])
+                      - (x[kept] - x[start:stop]) * (next_y - y[kept]))
+        kept = start + int(area.argmax())
+        index[bucket + 1] = kept
+    return index
+
+
+def event_indices(timestamps, mask, points):
+    '''
+    Indices of the flagged records, at most one per time bucket when there 
+    are more than `points` of them
+    '''
+    index = np.flatnonzero(mask)
+    if len(index) <= points:
+        return index
+    start, stop = timestamps[0], timestamps[-1] + 1
+    buckets = (timestamps[index] - start) * points // (stop - start)
+    return index[np.unique(buckets, return_index=True)[1]]
+
+
+class Target():
+    '''
+    One monitored host with its own probe interval and counters. 
+    `in_flight` holds a slot per probe in send order until its result is 
+    handed on
+    '''
+    def __init__(self, host, interval=1.0):
+        self.host = host
+        self.address = socket.gethostbyname(host)
+        self.interval = interval
+        self.sent = 0
+        self.received = 0
+        self.in_flight = deque()
+
+    @property
+    def loss(self):
+        return 1 - self.received / self.sent if self.sent else 0.0
+
+
+def load_targets(hosts, targets_file=None, interval=1.0):
+    '''
+    Targets from the command line hosts and a file with one 
+    "host [interval]" per line, # starts a comment
+    '''
+    specs = [(host, interval) for host in hosts]
+    if targets_file:
+        with open(targets_file, encoding='utf8') as fh:
+            for line in fh:
+                parts = line.split('#')[0].split()
+                if parts:
+                    specs.append((parts[0], float(parts[1]) if len(parts) > 1 else interval))
+    return [Target(host, host_interval) for host, host_interval in specs]
+
+
+class Monitor():
+    '''
+    Probes many targets from one asyncio event loop. All ICMP probes share 
+    one socket, replies are matched back by address and sequence number. 
+    Sequence numbers count per target address, so the probes of a target 
+    are numbered without gaps; targets that resolve to the same address 
+    share one counter to keep their replies apart. Each target is probed 
+    on its own interval, send times are jittered so targets with the same 
+    interval do not burst together, and a probe never waits for the 
+    previous one. Results are handed to all sinks as sink(target, probe) 
+    in the order the probes of a target were sent: a reply that beats an 
+    earlier probe waits until that one is answered or times out, so the 
+    logs stay sorted by time
+    '''
+    def __init__(self, targets, timeout=1.0, mode='auto', port=80, jitter=0.1, size=56):
+        self.targets = targets
+        self.timeout = timeout
+        self.port = port
+        self.jitter = jitter
+        self.size = size
+        self.sock, self.mode = open_probe_socket(mode)
+        self.ident = os.getpid() & 0xffff
+        self.seqs = {}
+        self.pending = {}
+        self.tasks = set()
+        self.sinks = []
+
+    async def run(self, sinks):
+        self.sinks = sinks
+        loop = asyncio.get_running_loop()
+        if self.sock:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock, self.read_replies)
+        try:
+            await asyncio.gather(*(self.schedule(target) for target in self.targets))
+        finally:
+            if self.sock:
+                loop.remove_reader(self.sock)
+                self.sock.close()
+
+    async def schedule(self, target):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(random.uniform(0, target.interval))
+        next_send = loop.time()
+        while True:
+            task = asyncio.ensure_future(self.probe(target))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            next_send += target.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            await asyncio.sleep(max(0, next_send - loop.time()))
+
+    async def probe(self, target):
+        seq = self.seqs[target.address] = (self.seqs.get(target.address, 0) + 1) & 0xffff
+        target.sent += 1
+        timestamp = time.time()
+        slot = [None]
+        target.in_flight.append(slot)
+        try:
+            if self.mode == 'tcp':
+                rtt, status = await self.probe_tcp(target)
             else:
-                data = re.search(pattern_offline, line)
-                time_date.append(data.group(1))
-                try:
-                    time_ms.append(time_ms[-1])
-                except:
-                    time_ms.append(0)
-                time_pass.append(1)
-    maximum = max(time_ms) * 1.10
+                rtt, status = await self.probe_icmp(target, seq)
+        except BaseException:
+            # a cancelled probe must not hold back the ones after it
+            target.in_flight.remove(slot)
+            self.release(target)
+            raise
+        if status == OK:
+            target.received += 1
+        slot[0] = Probe(timestamp, seq, rtt, status)
+        self.release(target)
+
+    def release(self, target):
+        '''
+        Hand the finished probes at the head of `in_flight` to the sinks
+        '''
+        while target.in_flight and target.in_flight[0][0] is not None:
+            probe = target.in_flight.popleft()[0]
+            for sink in self.sinks:
+                sink(target, probe)
+
+    async def probe_icmp(self, target, seq):
+        key = (target.address, seq)
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[key] = reply
+        started = time.perf_counter_ns()
+        try:
+            self.sock.sendto(echo_request(self.ident, seq, self.size), (target.address, 0))
+            received = await asyncio.wait_for(reply, self.timeout)
+            return (received - started) // 1000, OK
+        except asyncio.TimeoutError:
+            return None, TIMEOUT
+        except OSError:
+            return None, UNREACHABLE
+        finally:
+            self.pending.pop(key, None)
+
+    def read_replies(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received = time.perf_counter_ns()
+            reply = echo_reply(data, self.mode)
+            # the kernel replaces the identifier of dgram sockets
+            if not reply or (self.mode == 'raw' and reply[0] != self.ident):
+                continue
+            future = self.pending.get((address[0], reply[1]))
+            if future and not future.done():
+                future.set_result(received)
+
+    async def probe_tcp(self, target):
+        started = time.perf_counter_ns()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(target.address, self.port), self.timeout)
+            writer.close()
+        except ConnectionRefusedError:
+            pass
+        except asyncio.TimeoutError:
+            return None, TIMEOUT
+        except OSError:
+            return None, UNREACHABLE
+        return (time.perf_counter_ns() - started) // 1000, OK
+
+
+class Segment():
+    '''
+    One file of a capture, the writer thread owns it
+    '''
+    def __init__(self, path, number, host, start, binary, probe=''):
+        self.path = path
+        self.number = number
+        self.day = time.localtime(start)[:3]
+        self.fh = open(path, 'ab')
+        if binary and self.fh.tell() == 0:
+            self.fh.write(BinaryLog.header(host, start, probe))
+            self.fh.flush()
+        self.size = self.fh.tell()
+
+
+class LogWriter():
+    '''
+    Writes the probes of all targets from a background thread. write() only 
+    appends the probe to a queue; the thread takes the whole queue every 
+    `flush_interval` seconds or once LOG_WRITE_BATCH probes are waiting, 
+    packs them into a buffer per target (text lines are formatted a buffer 
+    at a time) and writes a buffer when it reaches LOG_FLUSH_BYTES or at 
+    the interval. The files are fsynced every `fsync_interval` seconds (0 
+    leaves it to the OS). A crash of pping loses at most `flush_interval` seconds 
+    of probes, a crash of the machine at most `fsync_interval`.
+    
+    Files are rotated after `rotate_size` bytes or at midnight with 
+    `rotate_daily`, closed segments are gzipped with `compress`. `probe` 
+    is the probe type written to binary headers
+    '''
+    STOP = object()
+
+    def __init__(self, paths, format='binary', addresses=None, flush_interval=LOG_FLUSH_INTERVAL,
+                 fsync_interval=LOG_FSYNC_INTERVAL, rotate_size=None, rotate_daily=False, compress=False,
+                 probe=''):
+        self.paths = {host: Path(path) for host, path in paths.items()}
+        self.binary = format == 'binary'
+        self.probe = probe
+        self.addresses = addresses or {}
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.rotate_size = rotate_size
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.buffers = {host: bytearray() if self.binary else [] for host in self.paths}
+        self.segments = {host: Segment(path, 0, host, time.time(), self.binary, probe)
+                         for host, path in self.paths.items()}
+        self.compressing = []
+        self.written = 0
+        self.writes = 0
+        self.error = None
+        self.queue = deque()
+        self.wake = threading.Event()
+        self.seconds = {}
+        self.thread = threading.Thread(target=self.run, name='log writer', daemon=True)
+        self.thread.start()
+
+    def current(self, host):
+        '''
+        Path of the segment being written for `host`
+        '''
+        return self.segments[host].path
+
+    def write(self, host, probe):
+        '''
+        Queue a probe, or a ready text line, of `host`
+        '''
+        if self.error:
+            raise self.error
+        self.queue.append((host, probe))
+        if len(self.queue) >= LOG_WRITE_BATCH:
+            self.wake.set()
+
+    def run(self):
+        try:
+            next_flush = time.monotonic() + self.flush_interval
+            next_fsync = time.monotonic() + self.fsync_interval
+            stop = False
+            while not stop:
+                self.wake.wait(max(0, next_flush - time.monotonic()))
+                self.wake.clear()
+                while self.queue:
+                    item = self.queue.popleft()
+                    if item is self.STOP:
+                        stop = True
+                    else:
+                        self.add(*item)
+                now = time.monotonic()
+                if now >= next_flush or stop:
+                    for host in self.buffers:
+                        self.flush(host)
+                    self.seconds.clear()
+                    next_flush = now + self.flush_interval
+                if self.fsync_interval and (now >= next_fsync or stop):
+                    for segment in self.segments.values():
+                        os.fsync(segment.fh.fileno())
+                    next_fsync = now + self.fsync_interval
+        except Exception as error:
+            self.error = error
+            raise
+
+    def add(self, host, probe):
+        if not isinstance(probe, str):
+            segment = self.segments[host]
+            if self.rotate_daily and time.localtime(probe.timestamp)[:3] != segment.day:
+                self.rotate(host, probe.timestamp)
+        buffer = self.buffers[host]
+        self.written += 1
+        if self.binary:
+            buffer += BinaryLog.record(probe)
+            full = len(buffer) >= LOG_FLUSH_BYTES
+        else:
+            buffer.append(probe)
+            full = len(buffer) * LOG_TEXT_LINE >= LOG_FLUSH_BYTES
+        if full:
+            self.flush(host)
+
+    def flush(self, host):
+        buffer = self.buffers[host]
+        if not buffer:
+            return
+        if self.binary:
+            data = buffer
+        else:
+            data = format_probes(buffer, self.addresses.get(host, host), self.seconds).encode('utf8')
+        segment = self.segments[host]
+        segment.fh.write(data)
+        segment.fh.flush()
+        segment.size += len(data)
+        self.writes += 1
+        buffer.clear()
+        if self.rotate_size and segment.size >= self.rotate_size:
+            self.rotate(host, time.time())
+
+    def rotate(self, host, start):
+        '''
+        Close the current segment of `host` and start the next one
+        '''
+        self.flush(host)
+        segment = self.segments[host]
+        self.close_segment(segment)
+        base = self.paths[host]
+        path = base.with_name(f'{base.stem}.{segment.number + 1:03d}{base.suffix}')
+        self.segments[host] = Segment(path, segment.number + 1, host, start, self.binary, self.probe)
+
+    def close_segment(self, segment, compress=None):
+        if self.fsync_interval:
+            os.fsync(segment.fh.fileno())
+        segment.fh.close()
+        if self.compress if compress is None else compress:
+            thread = threading.Thread(target=compress_segment, args=(segment.path,), daemon=True)
+            thread.start()
+            self.compressing.append(thread)
+
+    def close(self):
+        '''
+        Write everything queued, close the files and wait for compression, 
+        the last segments stay uncompressed
+        '''
+        self.queue.append(self.STOP)
+        self.wake.set()
+        self.thread.join()
+        for segment in self.segments.values():
+            if not segment.fh.closed:
+                self.close_segment(segment, compress=False)
+        for thread in self.compressing:
+            thread.join()
+
+
+def compress_segment(path):
+    '''
+    Replace a closed segment with its gzipped copy
+    '''
+    target = Path(str(path) + '.gz')
+    with open(path, 'rb') as source, gzip.open(target.with_name(target.name + '.part'), 'wb') as packed:
+        shutil.copyfileobj(source, packed, LOAD_CHUNK)
+    os.replace(target.with_name(target.name + '.part'), target)
+    os.remove(path)
+
+
+def writer_options(args):
+    return {'flush_interval': args.flush, 'fsync_interval': args.fsync,
+            'rotate_size': int(args.rotate_size * 1024 ** 2) if args.rotate_size else None,
+            'rotate_daily': args.rotate_daily, 'compress': args.compress}
+
+
+class LogSink():
+    '''
+    Logs every probe of every target to log/<host> <timestamp>.ppl, or 
+    to .txt lines with the text format, through a LogWriter
+    '''
+    def __init__(self, targets, timestamp, format='binary', probe='', **options):
+        Path('log').mkdir(exist_ok=True)
+        suffix = 'ppl' if format == 'binary' else 'txt'
+        self.writer = LogWriter({target.host: Path('log') / f'{target.host} {timestamp}.{suffix}'
+                                 for target in targets},
+                                format, {target.host: target.address for target in targets}, probe=probe, **options)
+
+    def __call__(self, target, probe):
+        self.writer.write(target.host, probe)
+
+    @property
+    def paths(self):
+        return self.writer.paths
+
+    @property
+    def current(self):
+        '''
+        Functions returning the segment being written for every host
+        '''
+        return {host: lambda host=host: self.writer.current(host) for host in self.writer.paths}
+
+    def close(self):
+        self.writer.close()
+
+
+class StatsSink():
+    '''
+    Feeds every probe to the statistics of its target. Outages and loss 
+    bursts are printed, all events go to <log>.events.jsonl next to the 
+    capture of the target
+    '''
+    def __init__(self, paths, outage_after=OUTAGE_AFTER):
+        self.stats = {host: ProbeStats(host, outage_after=outage_after) for host in paths}
+        self.files = {host: open(Path(path).with_suffix('.events.jsonl'), 'a', buffering=1, encoding='utf8')
+                      for host, path in paths.items()}
+
+    def __call__(self, target, probe):
+        host = target if isinstance(target, str) else target.host
+        self.log(host, self.stats[host].add(probe))
+
+    def log(self, host, events):
+        for event in events:
+            self.files[host].write(json.dumps(event, ensure_ascii=False) + '\n')
+            if event['event'] != 'stats':
+                print(format_event(event))
+
+    def close(self):
+        '''
+        Write and print the summary of every target
+        '''
+        for host, stats in self.stats.items():
+            self.log(host, stats.close())
+            summary = stats.summary()
+            self.files[host].write(json.dumps(summary, ensure_ascii=False) + '\n')
+            print(format_event(summary))
+            self.files[host].close()
+
+
+def log_stats(path, outage_after=OUTAGE_AFTER):
+    '''
+    Replay a finished capture through the statistics: print its outages, 
+    loss bursts and summary
+    '''
+    records = load_log(path)
+    stats = ProbeStats(read_log_host(path), outage_after=outage_after)
+    for timestamp, seq, rtt, status in zip((records['timestamp'] / 1e6).tolist(), records['seq'].tolist(),
+                                           records['rtt'].tolist(), records['status'].tolist()):
+        probe = Probe(timestamp, seq, None if status != OK else rtt, status)
+        for event in stats.add(probe):
+            if event['event'] != 'stats':
+                print(format_event(event))
+    for event in stats.close():
+        print(format_event(event))
+    print(format_event(stats.summary()))
+
+
+def print_sink(target, probe):
+    print(target.host, format_probe(probe, target.address))
+
+
+def monitor(args):
+    '''
+    Multi-target mode: probe every target until Ctrl-C, then print the 
+    summary of each one
+    '''
+    targets = load_targets(args.host, args.targets, args.period)
+    timestamp = time.strftime("%d.%m.%y %H-%M-%S", time.localtime(time.time()))
+    engine = Monitor(targets, timeout=args.timeout / 1000, mode=args.mode, port=args.port, jitter=args.jitter)
+    log = LogSink(targets, timestamp, args.format, engine.mode, **writer_options(args))
+    stats = StatsSink(log.paths, args.outage)
+    sinks = [log, stats] if args.quiet else [log, stats, print_sink]
+    print(f'Monitoring {len(targets)} targets with {engine.mode} probes')
+    dashboard = start_dashboard(log.current, args.live)
+    try:
+        asyncio.run(engine.run(sinks))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.close()
+        stats.close()
+        if dashboard:
+            dashboard.close()
+
+
+def local_datetime(timestamps):
+    '''
+    datetime64 in local time from epoch microseconds, as the text logs show it
+    '''
+    return (timestamps + utc_offsets(timestamps)).astype('datetime64[us]')
+
+
+def plot_series(records, points=PLOT_POINTS, method='minmax'):
+    '''
+    Chart data of a capture reduced to about `points` points: times and 
+    latency of the line, times of the drops, and the latency scale
+    '''
+    timestamps = records['timestamp']
+    time_pass = records['status'] != OK
+    # a lost probe has no latency, the line has a gap there
+    time_ms = np.where(time_pass, np.nan, records['rtt'] / 1000)
+    if method == 'lttb':
+        received = np.flatnonzero(~time_pass)
+        index = received[lttb_indices(timestamps[received], time_ms[received], points)]
+    else:
+        index = minmax_indices(time_ms, points)
+    drops = event_indices(timestamps, time_pass, points)
+    # keep a lost point at every drop so the line breaks there
+    index = np.union1d(index, drops)
+    maximum = np.nanmax(time_ms, initial=0) * 1.10
+    return local_datetime(timestamps[index]), time_ms[index], local_datetime(timestamps[drops]), maximum
+
+
+def plot(fh, points=PLOT_POINTS, method='minmax'):
+    time_date, time_ms, drop_date, maximum = plot_series(load_log(fh), points, method)
     
     # Draw ping chart
     trace_comp0 = go.Scattergl(
@@ -75,8 +1094,8 @@ def plot(fh, period=None):
 
     # Add drop bar
     trace_comp1 = go.Bar(
-        x=time_date, 
-        y=[maximum if x==1 else '' for x in time_pass],
+        x=drop_date, 
+        y=np.full(len(drop_date), maximum),
         hovertemplate =
         '<i>Time</i>: %{x}'+
         '<br>Latency: drop<extra></extra>',
@@ -85,39 +1104,404 @@ def plot(fh, period=None):
     
     fig = go.Figure([trace_comp0, trace_comp1])
     fig.update_layout(bargap=0, yaxis=dict(fixedrange=True))
-    ip = fh.split()[0].split("\\")[1]
-    fig.update_layout(title_text=f'{ip}')
+    fig.update_layout(title_text=read_log_host(fh))
     fig.show()
 
+def read_log_tail(path, since=-1, limit=LIVE_BATCH):
+    '''
+    Records appended to a log after byte offset `since` and the offset to 
+    ask for next time, only whole records or lines are returned. since=-1 
+    starts LIVE_BACKLOG records before the end. Only the new part of the 
+    file is read, however long the capture is
+    '''
+    size = os.path.getsize(path)
+    if not size:
+        return np.zeros(0, dtype=LOG_DTYPE), -1
+    header = read_log_header(path)
+    with open(path, 'rb') as fh:
+        if header:
+            offset = header['size']
+            end = offset + max(0, size - offset) // LOG_RECORD.size * LOG_RECORD.size
+            if since < 0:
+                since = end - LIVE_BACKLOG * LOG_RECORD.size
+            since = max(since, offset)
+            end = min(end, since + limit * LOG_RECORD.size)
+            fh.seek(since)
+            records = np.frombuffer(fh.read(end - since), dtype=LOG_DTYPE)
+            return records, end
+        if since < 0:
+            # about 70 bytes per text line, start at the first whole one
+            since = max(0, size - LIVE_BACKLOG * 70)
+            fh.seek(since)
+            if since:
+                since += len(fh.readline())
+        fh.seek(since)
+        data = fh.read(limit * 100)
+    data = data[:data.rfind(b'\n') + 1]
+    return parse_text_chunk(data.decode('utf8', 'replace')), since + len(data)
+
+
+# $-placeholders are filled in one pass, so a host name is never substituted into
+DASHBOARD_HTML = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>pping live</title>
+<script src="plotly.js"></script>
+<style>body {font-family: sans-serif; margin: 8px} #chart {height: 90vh}</style>
+</head><body>
+<select id="host"></select> <span id="status"></span>
+<div id="chart"></div>
+<script>
+const hosts = $hosts, window_size = $window, max_points = $points, poll_ms = $poll;
+let host, since, segment = '', generation = 0, lost, prev, jitter;
+const select = document.getElementById('host');
+hosts.forEach(h => select.add(new Option(h, h)));
+select.onchange = () => start(select.value);
+
+function start(name) {
+  host = name; since = -1; segment = ''; lost = []; prev = null; jitter = 0; generation++;
+  Plotly.newPlot('chart', [
+    {x: [], y: [], name: 'rtt, ms', mode: 'lines', line: {width: 1, shape: 'hvh'}},
+    {x: [], y: [], name: 'jitter, ms', mode: 'lines', line: {width: 1}, xaxis: 'x', yaxis: 'y2'},
+    {x: [], y: [], name: 'loss, % of ' + window_size, mode: 'lines', line: {width: 1}, xaxis: 'x', yaxis: 'y3'},
+  ], {grid: {rows: 3, columns: 1, roworder: 'top to bottom'}, title: {text: name},
+      xaxis: {type: 'date'}, yaxis: {rangemode: 'tozero'}, yaxis2: {rangemode: 'tozero'},
+      yaxis3: {range: [0, 100]}, margin: {t: 40}});
+  poll(generation);
+}
+
+function extend(data) {
+  // rolling loss and RFC 3550 jitter, updated with the new points only
+  const x = [], rtt = [], jit = [], loss = [];
+  let lost_count = lost.filter(Boolean).length;
+  for (let i = 0; i < data.t.length; i++) {
+    const value = data.rtt[i];
+    lost.push(value === null);
+    lost_count += value === null;
+    if (lost.length > window_size) lost_count -= lost.shift();
+    if (value !== null) {
+      if (prev !== null) jitter += (Math.abs(value - prev) - jitter) / 16;
+      prev = value;
+    }
+    x.push(data.t[i]); rtt.push(value); jit.push(jitter);
+    loss.push(100 * lost_count / lost.length);
+  }
+  if (x.length) Plotly.extendTraces('chart', {x: [x, x, x], y: [rtt, jit, loss]}, [0, 1, 2], max_points);
+}
+
+async function poll(current) {
+  if (current !== generation) return;
+  let more = false;
+  try {
+    const response = await fetch('data?host=' + encodeURIComponent(host) + '&since=' + since +
+                                 '&segment=' + encodeURIComponent(segment));
+    const data = await response.json();
+    if (current !== generation) return;
+    since = data.offset; segment = data.segment; more = data.more;
+    extend(data);
+    document.getElementById('status').textContent = data.t.length ? '' : 'waiting for probes';
+  } catch (error) {
+    document.getElementById('status').textContent = 'capture is not reachable';
+  }
+  setTimeout(() => poll(current), more ? 0 : poll_ms);
+}
+start(hosts[0]);
+</script></body></html>
+""")
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    '''
+    The page, plotly.js and the new records of a log as JSON
+    '''
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/':
+            # escaping '</' keeps a host name from closing the script element
+            hosts = json.dumps(list(self.server.logs)).replace('</', '<\\/')
+            page = DASHBOARD_HTML.substitute(hosts=hosts, window=LIVE_WINDOW, points=LIVE_POINTS, poll=LIVE_POLL)
+            return self.reply(page.encode('utf8'), 'text/html; charset=utf-8')
+        if url.path == '/plotly.js':
+            return self.reply(self.server.plotly_js, 'application/javascript', cache=True)
+        if url.path == '/data':
+            query = parse_qs(url.query)
+            path = self.server.logs.get(query.get('host', [''])[0])
+            if path is None:
+                return self.send_error(404, 'unknown host')
+            path = str(path() if callable(path) else path)
+            since = int(query.get('since', ['-1'])[0])
+            if since >= 0 and query.get('segment', [''])[0] != Path(path).name:
+                # the log was rotated, go on from the start of the new segment
+                since = 0
+            records, offset = read_log_tail(path, since)
+            lost = records['status'] != OK
+            timestamps = local_datetime(records['timestamp']).astype('datetime64[ms]').astype(str)
+            rtt = np.round(records['rtt'] / 1000, 3).astype(object)
+            rtt[lost] = None
+            data = {'offset': offset, 'segment': Path(path).name, 'more': len(records) == LIVE_BATCH,
+                    't': timestamps.tolist(), 'rtt': rtt.tolist()}
+            return self.reply(json.dumps(data).encode('utf8'), 'application/json')
+        self.send_error(404)
+
+    def reply(self, body, content_type, cache=False):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=86400' if cache else 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_dashboard(logs, port):
+    if port is None:
+        return None
+    dashboard = Dashboard(logs, port).start()
+    print(f'Live view on {dashboard.url}')
+    return dashboard
+
+
+class Dashboard():
+    '''
+    Live view of running captures on http://127.0.0.1:<port>/, `logs` maps 
+    host names to their log files, or to functions returning the segment 
+    being written. The page polls for the records added 
+    since its last request and extends the rtt, jitter and loss panels
+    '''
+    def __init__(self, logs, port, address='127.0.0.1'):
+        self.server = ThreadingHTTPServer((address, port), DashboardHandler)
+        self.server.daemon_threads = True
+        self.server.logs = logs
+        self.server.plotly_js = get_plotlyjs().encode('utf8')
+
+    @property
+    def url(self):
+        address, port = self.server.server_address[:2]
+        return f'http://{address}:{port}/'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
 def main():
     parser = argparse.ArgumentParser(description='Tools to ping with time stamp')
     parser.add_argument(
         "host", 
-        help="host or ip (str, address of host to ping)"
+        nargs='*',
+        help="host or ip (str, address of host to ping), several hosts are monitored together"
+    )
+    parser.add_argument(
+        "-t",
+        "--targets",
+        action='store',
+        help="file with one \"host [period]\" per line to monitor together"
+    )
+    parser.add_argument(
+        "-j",
+        "--jitter",
+        action='store',
+        default=0.1,
+        type=float,
+        help="random share of the period added to or taken from each send time "
+             "in multi-target mode [default: 0.1]"
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action='store_true',
+        default=False,
+        help="do not print every probe in multi-target mode"
     )
     parser.add_argument(
         "-p", 
         "--period", 
         action='store', 
         default=1, 
+        type=float,
+        help="pause between send packets, seconds, can be below 1 [default: 1]"
+    )
+    parser.add_argument(
+        "-w",
+        "--timeout",
+        action='store',
+        default=1000,
+        type=int,
+        help="reply timeout, milliseconds [default: 1000]"
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=('native', 'system'),
+        default='system' if platform.system() == 'Windows' else 'native',
+        help="native pings from this process, system runs ping.exe, Windows only "
+             "[default: system on Windows, native elsewhere]"
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=('auto', *PROBE_MODES),
+        default='auto',
+        help="native probe type: unprivileged ICMP, raw ICMP or TCP connect [default: auto]"
+    )
+    parser.add_argument(
+        "--port",
+        action='store',
+        default=80,
+        type=int,
+        help="port for TCP connect probes [default: 80]"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=('binary', 'text'),
+        default='binary',
+        help="log format of native pings, the system engine always logs text [default: binary]"
+    )
+    parser.add_argument(
+        "--convert",
+        nargs='+',
+        metavar='FILE',
+        help="convert text logs to the binary format next to them and exit"
+    )
+    parser.add_argument(
+        "--plot",
+        metavar='FILE',
+        help="show the chart of an existing log and exit"
+    )
+    parser.add_argument(
+        "--points",
+        action='store',
+        default=PLOT_POINTS,
+        type=int,
+        help=f"number of points the chart is reduced to [default: {PLOT_POINTS}]"
+    )
+    parser.add_argument(
+        "--downsample",
+        choices=DOWNSAMPLERS,
+        default='minmax',
+        help="minmax keeps the extremes of every interval, lttb keeps the shape [default: minmax]"
+    )
+    parser.add_argument(
+        "-l",
+        "--live",
+        nargs='?',
+        const=LIVE_PORT,
         type=int,
-        help="pause between send packets [default: 1]"
+        metavar='PORT',
+        help=f"serve a live view of the capture on http://127.0.0.1:PORT/ [default port: {LIVE_PORT}], "
+             "with --plot follow a log another pping is writing"
+    )
+    parser.add_argument(
+        "--outage",
+        action='store',
+        default=OUTAGE_AFTER,
+        type=float,
+        help=f"seconds of continuous loss reported as an outage [default: {OUTAGE_AFTER:g}]"
+    )
+    parser.add_argument(
+        "--stats",
+        metavar='FILE',
+        help="print the outages, loss bursts and summary of an existing log and exit"
+    )
+    parser.add_argument(
+        "--flush",
+        action='store',
+        default=LOG_FLUSH_INTERVAL,
+        type=float,
+        help=f"seconds between log writes, the most a crash of pping can lose [default: {LOG_FLUSH_INTERVAL:g}]"
+    )
+    parser.add_argument(
+        "--fsync",
+        action='store',
+        default=LOG_FSYNC_INTERVAL,
+        type=float,
+        help=f"seconds between fsyncs of the logs, 0 leaves it to the OS [default: {LOG_FSYNC_INTERVAL:g}]"
+    )
+    parser.add_argument(
+        "--rotate-size",
+        action='store',
+        type=float,
+        metavar='MIB',
+        help="start a new log segment after this many MiB"
+    )
+    parser.add_argument(
+        "--rotate-daily",
+        action='store_true',
+        default=False,
+        help="start a new log segment at midnight"
+    )
+    parser.add_argument(
+        "--compress",
+        action='store_true',
+        default=False,
+        help="gzip closed log segments"
     )
     args = parser.parse_args()
-    
-    timestamp = time.strftime("%d.%m.%y %H-%M-%S", time.localtime(time.time()))
-    fh = f'log\\{args.host} {timestamp}.txt'
-    
-    with open(fh, 'w', encoding='utf8') as result:
+    if args.stats:
+        return log_stats(args.stats, args.outage)
+    if args.plot and args.live is not None:
+        dashboard = start_dashboard({read_log_host(args.plot): args.plot}, args.live)
         try:
             while True:
-                text = ping(args.host)
-                result.write(text + '\n')
-                time.sleep(args.period)
+                time.sleep(1)
         except KeyboardInterrupt:
-            input('Catch ctrl-C!, press Enter to exit')
+            dashboard.close()
+        return
+    if args.plot:
+        return plot(args.plot, args.points, args.downsample)
+    if args.convert:
+        for path in args.convert:
+            print(f'{path} -> {convert_text_log(path)}')
+        return
+    if not args.host and not args.targets:
+        parser.error('give a host or --targets')
+    if len(args.host) > 1 or args.targets:
+        return monitor(args)
+    args.host = args.host[0]
+    
+    timestamp = time.strftime("%d.%m.%y %H-%M-%S", time.localtime(time.time()))
+    Path('log').mkdir(exist_ok=True)
+    binary = args.engine == 'native' and args.format == 'binary'
+    fh = str(Path('log') / f'{args.host} {timestamp}.{"ppl" if binary else "txt"}')
+
+    if args.engine == 'native':
+        pinger = Pinger(args.host, timeout=args.timeout / 1000, mode=args.mode, port=args.port)
+        print(f'Pinging {args.host} [{pinger.address}] with {pinger.mode} probes')
+    
+    writer = LogWriter({args.host: fh}, 'binary' if binary else 'text',
+                       {args.host: pinger.address} if args.engine == 'native' else None, **writer_options(args),
+                       probe=pinger.mode if args.engine == 'native' else '')
+    dashboard = start_dashboard({args.host: lambda: writer.current(args.host)}, args.live)
+    stats = StatsSink({args.host: fh}, args.outage) if args.engine == 'native' else None
+    try:
+        next_send = time.perf_counter()
+        while True:
+            if args.engine == 'native':
+                probe = pinger.probe()
+                print(format_probe(probe, pinger.address))
+                stats(args.host, probe)
+                writer.write(args.host, probe)
+            else:
+                writer.write(args.host, ping(args.host, timeout=args.timeout))
+            # keep a steady rate, the probe itself takes part of the period
+            next_send += args.period
+            time.sleep(max(0, next_send - time.perf_counter()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        if stats:
+            stats.close()
+        if dashboard:
+            dashboard.close()
+    input('Catch ctrl-C!, press Enter to exit')
     
-    plot(fh, period=args.period)
+    plot(fh, args.points, args.downsample)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+import math
+import time
+from collections import deque
+import numpy as np
+
+'''
+Online statistics of a ping capture. ProbeStats is fed one probe at a time
+with O(1) work per probe and keeps rolling latency percentiles, RFC 3550
+jitter, loss bursts and outages. It returns events (outage start and end,
+loss bursts, periodic rolling stats) as dicts ready to be logged, and a
+summary of the whole capture at the end.
+'''
+
+# Latency histogram: log-spaced buckets, each RESOLUTION wider than the one
+# before, from 1us up to the largest rtt a log can hold
+RESOLUTION = 1.02
+BUCKETS = int(math.log(2 ** 32) / math.log(RESOLUTION)) + 1
+
+# Probes the rolling percentiles and loss are taken over
+WINDOW = 300
+
+# Consecutive lost probes reported as a burst, and the loss time after
+# which a burst is an outage, seconds
+BURST_MIN = 2
+OUTAGE_AFTER = 5.0
+
+# Period of the rolling stats events, seconds
+REPORT_INTERVAL = 60.0
+
+PERCENTILES = (50, 95, 99)
+
+
+def local_time(timestamp):
+    text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+    return text + f'.{int(timestamp * 1000) % 1000:03d}'
+
+
+def bucket(rtt):
+    '''
+    Histogram bucket of an rtt in microseconds
+    '''
+    return min(BUCKETS - 1, int(math.log(max(rtt, 1)) / math.log(RESOLUTION)))
+
+
+# Representative rtt of every bucket, ms: the geometric middle of its bounds
+BUCKET_MS = RESOLUTION ** (np.arange(BUCKETS) + 0.5) / 1000
+
+
+class Histogram():
+    '''
+    Latency histogram with percentiles accurate to RESOLUTION. With `size`
+    it only counts the last `size` samples: the oldest is taken out when a
+    new one is added
+    '''
+    def __init__(self, size=None):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.total = 0
+        self.samples = deque() if size else None
+        self.size = size
+
+    def add(self, rtt):
+        index = bucket(rtt)
+        self.counts[index] += 1
+        self.total += 1
+        if self.samples is not None:
+            self.samples.append(index)
+            if len(self.samples) > self.size:
+                self.counts[self.samples.popleft()] -= 1
+                self.total -= 1
+
+    def percentile(self, q):
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * q / 100))
+        return round(float(BUCKET_MS[np.searchsorted(np.cumsum(self.counts), rank)]), 3)
+
+    def percentiles(self, qs=PERCENTILES):
+        return {f'p{q}': self.percentile(q) for q in qs}
+
+
+class ProbeStats():
+    '''
+    Statistics of one target. add() takes a probe (timestamp, seq, rtt in
+    microseconds or None, status) and returns the events it caused
+    '''
+    def __init__(self, host, window=WINDOW, outage_after=OUTAGE_AFTER, burst_min=BURST_MIN,
+                 report_interval=REPORT_INTERVAL):
+        self.host = host
+        self.outage_after = outage_after
+        self.burst_min = burst_min
+        self.report_interval = report_interval
+        self.histogram = Histogram()
+        self.rolling = Histogram(window)
+        self.window = deque(maxlen=window)
+        self.window_lost = 0
+        self.sent = 0
+        self.received = 0
+        self.minimum = None
+        self.maximum = None
+        self.rtt_sum = 0
+        self.previous = None
+        self.jitter = 0.0
+        self.burst_start = None
+        self.burst_length = 0
+        self.in_outage = False
+        self.bursts = 0
+        self.longest_burst = 0
+        self.outages = []
+        self.first = None
+        self.last = None
+        self.next_report = None
+
+    def add(self, probe):
+        events = []
+        timestamp, rtt = probe[0], probe[2]
+        if self.first is None:
+            self.first = timestamp
+            self.next_report = timestamp + self.report_interval
+        self.last = timestamp
+        self.sent += 1
+        lost = rtt is None
+        if len(self.window) == self.window.maxlen:
+            self.window_lost -= self.window[0]
+        self.window.append(lost)
+        self.window_lost += lost
+
+        if lost:
+            if not self.burst_length:
+                self.burst_start = timestamp
+            self.burst_length += 1
+            if not self.in_outage and timestamp - self.burst_start >= self.outage_after:
+                self.in_outage = True
+                events.append(self.event('outage start', self.burst_start, lost=self.burst_length))
+        else:
+            self.received += 1
+            self.histogram.add(rtt)
+            self.rolling.add(rtt)
+            self.minimum = rtt if self.minimum is None else min(self.minimum, rtt)
+            self.maximum = rtt if self.maximum is None else max(self.maximum, rtt)
+            self.rtt_sum += rtt
+            # RFC 3550: J += (|D| - J) / 16, D is the change of the transit time
+            if self.previous is not None:
+                self.jitter += (abs(rtt - self.previous) - self.jitter) / 16
+            self.previous = rtt
+            if self.burst_length:
+                events.extend(self.end_burst(timestamp))
+
+        if timestamp >= self.next_report:
+            self.next_report = timestamp + self.report_interval
+            events.append(self.event('stats', timestamp, **self.rolling_stats()))
+        return events
+
+    def end_burst(self, timestamp):
+        events = []
+        self.bursts += self.burst_length >= self.burst_min
+        self.longest_burst = max(self.longest_burst, self.burst_length)
+        if self.in_outage:
+            duration = timestamp - self.burst_start
+            self.outages.append((self.burst_start, duration))
+            events.append(self.event('outage end', timestamp, start=local_time(self.burst_start),
+                                     duration=round(duration, 3), lost=self.burst_length))
+        elif self.burst_length >= self.burst_min:
+            events.append(self.event('loss burst', self.burst_start, lost=self.burst_length,
+                                     duration=round(timestamp - self.burst_start, 3)))
+        self.in_outage = False
+        self.burst_length = 0
+        return events
+
+    def close(self):
+        '''
+        Events of a burst or outage still going on when the capture stops
+        '''
+        if self.burst_length and self.last is not None:
+            return self.end_burst(self.last)
+        return []
+
+    def rolling_stats(self):
+        stats = self.rolling.percentiles()
+        stats['jitter'] = round(self.jitter / 1000, 3)
+        stats['loss'] = round(100 * self.window_lost / len(self.window), 2) if self.window else 0.0
+        return stats
+
+    def summary(self):
+        longest = max(self.outages, key=lambda outage: outage[1], default=None)
+        summary = {'sent': self.sent, 'received': self.received,
+                   'loss': round(100 * (self.sent - self.received) / self.sent, 2) if self.sent else 0.0,
+                   'min': self.minimum / 1000 if self.minimum is not None else None,
+                   'avg': round(self.rtt_sum / self.received / 1000, 3) if self.received else None,
+                   'max': self.maximum / 1000 if self.maximum is not None else None,
+                   **self.histogram.percentiles(),
+                   'jitter': round(self.jitter / 1000, 3),
+                   'bursts': self.bursts, 'longest_burst': self.longest_burst,
+                   'outages': len(self.outages),
+                   'outage_time': round(sum(duration for start, duration in self.outages), 3)}
+        if longest:
+            summary['longest_outage'] = {'start': local_time(longest[0]), 'duration': round(longest[1], 3)}
+        return self.event('summary', self.last or time.time(), **summary)
+
+    def event(self, kind, timestamp, **values):
+        return {'event': kind, 'host': self.host, 'time': local_time(timestamp), **values}
+
+
+def format_event(event):
+    values = ' '.join(f'{key}={value}' for key, value in event.items() if key not in ('event', 'host', 'time'))
+    return f'{event["time"]} {event["host"]} {event["event"]}: {values}'
@@ -1,48 +1,323 @@
 import speedtest
 from datetime import datetime, timezone
+import argparse
 import json
 from pathlib import Path
+import random
+import signal
 import sqlite3
 import csv
+import itertools
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:
+    # Windows: runs are not locked against each other
+    fcntl = None
 
 '''
 This script is designed to be called on a schedule. It checks the internet speed, 
-writes data to the sqlite database, json and csv files for further diagnostics. 
-It also generates an html page with 5 latest results.
+writes data to the sqlite database, a json lines archive and a csv file for further
+diagnostics. It also generates an html page with 5 latest results. --sinks picks
+which of these outputs are written.
+
+With --daemon it stays running and measures every --interval seconds
+itself: the speedtest configuration and best server are kept between runs
+and the outputs stay open. A lock file keeps a scheduled
+run from measuring at the same time as another run or the daemon.
+
+With --servers and --source every listed server is measured from every
+listed local address in the same run: all of them are pinged at once,
+then download and upload are measured one after another, or all at once
+with --parallel to see what the uplinks carry together.
+
+--backfill feeds the json files of older runs, or json lines archives,
+through the outputs in batches, to fill a new database or archive.
 '''
 
+DB_PATH = 'result_speedtest.db'
+CSV_PATH = 'results/Total.csv'
+# strftime pattern of the local time of a result, a file per month
+JSONL_PATH = 'results/%Y-%m.jsonl'
+HTML_PATH = 'last_result.html'
+LOCK_PATH = 'pyspeedtest.lock'
+
+# Daemon schedule: seconds between runs, random delay added to each run so
+# boxes started together don't test at the same moment, and how long the
+# server list and best server are reused
+INTERVAL = 300
+JITTER = 30
+SERVER_TTL = 3600
+
+# Results passed to the outputs at a time by --backfill
+BACKFILL_BATCH = 1000
+
+# PRAGMA user_version of the current schema: 0 is the old untyped
+# `speedtest` table with text date and time columns, 1 has no interface
+SCHEMA_VERSION = 2
+
+COLUMNS = 'ts, server_id, server, interface, ping, download, upload, url'
+
+# One result of get_speedtest in the units it is stored in: `ts` is a UTC
+# epoch, `date` and `time` are local, speeds are in Mbit/s and `result`
+# is the dict of speedtest
+Measurement = namedtuple('Measurement', 'ts date time ping download upload url server_id server interface result')
+
+
 class SpeedDB():
+    '''
+    Results database. The connection is opened once and kept until close(),
+    the database runs in WAL mode so the page generator can read while a
+    run writes, and an older file is migrated to the current schema when
+    it is opened. Measurements are stored with a UTC epoch timestamp
+    (`ts`) that is indexed, so the latest rows and the rows of a time
+    range are read from the index instead of sorting the whole table.
+    Reads can be limited to one server and one interface, the source
+    address a test ran from or None for the default route
+    '''
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = None
+
     def __enter__(self):
-        if Path('result_speedtest.db').is_file():
-            self.conn = sqlite3.connect('result_speedtest.db')
-            self.cur = self.conn.cursor()
-        else:
-            self.conn = sqlite3.connect('result_speedtest.db')
-            self.cur = self.conn.cursor()
-            self.cur.execute('''create table speedtest (
-                date,
-                time,
-                ping,
-                download,
-                upload,
-                url unique)''')
-            self.conn.commit()
+        self.open()
         return self
 
     def __exit__(self, type, value, traceback):
-        self.conn.commit()
-        self.conn.close()
+        self.close()
 
-    def add_data(self, data):
-        query = 'insert into speedtest values (?, ?, ?, ?, ?, ?)'
-        self.cur.execute(query, data)
+    def open(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.migrate()
+        return self
+
+    def commit(self):
         self.conn.commit()
-        return True
 
-    def get_last_data(self):
-        query = 'SELECT * FROM speedtest ORDER BY date DESC, time DESC LIMIT 5'
-        last_data = self.cur.execute(query).fetchall()
-        return last_data
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def migrate(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self.conn:
+            if version < 1:
+                self.create_measurements()
+            if version < 2:
+                self.conn.execute('alter table measurements add column interface text')
+                self.conn.execute('create index if not exists measurements_server '
+                                  'on measurements (server_id, interface, ts)')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def create_measurements(self):
+        # Schema version 1, with the rows of a legacy `speedtest` table
+        self.conn.execute('''create table if not exists measurements (
+            id integer primary key,
+            ts integer not null,
+            server_id integer,
+            server text,
+            ping real not null,
+            download real not null,
+            upload real not null,
+            url text unique)''')
+        self.conn.execute('create index if not exists measurements_ts on measurements (ts)')
+        legacy = self.conn.execute(
+            "select 1 from sqlite_master where type = 'table' and name = 'speedtest'").fetchone()
+        if legacy:
+            # date 2021.02.12 and time 13:56 were local time
+            self.conn.execute('''insert or ignore into measurements (ts, ping, download, upload, url)
+                select cast(strftime('%s', replace(date, '.', '-') || ' ' || time, 'utc') as integer),
+                       ping, download, upload, url
+                from speedtest''')
+            self.conn.execute('drop table speedtest')
+
+    def known_urls(self, urls):
+        '''
+        The share urls of `urls` that are stored already
+        '''
+        urls = list(urls)
+        known = set()
+        # well below the bound variable limit of older SQLite builds
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            query = f'select url from measurements where url in ({", ".join("?" * len(chunk))})'
+            known.update(url for url, in self.conn.execute(query, chunk))
+        return known
+
+    def add_many(self, measurements):
+        '''
+        Store Measurements, `ts` is a UTC epoch and speeds are in Mbit/s.
+        One already stored (same share url) is skipped. They are committed
+        by commit() or when the database is closed
+        '''
+        self.conn.executemany(f'insert or ignore into measurements ({COLUMNS}) values (?, ?, ?, ?, ?, ?, ?, ?)',
+                              ((m.ts, m.server_id, m.server, m.interface, m.ping, m.download, m.upload, m.url)
+                               for m in measurements))
+
+    @staticmethod
+    def where(conditions, server_id=None, interface=None):
+        # `conditions` and the server and interface filters as a where clause
+        params = []
+        if server_id is not None:
+            conditions = conditions + ['server_id = ?']
+            params.append(server_id)
+        if interface is not None:
+            conditions = conditions + ['interface = ?']
+            params.append(interface)
+        return (' where ' + ' and '.join(conditions)) if conditions else '', params
+
+    def get_last(self, count=5, server_id=None, interface=None):
+        '''
+        The latest `count` measurements, newest first
+        '''
+        where, params = self.where([], server_id, interface)
+        query = f'select {COLUMNS} from measurements{where} order by ts desc limit ?'
+        return self.conn.execute(query, params + [count]).fetchall()
+
+    def get_range(self, start, end, server_id=None, interface=None):
+        '''
+        Measurements with start <= ts < end, oldest first
+        '''
+        where, params = self.where(['ts >= ?', 'ts < ?'], server_id, interface)
+        query = f'select {COLUMNS} from measurements{where} order by ts'
+        return self.conn.execute(query, [start, end] + params).fetchall()
+
+    def get_stats(self, start, end, server_id=None, interface=None):
+        '''
+        Count and min/avg/max of ping, download and upload for start <= ts < end
+        '''
+        where, params = self.where(['ts >= ?', 'ts < ?'], server_id, interface)
+        row = self.conn.execute(f'''select count(*),
+            min(ping), avg(ping), max(ping),
+            min(download), avg(download), max(download),
+            min(upload), avg(upload), max(upload)
+            from measurements{where}''', [start, end] + params).fetchone()
+        stats = {'count': row[0]}
+        for index, name in enumerate(('ping', 'download', 'upload')):
+            values = row[1 + 3 * index:4 + 3 * index]
+            stats[name] = dict(zip(('min', 'avg', 'max'), (round(value, 2) if value is not None else None
+                                                           for value in values)))
+        return stats
+
+    def get_last_data(self, count=5):
+        '''
+        get_last() as (date, time, ping, download, upload, url) in local
+        time, the rows of the html page
+        '''
+        rows = []
+        for ts, server_id, server, interface, ping, download, upload, url in self.get_last(count):
+            date, time = datetime.fromtimestamp(ts).strftime('%Y.%m.%d %H:%M').split()
+            rows.append((date, time, round(ping), download, upload, url))
+        return rows
+
+
+class SpeedtestRunner():
+    '''
+    Keeps one speedtest.Speedtest between runs. The configuration, the
+    server list and the best server are fetched on the first run, again
+    after `ttl` seconds and after a failed run. Other runs only ping the
+    chosen server before measuring download and upload. `source` is the
+    local address to test from, None for the default route
+    '''
+    def __init__(self, servers=None, threads=None, ttl=SERVER_TTL, source=None):
+        self.servers = servers
+        self.threads = threads
+        self.ttl = ttl
+        self.source = source
+        self.speedtest = None
+        self.best = None
+        self.expires = 0
+
+    def __str__(self):
+        server = ','.join(map(str, self.servers)) if self.servers else 'best server'
+        return f'{server} from {self.source}' if self.source else server
+
+    def refresh(self):
+        self.speedtest = speedtest.Speedtest(source_address=self.source)
+        self.speedtest.get_servers(self.servers)
+        self.best = self.speedtest.get_best_server()
+        self.expires = time.monotonic() + self.ttl
+
+    def prepare(self):
+        '''
+        Pick the server, or ping the one picked before
+        '''
+        try:
+            if self.speedtest is None or time.monotonic() >= self.expires:
+                self.refresh()
+            else:
+                s = self.speedtest
+                # Fresh results (timestamp, share url) on the kept client
+                s.results = speedtest.SpeedtestResults(client=s.config['client'], opener=s._opener,
+                                                       secure=s._secure)
+                s.get_best_server([self.best])
+        except Exception:
+            self.speedtest = None
+            raise
+
+    def measure(self):
+        '''
+        Download and upload against the server of prepare(), returns the
+        results dict of speedtest with the source address as `interface`
+        '''
+        try:
+            self.speedtest.download(threads=self.threads)
+            self.speedtest.upload(threads=self.threads)
+            self.speedtest.results.share()
+        except Exception:
+            self.speedtest = None
+            raise
+        return dict(self.speedtest.results.dict(), interface=self.source)
+
+    def run(self):
+        self.prepare()
+        return self.measure()
+
+
+def make_runners(servers=None, sources=None, threads=None, ttl=SERVER_TTL):
+    '''
+    A runner for every server id in `servers` from every address in
+    `sources`, None picks the best server or uses the default route
+    '''
+    return [SpeedtestRunner([server] if server is not None else None, threads, ttl, source)
+            for server, source in itertools.product(servers or [None], sources or [None])]
+
+
+def run_all(runners, parallel=False):
+    '''
+    Ping the servers of all `runners` at once, then measure throughput one
+    runner at a time, or all at once if `parallel`. Returns the results of
+    the runners that succeeded, a failed one is reported and left out so
+    one dead uplink doesn't cost the results of the others
+    '''
+    def failed(runner, error):
+        print(f'{datetime.now():%Y-%m-%d %H:%M:%S} speedtest {runner} failed: {error}', file=sys.stderr)
+
+    def attempt(step, runner):
+        try:
+            return True, step(runner)
+        except (speedtest.SpeedtestException, OSError) as error:
+            failed(runner, error)
+            return False, None
+
+    with ThreadPoolExecutor(len(runners)) as pool:
+        prepared = pool.map(lambda runner: attempt(SpeedtestRunner.prepare, runner), runners)
+        ready = [runner for runner, (ok, _) in zip(runners, list(prepared)) if ok]
+        if parallel:
+            measured = list(pool.map(lambda runner: attempt(SpeedtestRunner.measure, runner), ready))
+        else:
+            measured = [attempt(SpeedtestRunner.measure, runner) for runner in ready]
+    return [result for ok, result in measured if ok]
 
 
 def get_speedtest(host=None):
@@ -54,69 +329,49 @@ def get_speedtest(host=None):
     # If you want to use a single threaded test
     # threads = 1
 
-    s = speedtest.Speedtest()
-    s.get_servers(servers)
-    s.get_best_server()
-    s.download(threads=threads)
-    s.upload(threads=threads)
-    s.results.share()
-    result = s.results.dict()
-
-    return result
+    return SpeedtestRunner(servers, threads).run()
 
 
 def convert_result_speedtest(result_dict):
     """
-    Convert dict received from get_speedtest function, to
-    {
+    Convert dict received from get_speedtest function to a Measurement
+    (
         date: 2021.02.12
-        time: 13:56:26
-        ping: 116
+        time: 13:56
+        ping: 116.2
         download: 48.75
         upload: 20.09
         url: https://www.speedtest.net/result/10916674697
-    }
+        ...
+    )
     """
     def convert_to_mbps(bps):
         return round(bps/1000000, 2)
 
-    def convert_date(_date):
-        _date = datetime.strptime(_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-        _date = _date.replace(tzinfo=timezone.utc).astimezone(tz=None)
-        _date = _date.strftime('%Y.%m.%d %H:%M').split()
-        return _date
-
-    date, time = convert_date(result_dict['timestamp'])
-    ping = int(result_dict['ping'])
+    timestamp = datetime.strptime(result_dict['timestamp'], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    date, time = timestamp.astimezone(tz=None).strftime('%Y.%m.%d %H:%M').split()
     download = convert_to_mbps(result_dict['download'])
     upload = convert_to_mbps(result_dict['upload'])
     url = result_dict['share'][:-4].replace('http', 'https')
-    with SpeedDB() as db:
-        db.add_data((date, time, ping, download, upload, url))
+    server = result_dict.get('server', {})
+    return Measurement(int(timestamp.timestamp()), date, time, result_dict['ping'], download, upload, url,
+                       int(server['id']) if server.get('id') else None, server.get('sponsor'),
+                       result_dict.get('interface'), result_dict)
 
-    return (date, time, ping, download, upload, url)
 
+def open_csv(path=CSV_PATH):
+    '''
+    The csv file opened for appending, a new one starts with the header
+    '''
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    new = not Path(path).is_file()
+    fh = open(path, 'a', newline='')
+    if new:
+        csv.writer(fh).writerow(('date', 'time', 'ping', 'download', 'upload', 'url'))
+    return fh
 
-def save_result_to_json(result_dict, date, time):
-    Path("results").mkdir(parents=True, exist_ok=True)
-    with open(f'results/{date}_{time}.json', 'w') as fh:
-        json.dump(result_dict, fh, indent=4)
 
-
-def write_to_csv(convert_result):
-    if Path('results/Total.csv').is_file():
-        fh = open('results/Total.csv', 'a', newline='')
-    else:
-        fh = open('results/Total.csv', 'w', newline='')
-        writer = csv.writer(fh)
-        writer.writerow(('date', 'time', 'ping', 'download', 'upload', 'url'))
-
-    writer = csv.writer(fh)
-    writer.writerow(convert_result)
-    fh.close()
-
-
-def make_html():
+def make_html(db, path=HTML_PATH):
     head = '''<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
 <html>
  <head>
@@ -170,25 +425,276 @@ def make_html():
     end = '''  </table>
  </body>
 </html>'''
-    with open('last_result.html', 'w', encoding='utf8') as fh:
+    with open(path, 'w', encoding='utf8') as fh:
         fh.write(head)
-        with SpeedDB() as db:
-            list_results = db.get_last_data()
-
-        for line in list_results:
+        for line in db.get_last_data():
             fh.write(row_template.format(*line))
         fh.write(end)
 
 
+class DBSink():
+    '''
+    Stores measurements in the SpeedDB `db`, a commit per batch
+    '''
+    def __init__(self, db):
+        self.db = db
+
+    def __call__(self, measurements):
+        self.db.add_many(measurements)
+        self.db.commit()
+
+    def close(self):
+        pass
+
+
+class JsonlSink():
+    '''
+    Appends the speedtest dict of every measurement as a line to a json
+    lines archive. `path` is a strftime pattern of the local time of the
+    measurement, the file changes when the name does and stays open until
+    then
+    '''
+    def __init__(self, path=JSONL_PATH):
+        self.pattern = path
+        self.path = None
+        self.fh = None
+
+    def __call__(self, measurements):
+        for measurement in measurements:
+            path = datetime.fromtimestamp(measurement.ts).strftime(self.pattern)
+            if path != self.path:
+                self.close()
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                self.fh = open(path, 'a', encoding='utf8')
+                self.path = path
+            self.fh.write(json.dumps(measurement.result, ensure_ascii=False) + '\n')
+        if self.fh is not None:
+            self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+            self.path = None
+
+
+class CsvSink():
+    '''
+    Appends a row per measurement to the csv file, kept open
+    '''
+    def __init__(self, path=CSV_PATH):
+        self.fh = open_csv(path)
+        self.writer = csv.writer(self.fh)
+
+    def __call__(self, measurements):
+        self.writer.writerows((m.date, m.time, int(m.ping), m.download, m.upload, m.url) for m in measurements)
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class HtmlSink():
+    '''
+    Rewrites the page of the latest results from the SpeedDB `db` once
+    per batch
+    '''
+    def __init__(self, db, path=HTML_PATH):
+        self.db = db
+        self.path = path
+
+    def __call__(self, measurements):
+        make_html(self.db, self.path)
+
+    def close(self):
+        pass
+
+
+# Outputs by --sinks name, as functions of the open SpeedDB and the
+# command line options. They are written in this order, the page is made
+# from the database so it comes after it
+SINKS = {
+    'db': lambda db, args: DBSink(db),
+    'jsonl': lambda db, args: JsonlSink(args.jsonl),
+    'csv': lambda db, args: CsvSink(args.csv),
+    'html': lambda db, args: HtmlSink(db, args.html),
+}
+
+
+class Pipeline():
+    '''
+    The sinks `names` of SINKS, opened once. Calling it with a list of
+    speedtest results converts them and hands the whole batch to every
+    sink, so a batch costs each output one write and one flush. With
+    `skip_known` the results whose share url is in the database already
+    are left out of the batch for all sinks, returns the number passed on
+    '''
+    def __init__(self, names, args):
+        self.db = SpeedDB(args.db).open() if {'db', 'html'} & set(names) else None
+        self.sinks = [SINKS[name](self.db, args) for name in SINKS if name in names]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __call__(self, results, skip_known=False):
+        measurements = [convert_result_speedtest(result) for result in results]
+        if skip_known and self.db is not None:
+            seen = self.db.known_urls(measurement.url for measurement in measurements)
+            new = []
+            for measurement in measurements:
+                if measurement.url not in seen:
+                    seen.add(measurement.url)
+                    new.append(measurement)
+            measurements = new
+        if measurements:
+            for sink in self.sinks:
+                sink(measurements)
+        return len(measurements)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        if self.db is not None:
+            self.db.close()
+
+
+def read_results(paths):
+    '''
+    Speedtest dicts from the json files of older runs and from json lines
+    archives (.jsonl)
+    '''
+    for path in paths:
+        with open(path, encoding='utf8') as fh:
+            if str(path).endswith('.jsonl'):
+                for line in fh:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield json.load(fh)
+
+
+def backfill(paths, pipeline, batch=BACKFILL_BATCH):
+    '''
+    Pass the results of `paths` through the pipeline `batch` at a time,
+    leaving out those the database has already, so a backfill can be
+    repeated as long as the db sink is one of the sinks. Returns how many
+    results were read and how many were written
+    '''
+    results = read_results(paths)
+    count = written = 0
+    while chunk := list(itertools.islice(results, batch)):
+        written += pipeline(chunk, skip_known=True)
+        count += len(chunk)
+    return count, written
+
+
+def lock(path=LOCK_PATH):
+    '''
+    Take an exclusive lock on `path` for the life of the process, returns
+    the open lock file or None if another run holds it
+    '''
+    fh = open(path, 'a')
+    if fcntl is None:
+        return fh
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fh.close()
+        return None
+    return fh
+
+
+def daemon(args):
+    '''
+    Measure every `args.interval` seconds plus up to `args.jitter` until
+    stopped. A failed run is reported and the schedule goes on, slots
+    missed by a long run are skipped rather than run back to back
+    '''
+    # Leave through the with blocks on kill, so the database is closed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    runners = make_runners(args.servers, args.source, args.threads, args.server_ttl)
+    with Pipeline(args.sinks, args) as pipeline:
+        slot = time.time()
+        while True:
+            try:
+                results = run_all(runners, args.parallel)
+                if results:
+                    pipeline(results)
+            except Exception as error:
+                # A bug or a full disk must not end the daemon, the next slot tries again
+                print(f'{datetime.now():%Y-%m-%d %H:%M:%S} run failed: {error!r}', file=sys.stderr)
+            slot += args.interval
+            now = time.time()
+            if now > slot:
+                slot += (now - slot) // args.interval * args.interval + args.interval
+            time.sleep(max(0.0, slot + random.uniform(0, args.jitter) - time.time()))
+
+
 def main():
-    result_speedtest = get_speedtest()
-    convert_result = convert_result_speedtest(result_speedtest)
-    date = convert_result[0].replace('.', '-')
-    time = convert_result[1].replace(':', '-')
-    save_result_to_json(result_speedtest, date, time)
-    write_to_csv(convert_result)
-    make_html()
+    parser = argparse.ArgumentParser(description='Measure the internet speed and store the result')
+    parser.add_argument('-d', '--daemon', action='store_true', default=False,
+                        help='keep running and measure every --interval seconds')
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL,
+                        help=f'daemon: seconds between measurements [default: {INTERVAL}]')
+    parser.add_argument('--jitter', type=float, default=JITTER,
+                        help=f'daemon: up to this many seconds added to each start [default: {JITTER}]')
+    parser.add_argument('--server-ttl', type=float, default=SERVER_TTL,
+                        help=f'daemon: seconds the best server is reused [default: {SERVER_TTL}]')
+    parser.add_argument('--lock', default=LOCK_PATH,
+                        help=f'lock file that keeps runs from overlapping [default: {LOCK_PATH}]')
+    parser.add_argument('-s', '--servers', type=int, nargs='+', metavar='ID',
+                        help='measure against each of these server ids [default: the best server]')
+    parser.add_argument('--source', nargs='+', metavar='ADDRESS',
+                        help='measure from each of these local addresses, one per uplink [default: the default route]')
+    parser.add_argument('-t', '--threads', type=int,
+                        help='download and upload threads, 1 for a single threaded test')
+    parser.add_argument('-p', '--parallel', action='store_true', default=False,
+                        help='measure download and upload of all servers and addresses at once '
+                             'instead of one after another')
+    parser.add_argument('--sinks', nargs='+', choices=SINKS, default=list(SINKS), metavar='SINK',
+                        help=f'outputs to write, of {", ".join(SINKS)} [default: all]')
+    parser.add_argument('--db', default=DB_PATH, help=f'sqlite database [default: {DB_PATH}]')
+    parser.add_argument('--jsonl', default=JSONL_PATH,
+                        help=f'json lines archive, a strftime pattern [default: {JSONL_PATH}]'.replace('%', '%%'))
+    parser.add_argument('--csv', default=CSV_PATH, help=f'csv file [default: {CSV_PATH}]')
+    parser.add_argument('--html', default=HTML_PATH, help=f'page of the latest results [default: {HTML_PATH}]')
+    parser.add_argument('--backfill', nargs='+', metavar='FILE',
+                        help='instead of measuring, write the results of these json or .jsonl files to the sinks, '
+                             'skipping those the database has already')
+    args = parser.parse_args()
+
+    lock_file = lock(args.lock)
+    if lock_file is None:
+        print(f'another run holds {args.lock}, skipping this one', file=sys.stderr)
+        return 1
+    with lock_file:
+        if args.backfill:
+            if 'db' not in args.sinks:
+                print('without the db sink results written before are not recognized, '
+                      'running this backfill again will write them again', file=sys.stderr)
+            with Pipeline(args.sinks, args) as pipeline:
+                count, written = backfill(args.backfill, pipeline)
+            print(f'{count} results read, {written} new ones written')
+            return 0
+        if args.daemon:
+            try:
+                daemon(args)
+            except KeyboardInterrupt:
+                pass
+            return 0
+        if args.servers or args.source or args.threads:
+            results = run_all(make_runners(args.servers, args.source, args.threads), args.parallel)
+        else:
+            results = [get_speedtest()]
+        if not results:
+            return 1
+        with Pipeline(args.sinks, args) as pipeline:
+            pipeline(results)
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
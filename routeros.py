@@ -0,0 +1,251 @@
+import re
+from dataclasses import dataclass, fields
+from functools import total_ordering
+
+'''
+Parsing of RouterOS cli output into typed records. Handles the default
+`print` detail layout (key: value lines), `print as-value` output
+(key=value;key=value) and `print terse` lists, so callers never index
+into split() output. RouterOSVersion compares versions numerically and
+knows about beta/rc builds and release channels.
+'''
+
+# Pre-release stages sort before the final release of the same number
+STAGES = {'alpha': 0, 'beta': 1, 'rc': 2, '': 3}
+
+# Channel a version belongs to when the output does not say it explicitly
+STAGE_CHANNELS = {'alpha': 'development', 'beta': 'development', 'rc': 'testing', '': 'stable'}
+
+# Multipliers of the size units RouterOS prints, e.g. 2.5MiB
+SIZE_UNITS = {'': 1, 'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+# Seconds of the units in uptime values, e.g. 1w2d3h4m5s
+UPTIME_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+size_pattern = re.compile(r'^\s*([\d.]+)\s*(B|KiB|MiB|GiB)?\s*$')
+version_pattern = re.compile(r'^\s*(\d+(?:\.\d+)*)(?:(alpha|beta|rc)(\d*))?\s*(?:\((.+?)\))?\s*$')
+uptime_pattern = re.compile(r'(\d+)(ms|[wdhms])')
+clock_pattern = re.compile(r'(\d+):(\d+):(\d+)$')
+detail_pattern = re.compile(r'^\s*([\w.-]+): ?(.*?)\s*$')
+terse_pattern = re.compile(r'([\w.-]+)=("(?:[^"\\]|\\.)*"|.*?)(?=\s+[\w.-]+=|\s*$)')
+
+
+@total_ordering
+@dataclass(frozen=True, eq=False)
+class RouterOSVersion():
+    '''
+    RouterOS or routerboard firmware version, e.g. 6.48.6, 7.10, 7.11rc2,
+    "7.9.2 (stable)". 7.10 > 7.9 and 7.11rc2 < 7.11
+    '''
+    numbers: tuple
+    stage: str = ''
+    stage_number: int = 0
+    channel: str = None
+
+    @classmethod
+    def parse(cls, text):
+        match = version_pattern.match(text)
+        if not match:
+            raise ValueError(f'not a RouterOS version: {text!r}')
+        numbers, stage, stage_number, channel = match.groups()
+        stage = stage or ''
+        return cls(tuple(int(number) for number in numbers.split('.')), stage,
+                   int(stage_number or 0), channel or STAGE_CHANNELS[stage])
+
+    @property
+    def key(self):
+        numbers = self.numbers + (0,) * (3 - len(self.numbers))
+        return numbers, STAGES[self.stage], self.stage_number
+
+    @property
+    def major(self):
+        return self.numbers[0]
+
+    def __eq__(self, other):
+        if not isinstance(other, RouterOSVersion):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __lt__(self, other):
+        if not isinstance(other, RouterOSVersion):
+            return NotImplemented
+        return self.key < other.key
+
+    def __str__(self):
+        text = '.'.join(str(number) for number in self.numbers)
+        if self.stage:
+            text += f'{self.stage}{self.stage_number or ""}'
+        return text
+
+
+def parse_version(text):
+    '''
+    RouterOSVersion or None for empty and unparsable values
+    '''
+    try:
+        return RouterOSVersion.parse(text) if text else None
+    except ValueError:
+        return None
+
+
+def parse_size(text):
+    '''
+    Size in bytes from values like 2.5MiB, or None
+    '''
+    match = size_pattern.match(text or '')
+    if not match:
+        return None
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit or ''])
+
+
+def parse_uptime(text):
+    '''
+    Seconds from uptime values like 1w2d3h4m5s or the older 2d03:04:05, or None
+    '''
+    text = (text or '').strip()
+    clock = clock_pattern.search(text)
+    if clock:
+        hours, minutes, seconds = (int(value) for value in clock.groups())
+        text = text[:clock.start()]
+    else:
+        hours = minutes = seconds = 0
+    parts = uptime_pattern.findall(text)
+    if not clock and not parts or uptime_pattern.sub('', text):
+        return None
+    return hours * 3600 + minutes * 60 + seconds + sum(int(number) * UPTIME_UNITS[unit] for number, unit in parts)
+
+
+def parse_print(text):
+    '''
+    Parse `print` detail output, one "key: value" per line, into a dict.
+    Lines without a key continue the previous value
+    '''
+    result = {}
+    key = None
+    for line in text.splitlines():
+        match = detail_pattern.match(line)
+        if match:
+            key, value = match.groups()
+            result[key] = value
+        elif key and line.strip():
+            result[key] += ' ' + line.strip()
+    return result
+
+
+def parse_as_value(text):
+    '''
+    Parse `:put [print as-value]` output: key=value pairs separated by ';'
+    '''
+    result = {}
+    for pair in text.strip().split(';'):
+        key, sep, value = pair.partition('=')
+        if sep:
+            result[key.lstrip('.')] = value
+    return result
+
+
+def parse_terse(text):
+    '''
+    Parse `print terse` output, one item per line, into a list of dicts
+    '''
+    items = []
+    for line in text.splitlines():
+        pairs = terse_pattern.findall(line)
+        if pairs:
+            items.append({key: value.strip('"') for key, value in pairs})
+    return items
+
+
+def parse_any(text):
+    '''
+    Parse single item output in any of the supported layouts
+    '''
+    if ': ' not in text and '=' in text and ';' in text:
+        return parse_as_value(text)
+    if ': ' not in text and '=' in text:
+        items = parse_terse(text)
+        return items[0] if items else {}
+    return parse_print(text)
+
+
+class Record():
+    '''
+    Base for typed records, fields are the cli keys with '-' replaced by '_'.
+    Fields annotated as RouterOSVersion are parsed into versions
+    '''
+    @classmethod
+    def from_dict(cls, data):
+        values = {}
+        for item in fields(cls):
+            value = data.get(item.name.replace('_', '-'))
+            if item.type is RouterOSVersion:
+                value = parse_version(value)
+            values[item.name] = value
+        return cls(**values)
+
+    @classmethod
+    def from_output(cls, text):
+        return cls.from_dict(parse_any(text))
+
+
+@dataclass
+class PackageUpdate(Record):
+    '''
+    `system package update print` and `check-for-updates` output
+    '''
+    channel: str = None
+    installed_version: RouterOSVersion = None
+    latest_version: RouterOSVersion = None
+    status: str = None
+
+    @property
+    def update_available(self):
+        if self.status and 'New version is available' in self.status:
+            return True
+        return bool(self.latest_version and self.installed_version
+                    and self.latest_version > self.installed_version)
+
+
+@dataclass
+class Routerboard(Record):
+    '''
+    `system routerboard print` output
+    '''
+    routerboard: str = None
+    board_name: str = None
+    model: str = None
+    revision: str = None
+    serial_number: str = None
+    firmware_type: str = None
+    factory_firmware: RouterOSVersion = None
+    current_firmware: RouterOSVersion = None
+    upgrade_firmware: RouterOSVersion = None
+
+    @property
+    def upgrade_needed(self):
+        return bool(self.current_firmware and self.upgrade_firmware
+                    and self.current_firmware != self.upgrade_firmware)
+
+
+@dataclass
+class Resource(Record):
+    '''
+    `system resource print` output
+    '''
+    version: RouterOSVersion = None
+    architecture_name: str = None
+    board_name: str = None
+    free_hdd_space: str = None
+    uptime: str = None
+
+    @property
+    def free_space(self):
+        return parse_size(self.free_hdd_space)
+
+    @property
+    def uptime_seconds(self):
+        return parse_uptime(self.uptime)